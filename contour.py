@@ -0,0 +1,527 @@
+
+# Contour extraction from images.
+#
+# get_pixel_outlines() follows the edges between pixels of binary images.
+#
+# get_contours() is for anti-aliased coverage images, using marching
+# squares. Each pixel's value is a sample at its center, and contour
+# vertices are placed where the linear interpolation between two
+# neighboring samples crosses the iso level, so they land at fractional
+# positions instead of on pixel corners.
+#
+# Pixel (x,y) covers the square from (x,y) to (x+1,y+1). Paths go with the
+# inside of the shape on the side of the reciprocal() of their edges.
+
+import numpy as np
+
+from vector import Vector2
+
+# Cell corners, as (x,y) within the cell, and their bit in the case index.
+CORNERS = [(0, 0), (1, 0), (1, 1), (0, 1)]
+
+# Cell edges, as pairs of indices into CORNERS: top, right, bottom, left.
+EDGES = [(0, 1), (1, 2), (3, 2), (0, 3)]
+TOP, RIGHT, BOTTOM, LEFT = range(4)
+
+# Unoriented segments for each case of inside corners. The two saddle cases
+# list the segments for when the cell's center is outside, then inside.
+SEGMENTS = {
+    0: [],
+    1: [(LEFT, TOP)],
+    2: [(TOP, RIGHT)],
+    3: [(LEFT, RIGHT)],
+    4: [(RIGHT, BOTTOM)],
+    5: ([(LEFT, TOP), (RIGHT, BOTTOM)], [(TOP, RIGHT), (BOTTOM, LEFT)]),
+    6: [(TOP, BOTTOM)],
+    7: [(LEFT, BOTTOM)],
+    8: [(BOTTOM, LEFT)],
+    9: [(TOP, BOTTOM)],
+    10: ([(TOP, RIGHT), (BOTTOM, LEFT)], [(LEFT, TOP), (RIGHT, BOTTOM)]),
+    11: [(RIGHT, BOTTOM)],
+    12: [(LEFT, RIGHT)],
+    13: [(TOP, RIGHT)],
+    14: [(LEFT, TOP)],
+    15: [],
+}
+
+# Midpoint of an edge in the cell.
+def edge_midpoint(edge):
+    (x0, y0), (x1, y1) = [CORNERS[corner] for corner in EDGES[edge]]
+    return (x0 + x1)/2.0, (y0 + y1)/2.0
+
+# Orient the segment so that the inside corners are on its right (in image
+# coordinates, with Y down), which makes every crossing have exactly one
+# segment leaving it.
+def orient(segment, case):
+    a, b = segment
+    ax, ay = edge_midpoint(a)
+    bx, by = edge_midpoint(b)
+
+    # A corner on one side of the segment: the one the edges share, or the
+    # first corner of the first edge if they're opposite.
+    shared = set(EDGES[a]) & set(EDGES[b])
+    corner = shared.pop() if shared else EDGES[a][0]
+    cx, cy = CORNERS[corner]
+
+    on_right = (bx - ax)*(cy - ay) - (by - ay)*(cx - ax) > 0
+    inside = (case >> corner) & 1 == 1
+    return (a, b) if on_right == inside else (b, a)
+
+# Oriented segments for each (case, center inside) pair.
+def make_table():
+    table = {}
+    for case, segments in SEGMENTS.items():
+        for center_inside in (False, True):
+            if isinstance(segments, tuple):
+                chosen = segments[1 if center_inside else 0]
+            else:
+                chosen = segments
+            table[case, center_inside] = [orient(segment, case) for segment in chosen]
+    return table
+
+TABLE = make_table()
+
+# Directions of pixel edges. The inside is on the side of the next one.
+EAST, SOUTH, WEST, NORTH = range(4)
+
+# Return a list of paths of Vector2 along the edges between the pixels of
+# the 2D boolean array that are set and those that aren't, and a list of
+# whether each path is around a hole, that is, runs around an area that
+# isn't set. Closed paths have their first vertex repeated at their end.
+# Paths of areas that touch the edge of the image stop there, and edges
+# along the last row and column of pixels aren't followed. Diagonally
+# touching pixels are in separate paths. Vertices are only where the paths
+# turn.
+def get_pixel_outlines(mask):
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+    stride = width + 1
+
+    # Edges right of pixels, going south when the pixel is set and north
+    # when the pixel after it is.
+    ys, xs = np.nonzero(mask[:-1,:-1] != mask[:-1,1:])
+    south = mask[ys, xs]
+    top = ys*stride + xs + 1
+    vertical_from = np.where(south, top, top + stride)
+    vertical_to = np.where(south, top + stride, top)
+    vertical_direction = np.where(south, SOUTH, NORTH)
+
+    # Edges below pixels, going west when the pixel is set and east when the
+    # pixel below it is.
+    ys, xs = np.nonzero(mask[:-1,:-1] != mask[1:,:-1])
+    west = mask[ys, xs]
+    left = (ys + 1)*stride + xs
+    horizontal_from = np.where(west, left + 1, left)
+    horizontal_to = np.where(west, left, left + 1)
+    horizontal_direction = np.where(west, WEST, EAST)
+
+    edge_from = np.concatenate((vertical_from, horizontal_from))
+    edge_to = np.concatenate((vertical_to, horizontal_to))
+    direction = np.concatenate((vertical_direction, horizontal_direction))
+    edge_count = len(edge_from)
+
+    # The edges leaving each vertex. Only vertices where two areas touch
+    # diagonally have two.
+    order = np.argsort(edge_from, kind="mergesort")
+    first_out = np.full(stride*(height + 1), -1, dtype=np.int64)
+    second_out = np.full(stride*(height + 1), -1, dtype=np.int64)
+    first_out[edge_from[order[::-1]]] = order[::-1]
+    second = order[1:][edge_from[order[1:]] == edge_from[order[:-1]]]
+    second_out[edge_from[second]] = second
+
+    # The edge after each one. Where there are two, turn towards the inside
+    # so diagonally touching areas stay apart.
+    a = first_out[edge_to]
+    b = second_out[edge_to]
+    turn = (direction + 1) % 4
+    next_edge = np.where((b == -1) | (direction[a] == turn), a, b)
+
+    has_previous = np.zeros(edge_count, dtype=bool)
+    has_previous[next_edge[next_edge != -1]] = True
+
+    # Follow chains from their first edge, then the loops.
+    starts = np.concatenate((np.nonzero(~has_previous)[0], np.arange(edge_count))).tolist()
+    next_list = next_edge.tolist()
+    used = np.zeros(edge_count, dtype=bool)
+    paths = []
+    holes = []
+    for start in starts:
+        if used[start]:
+            continue
+
+        chain = []
+        edge = start
+        while edge != -1 and not used[edge]:
+            used[edge] = True
+            chain.append(edge)
+            edge = next_list[edge]
+        chain = np.array(chain)
+
+        # Keep the vertices where the direction changes.
+        turns = np.ones(len(chain), dtype=bool)
+        turns[1:] = direction[chain[1:]] != direction[chain[:-1]]
+        vertex_ids = np.append(edge_from[chain[turns]], edge_to[chain[-1]])
+        closed = edge == start
+        if closed and direction[chain[0]] == direction[chain[-1]] and len(vertex_ids) > 2:
+            # Starting in the middle of a side.
+            vertex_ids = np.append(vertex_ids[1:-1], vertex_ids[1])
+
+        vx = vertex_ids % stride
+        vy = vertex_ids // stride
+        paths.append([Vector2(x, y) for x, y in zip(vx.tolist(), vy.tolist())])
+
+        # Areas are positive around set pixels.
+        area = (vx[:-1]*vy[1:] - vx[1:]*vy[:-1]).sum()
+        holes.append(bool(closed and area < 0))
+
+    return paths, holes
+
+# Return the paths that get_pixel_outlines() finds in "mask", given the
+# "paths" it found in a mask that differed only in columns "first_column"
+# to "last_column". Only the pixel edges that those columns can change are
+# found again: the vertical ones on lines "first_column" to
+# "last_column" + 1 and the horizontal ones between them. The rest of the
+# old paths is cut where it meets them, and all the pieces are joined by
+# the same rules as get_pixel_outlines(), so the result is the same as
+# tracing the whole mask, but in a different order. Also returns a list
+# with, for each path, the index of the old path that it is, or -1 if it's
+# new or changed.
+def update_pixel_outlines(paths, mask, first_column, last_column):
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+
+    # Vertex columns where edges can have changed, or start or end at an
+    # edge that has.
+    left = first_column
+    right = last_column + 1
+
+    # The edge that follows another only depends on the edges at the vertex
+    # between them, except on the last row and column of vertices, where
+    # edges aren't followed on one side. There two chains can lead to the
+    # same edge, and the one that get_pixel_outlines() starts first goes on.
+    # Paths that meet a changed one there are changed too, since which one
+    # that is can change.
+    touched = []
+    meeting = {}
+    for index, path in enumerate(paths):
+        xs = [v.x for v in path]
+        if not (max(xs) < left or min(xs) > right):
+            touched.append(index)
+        for v in path:
+            if v.x == width - 1 or v.y == height - 1:
+                meeting.setdefault((v.x, v.y), []).append(index)
+
+    changed = set(touched)
+    while touched:
+        for v in paths[touched.pop()]:
+            for index in meeting.get((v.x, v.y), []):
+                if index not in changed:
+                    changed.add(index)
+                    touched.append(index)
+
+    pieces = get_window_edges(mask, first_column, last_column)
+    new_paths = []
+    kept = []
+    for index, path in enumerate(paths):
+        if index in changed:
+            pieces.extend(get_outside_pieces([(v.x, v.y) for v in path], left, right,
+                width, height))
+        else:
+            new_paths.append(path)
+            kept.append(index)
+
+    for path in join_pieces(pieces):
+        new_paths.append([Vector2(x, y) for x, y in path])
+        kept.append(-1)
+
+    return new_paths, kept
+
+# Return the list of the edges, as [(x,y), (x,y)] pieces oriented like those
+# of get_pixel_outlines(), that columns "first_column" to "last_column" of
+# the mask can change.
+def get_window_edges(mask, first_column, last_column):
+    height, width = mask.shape
+    pieces = []
+
+    # Edges right of pixels, going south when the pixel is set and north
+    # when the pixel after it is.
+    first = max(first_column - 1, 0)
+    last = min(last_column, width - 2)
+    if first <= last:
+        ys, xs = np.nonzero(mask[:-1,first:last + 1] != mask[:-1,first + 1:last + 2])
+        south = mask[ys, xs + first].tolist()
+        for x, y, is_south in zip((xs + first + 1).tolist(), ys.tolist(), south):
+            if is_south:
+                pieces.append([(x, y), (x, y + 1)])
+            else:
+                pieces.append([(x, y + 1), (x, y)])
+
+    # Edges below pixels, going west when the pixel is set and east when the
+    # pixel below it is.
+    first = first_column
+    if first <= last:
+        ys, xs = np.nonzero(mask[:-1,first:last + 1] != mask[1:,first:last + 1])
+        west = mask[ys, xs + first].tolist()
+        for x, y, is_west in zip((xs + first).tolist(), (ys + 1).tolist(), west):
+            if is_west:
+                pieces.append([(x + 1, y), (x, y)])
+            else:
+                pieces.append([(x, y), (x + 1, y)])
+
+    return pieces
+
+# Direction of the step from "a" to "b", (x,y) points on a horizontal or
+# vertical line.
+def get_direction(a, b):
+    if b[0] > a[0]:
+        return EAST
+    elif b[1] > a[1]:
+        return SOUTH
+    elif b[0] < a[0]:
+        return WEST
+    else:
+        return NORTH
+
+# Return the list of the pieces of the pixel outline "path", a list of
+# (x,y) points, that update_pixel_outlines() keeps: the edges that aren't on
+# vertical lines "left" to "right" or horizontally between them. Pieces
+# also end at every vertex on those lines, where the edge that follows may
+# have changed, and on the last row and column of vertices of the
+# "width" by "height" mask, where another chain may now go on instead.
+def get_outside_pieces(path, left, right, width, height):
+    pieces = []
+    piece = []
+    for a, b in zip(path[:-1], path[1:]):
+        if a[0] == b[0]:
+            parts = [(a, b)] if a[0] < left or a[0] > right else []
+        else:
+            low = min(a[0], b[0])
+            high = max(a[0], b[0])
+            parts = []
+            if low < left:
+                parts.append((low, min(high, left)))
+            if high > right:
+                parts.append((max(low, right), high))
+            if b[0] > a[0]:
+                parts = [((x0, a[1]), (x1, a[1])) for x0, x1 in parts]
+            else:
+                parts = [((x1, a[1]), (x0, a[1])) for x0, x1 in reversed(parts)]
+
+        for start, end in parts:
+            if piece and piece[-1] != start:
+                pieces.append(piece)
+                piece = []
+            if not piece:
+                piece = [start]
+            piece.append(end)
+            if left <= end[0] <= right or end[0] == width - 1 or end[1] == height - 1:
+                pieces.append(piece)
+                piece = []
+
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+# Return the paths, lists of (x,y) points, made by joining the pieces end to
+# start, with vertices only where they turn. Where two pieces could follow
+# one, it takes the one that turns towards the inside, chains are followed
+# in the order of their first edges, and loops start where they do in
+# get_pixel_outlines().
+def join_pieces(pieces):
+    starting = {}
+    for index, piece in enumerate(pieces):
+        starting.setdefault(piece[0], []).append(index)
+
+    def get_next(index):
+        piece = pieces[index]
+        candidates = starting.get(piece[-1], [])
+        if len(candidates) == 2:
+            turn = (get_direction(piece[-2], piece[-1]) + 1) % 4
+            if get_direction(pieces[candidates[0]][0], pieces[candidates[0]][1]) != turn:
+                return candidates[1]
+        return candidates[0] if candidates else -1
+
+    next_piece = [get_next(index) for index in range(len(pieces))]
+    has_previous = [False]*len(pieces)
+    for index in next_piece:
+        if index != -1:
+            has_previous[index] = True
+
+    # Chains from their first piece, then the loops.
+    starts = [index for index in range(len(pieces)) if not has_previous[index]]
+    starts.sort(key=lambda index: get_edge_order(pieces[index][0], pieces[index][1]))
+    starts.extend(range(len(pieces)))
+    used = [False]*len(pieces)
+    paths = []
+    for start in starts:
+        if used[start]:
+            continue
+
+        points = []
+        index = start
+        while index != -1 and not used[index]:
+            used[index] = True
+            points.extend(pieces[index] if not points else pieces[index][1:])
+            index = next_piece[index]
+        closed = index == start
+
+        # Keep the vertices where the path turns, and for chains its ends.
+        if closed:
+            points = points[:-1]
+            path = [b for a, b, c in zip(points[-1:] + points[:-1], points, points[1:] + points[:1])
+                    if get_direction(a, b) != get_direction(b, c)]
+            path = get_loop_start(path)
+        else:
+            path = [points[0]]
+            for b, c in zip(points[1:-1], points[2:]):
+                if get_direction(path[-1], b) != get_direction(b, c):
+                    path.append(b)
+            path.append(points[-1])
+        paths.append(path)
+
+    return paths
+
+# Return a key that sorts the first pixel edges on the lines from "a" to
+# "b" in the order that get_pixel_outlines() numbers them: edges right of
+# pixels in row-major order, then edges below pixels in row-major order.
+def get_edge_order(a, b):
+    direction = get_direction(a, b)
+    if direction == SOUTH:
+        return 0, a[1], a[0]
+    elif direction == NORTH:
+        return 0, a[1] - 1, a[0]
+    elif direction == EAST:
+        return 1, a[1], a[0]
+    else:
+        return 1, a[1], a[0] - 1
+
+# Return the loop of (x,y) turning points, given without repeating its
+# first one, starting at the vertex that get_pixel_outlines() starts it at
+# and closed. That traces loops from the first of their edges to the right
+# of pixels in row-major order, and starts at the next turn if the edge
+# before that one goes the same way.
+def get_loop_start(path):
+    best = None
+    for index, (a, b) in enumerate(zip(path, path[1:] + path[:1])):
+        if a[0] == b[0]:
+            key = (min(a[1], b[1]), a[0])
+            if best is None or key < best[0]:
+                # Going north, the first edge is the last one of the side.
+                mid_side = b[1] < a[1] - 1
+                best = key, (index + 1 if mid_side else index) % len(path)
+
+    start = best[1]
+    path = path[start:] + path[:start]
+    return path + path[:1]
+
+# Return a list of paths of Vector2 around the areas of the image (a PIL
+# image or 2D array) whose value is above "level". Closed paths have their
+# first vertex repeated at their end. Paths of areas that touch the edge of
+# the image stop there, like those of get_outlines().
+def get_contours(image, level):
+    samples = np.asarray(image, dtype=np.float64)
+    height, width = samples.shape
+
+    tracer = ContourTracer(width, height, level)
+    tracer.addRows(samples, 0)
+    return tracer.getPaths()
+
+# Traces contours from an image given a band of rows at a time. Consecutive
+# bands must share a row (the last of one is the first of the next), since
+# cells lie between rows. Only the contours themselves are kept, so memory
+# depends on the band size and the length of the contours, not on the size
+# of the image. The paths are the same however the image is split up.
+class ContourTracer(object):
+    def __init__(self, width, height, level):
+        self.width = width
+        self.height = height
+        self.level = level
+
+        # Crossings are numbered by sample edge: horizontal ones (between a
+        # sample and the one to its right) first, then vertical ones.
+        self.vertical_base = width*height
+
+        # Map from crossing to the next crossing along the contour.
+        self.next_crossing = {}
+
+        # Map from crossing to its (x,y) position.
+        self.positions = {}
+
+    # Add the cells between the rows of "samples", a 2D array of the rows of
+    # the image starting at "first_row".
+    def addRows(self, samples, first_row):
+        samples = np.asarray(samples, dtype=np.float64)
+        level = self.level
+        cols = self.width
+        vertical_base = self.vertical_base
+        inside = samples > level
+
+        # Case index of every cell, from its four corners.
+        case = (inside[:-1,:-1]*1 | inside[:-1,1:]*2 | inside[1:,1:]*4 | inside[1:,:-1]*8)
+        center = (samples[:-1,:-1] + samples[:-1,1:] + samples[1:,1:] + samples[1:,:-1])/4 > level
+
+        cell_rows, cell_cols = np.nonzero((case != 0) & (case != 15))
+        cell_cases = case[cell_rows, cell_cols]
+        cell_centers = center[cell_rows, cell_cols]
+        crossings = []
+        for r, c, cell_case, center_inside in zip((cell_rows + first_row).tolist(),
+                cell_cols.tolist(), cell_cases.tolist(), cell_centers.tolist()):
+
+            edge_ids = (r*cols + c,                       # Top.
+                    vertical_base + r*cols + c + 1,       # Right.
+                    (r + 1)*cols + c,                     # Bottom.
+                    vertical_base + r*cols + c)           # Left.
+            for a, b in TABLE[cell_case, center_inside]:
+                self.next_crossing[edge_ids[a]] = edge_ids[b]
+                crossings.append(edge_ids[a])
+                crossings.append(edge_ids[b])
+
+        if crossings:
+            xs, ys = get_positions(np.array(crossings), samples, first_row, level, cols, vertical_base)
+            self.positions.update(zip(crossings, zip(xs.tolist(), ys.tolist())))
+
+    # Return the list of paths of Vector2.
+    def getPaths(self):
+        next_crossing = self.next_crossing
+
+        # Walk the chains that start at the edge of the image, then the loops,
+        # each in order of their first crossing so that the result doesn't
+        # depend on how the map was built.
+        starts = sorted(set(next_crossing) - set(next_crossing.values()))
+        starts.extend(sorted(next_crossing))
+
+        paths = []
+        for start in starts:
+            if start not in next_crossing:
+                continue
+
+            chain = [start]
+            crossing = start
+            while crossing in next_crossing:
+                crossing = next_crossing.pop(crossing)
+                chain.append(crossing)
+            paths.append([Vector2(*self.positions[index]) for index in chain])
+
+        return paths
+
+# Return arrays of the X and Y positions of the crossings, given the samples
+# of the rows starting at "first_row".
+def get_positions(crossings, samples, first_row, level, cols, vertical_base):
+    vertical = crossings >= vertical_base
+    index = np.where(vertical, crossings - vertical_base, crossings)
+    r = index // cols
+    c = index % cols
+
+    # The second sample of each edge.
+    r2 = r + vertical.astype(int)
+    c2 = c + (~vertical).astype(int)
+
+    v1 = samples[r - first_row, c]
+    v2 = samples[r2 - first_row, c2]
+    t = (level - v1)/(v2 - v1)
+
+    # Sample (r,c) is the center of pixel (c,r).
+    xs = c + 0.5 + np.where(vertical, 0, t)
+    ys = r + 0.5 + np.where(vertical, t, 0)
+
+    return xs, ys
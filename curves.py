@@ -0,0 +1,349 @@
+# Fitting of lines, circular arcs and cubic Bezier curves to polylines, so
+# that smooth outlines take a handful of curves instead of hundreds of short
+# straight segments. Curves are fitted between the corners of a polyline and
+# split where they don't fit, as in Philip Schneider's "An Algorithm for
+# Automatically Fitting Digitized Curves" (Graphics Gems, 1990). A fit is
+# accepted when every vertex of the polyline is within the tolerance of the
+# curve and every point of the curve is within the tolerance of the polyline.
+
+import math
+
+import numpy as np
+
+from vector import Vector2
+
+# Vertices where a path turns by more than this, in radians, are corners.
+# Curves don't go around them.
+CORNER_ANGLE = math.radians(60)
+
+# Turns next to edges shorter than this many times the tolerance are noise,
+# like the steps along the outlines of pixels, not corners.
+CORNER_EDGE_TOLERANCES = 4
+
+# Times the parameters of the points are improved with Newton's method
+# before giving up on fitting a cubic curve to them.
+REPARAMETERIZE_COUNT = 4
+
+# Points along a curve per vertex of the polyline it's tested against.
+SAMPLES_PER_VERTEX = 8
+
+# Most vertices that one curve is fitted to. Longer runs are split first,
+# which bounds the time and memory that testing a fit takes.
+MAX_FIT_VERTICES = 64
+
+# Kinds of segments.
+LINE, ARC, CUBIC = range(3)
+
+# A path of lines, circular arcs and cubic Bezier curves, each starting
+# where the previous one ends.
+class CurvePath(object):
+    def __init__(self, start):
+        self.start = start
+
+        # List of (LINE, end), (ARC, center, sweep, end) and (CUBIC,
+        # control1, control2, end) tuples. Points are Vector2. The sweep is
+        # in radians, positive from the X axis towards the Y axis.
+        self.segments = []
+
+    def lineTo(self, end):
+        self.segments.append((LINE, end))
+
+    def arcTo(self, center, sweep, end):
+        self.segments.append((ARC, center, sweep, end))
+
+    def curveTo(self, control1, control2, end):
+        self.segments.append((CUBIC, control1, control2, end))
+
+    # Number of segments of the kind, LINE, ARC or CUBIC.
+    def getSegmentCount(self, kind):
+        return sum(1 for segment in self.segments if segment[0] == kind)
+
+    # Return the path as a list of Vector2, with the curves replaced by
+    # chords that are at most "tolerance" away from them.
+    def tessellate(self, tolerance):
+        points = [self.start]
+        for segment in self.segments:
+            kind = segment[0]
+            if kind == LINE:
+                points.append(segment[1])
+            elif kind == ARC:
+                points.extend(tessellate_arc(points[-1], segment[1], segment[2], segment[3], tolerance))
+            else:
+                points.extend(tessellate_cubic(points[-1], segment[1], segment[2], segment[3], tolerance))
+
+        return points
+
+# Return the points after "start" of chords along the arc around "center"
+# by "sweep" radians, ending exactly at "end".
+def tessellate_arc(start, center, sweep, end, tolerance):
+    radius = (start - center).length()
+    if tolerance < radius:
+        # Angle of a chord that's "tolerance" away from the circle at its middle.
+        step = 2*math.acos(1 - tolerance/radius)
+        count = max(int(math.ceil(abs(sweep)/step)), 1)
+    else:
+        count = 1
+
+    first_angle = (start - center).angle()
+    points = []
+    for i in range(1, count):
+        angle = first_angle + sweep*i/count
+        points.append(center + Vector2(math.cos(angle), math.sin(angle))*radius)
+    points.append(end)
+
+    return points
+
+# Return the points after "start" of chords along the cubic curve, split in
+# half until its control points are within "tolerance" of its chord. The
+# curve never strays farther from its chord than its control points do.
+def tessellate_cubic(start, control1, control2, end, tolerance):
+    points = []
+    stack = [(start, control1, control2, end)]
+    while stack:
+        p0, p1, p2, p3 = stack.pop()
+        if (get_line_distance(p1, p0, p3) <= tolerance and
+                get_line_distance(p2, p0, p3) <= tolerance):
+            points.append(p3)
+        else:
+            # De Casteljau.
+            p01 = (p0 + p1)*0.5
+            p12 = (p1 + p2)*0.5
+            p23 = (p2 + p3)*0.5
+            p012 = (p01 + p12)*0.5
+            p123 = (p12 + p23)*0.5
+            middle = (p012 + p123)*0.5
+            stack.append((middle, p123, p23, p3))
+            stack.append((p0, p01, p012, middle))
+
+    return points
+
+# Return the distance from "v" to the segment from "v1" to "v2".
+def get_line_distance(v, v1, v2):
+    segment = v2 - v1
+    length2 = segment.dot(segment)
+    if length2 == 0:
+        return (v - v1).length()
+
+    t = min(max((v - v1).dot(segment)/length2, 0), 1)
+    return (v - (v1 + segment*t)).length()
+
+# Return a CurvePath that follows the path, a list of Vector2, within
+# "tolerance".
+def fit_path(vertices, tolerance):
+    points = np.array([(v.x, v.y) for v in vertices], dtype=np.float64).reshape(-1, 2)
+
+    # Repeated points have no direction.
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (points[1:] != points[:-1]).any(axis=1)
+    points = points[keep]
+
+    path = CurvePath(vertices[0])
+    corners = get_corners(points, tolerance)
+    for first, last in zip(corners[:-1], corners[1:]):
+        fit_run(path, points[first:last + 1], tolerance)
+
+    return path
+
+# Return the list of the indices of the ends and the corners of the (N,2)
+# array of points.
+def get_corners(points, tolerance):
+    if len(points) < 3:
+        return range(len(points))
+
+    edges = points[1:] - points[:-1]
+    cross = edges[:-1,0]*edges[1:,1] - edges[:-1,1]*edges[1:,0]
+    dot = (edges[:-1]*edges[1:]).sum(axis=1)
+    turns = np.abs(np.arctan2(cross, dot))
+    long_edges = np.sqrt((edges*edges).sum(axis=1)) >= CORNER_EDGE_TOLERANCES*tolerance
+    corners = (turns > CORNER_ANGLE) & long_edges[:-1] & long_edges[1:]
+
+    return [0] + (np.nonzero(corners)[0] + 1).tolist() + [len(points) - 1]
+
+# Add segments to the path from the first of the (N,2) array of points,
+# where the path already is, to the last.
+def fit_run(path, points, tolerance):
+    last = len(points) - 1
+
+    # Ranges of points left to fit, as (first, last, tangent at the first
+    # point towards the rest, tangent at the last point towards the rest).
+    ranges = [(0, last, get_unit(points[1] - points[0]), get_unit(points[last - 1] - points[last]))]
+    while ranges:
+        first, last, tangent1, tangent2 = ranges.pop()
+        run = points[first:last + 1]
+        end = Vector2(*points[last].tolist())
+
+        if get_distances(run, run[[0, -1]]).max() <= tolerance and (run[0] != run[-1]).any():
+            path.lineTo(end)
+            continue
+
+        # A closed or long run is split in the middle.
+        split = len(run)//2
+        if (run[0] != run[-1]).any() and len(run) <= MAX_FIT_VERTICES:
+            arc = get_arc(run, tolerance)
+            if arc is not None:
+                center, sweep = arc
+                path.arcTo(center, sweep, end)
+                continue
+
+            controls, split = get_cubic(run, tangent1, tangent2, tolerance)
+            if controls is not None:
+                path.curveTo(controls[0], controls[1], end)
+                continue
+
+        # Split the range where it fits worst, smoothly.
+        split += first
+        tangent = points[split + 1] - points[split - 1]
+        if not tangent.any():
+            tangent = points[split] - points[split - 1]
+        tangent = get_unit(tangent)
+        ranges.append((split, last, tangent, tangent2))
+        ranges.append((first, split, tangent1, -tangent))
+
+# Return the vector scaled to unit length.
+def get_unit(vector):
+    return vector/math.hypot(vector[0], vector[1])
+
+# Return the center (Vector2) and sweep of a circular arc from the first to
+# the last of the (N,2) array of points, through the point half-way along
+# them, or None if it's not within "tolerance" of them.
+def get_arc(points, tolerance):
+    p0 = points[0]
+    p2 = points[-1]
+    lengths = np.append(0, np.cumsum(np.sqrt(((points[1:] - points[:-1])**2).sum(axis=1))))
+    middle = min(max(np.searchsorted(lengths, lengths[-1]/2), 1), len(points) - 2)
+    p1 = points[middle]
+
+    # Center of the circle through the three points.
+    a = p1 - p0
+    b = p2 - p0
+    det = 2*(a[0]*b[1] - a[1]*b[0])
+    if abs(det) < 1e-12:
+        return None
+    a2 = (a*a).sum()
+    b2 = (b*b).sum()
+    center = p0 + np.array([b[1]*a2 - a[1]*b2, a[0]*b2 - b[0]*a2])/det
+    radius = math.hypot(*(p0 - center))
+
+    # Go around the same way as from p0 to p1 to p2.
+    start = math.atan2(p0[1] - center[1], p0[0] - center[0])
+    finish = math.atan2(p2[1] - center[1], p2[0] - center[0])
+    if det > 0:
+        sweep = (finish - start) % (2*math.pi)
+    else:
+        sweep = -((start - finish) % (2*math.pi))
+
+    count = max(len(points)*SAMPLES_PER_VERTEX, 16)
+    angles = start + sweep*np.arange(count + 1)/float(count)
+    samples = center + radius*np.column_stack((np.cos(angles), np.sin(angles)))
+    if not is_within(points, samples, tolerance):
+        return None
+
+    return Vector2(*center.tolist()), sweep
+
+# Return a pair of the control points (Vector2) of a cubic curve from the
+# first to the last of the (N,2) array of points, leaving them along the
+# tangents, and the index of the point that's farthest from the curve. The
+# control points are None if the curve is not within "tolerance" of the
+# points.
+def get_cubic(points, tangent1, tangent2, tolerance):
+    # Start with the points' parameters proportional to their distance along
+    # the polyline.
+    lengths = np.append(0, np.cumsum(np.sqrt(((points[1:] - points[:-1])**2).sum(axis=1))))
+    u = lengths/lengths[-1]
+
+    count = max(len(points)*SAMPLES_PER_VERTEX, 16)
+    t = np.arange(count + 1)/float(count)
+    split = None
+    for iteration in range(REPARAMETERIZE_COUNT + 1):
+        controls = get_cubic_controls(points, u, tangent1, tangent2)
+        samples = get_bezier_points(controls, t)
+        if is_within(points, samples, tolerance):
+            return [Vector2(*c.tolist()) for c in controls[1:3]], None
+
+        if split is None:
+            # Only the first fit, since later ones don't always improve.
+            distances = get_distances(points[1:-1], samples)
+            split = np.argmax(distances) + 1
+
+        u = get_better_parameters(controls, points, u)
+
+    return None, split
+
+# Return the (4,2) array of the control points of the cubic curve from the
+# first to the last of the points that best fits the points at parameters
+# "u", with its inner control points along the tangents.
+def get_cubic_controls(points, u, tangent1, tangent2):
+    p0 = points[0]
+    p3 = points[-1]
+    b0 = (1 - u)**3
+    b1 = 3*u*(1 - u)**2
+    b2 = 3*u**2*(1 - u)
+    b3 = u**3
+
+    # Least squares for the distances of the inner control points along the tangents.
+    a1 = b1[:,np.newaxis]*tangent1
+    a2 = b2[:,np.newaxis]*tangent2
+    c00 = (a1*a1).sum()
+    c01 = (a1*a2).sum()
+    c11 = (a2*a2).sum()
+    rest = points - (p0*(b0 + b1)[:,np.newaxis] + p3*(b2 + b3)[:,np.newaxis])
+    x0 = (a1*rest).sum()
+    x1 = (a2*rest).sum()
+    det = c00*c11 - c01*c01
+
+    chord = math.hypot(*(p3 - p0))
+    alpha1 = alpha2 = 0
+    if abs(det) > 1e-12*chord**4:
+        alpha1 = (x0*c11 - x1*c01)/det
+        alpha2 = (c00*x1 - c01*x0)/det
+
+    # Fall back to a third of the chord when the fit puts the control
+    # points backwards or on the ends.
+    if alpha1 < 1e-6*chord or alpha2 < 1e-6*chord:
+        alpha1 = alpha2 = chord/3
+
+    return np.array([p0, p0 + tangent1*alpha1, p3 + tangent2*alpha2, p3])
+
+# Return the (N,2) array of the points of the cubic curve at parameters "t".
+def get_bezier_points(controls, t):
+    t = t[:,np.newaxis]
+    return ((1 - t)**3*controls[0] + 3*t*(1 - t)**2*controls[1] +
+            3*t**2*(1 - t)*controls[2] + t**3*controls[3])
+
+# Return the parameters "u" of the points improved by a step of Newton's
+# method towards the nearest point of the curve.
+def get_better_parameters(controls, points, u):
+    first = 3*(controls[1:] - controls[:-1])
+    second = 2*(first[1:] - first[:-1])
+
+    q = get_bezier_points(controls, u)
+    uc = u[:,np.newaxis]
+    q1 = (1 - uc)**2*first[0] + 2*uc*(1 - uc)*first[1] + uc**2*first[2]
+    q2 = (1 - uc)*second[0] + uc*second[1]
+
+    difference = q - points
+    numerator = (difference*q1).sum(axis=1)
+    denominator = (q1*q1).sum(axis=1) + (difference*q2).sum(axis=1)
+    step = np.where(denominator != 0, numerator/np.where(denominator != 0, denominator, 1), 0)
+
+    return np.clip(u - step, 0, 1)
+
+# Return whether each of the (N,2) array of points is within "tolerance" of
+# the polyline through the (M,2) array of samples, and the other way around.
+def is_within(points, samples, tolerance):
+    return (get_distances(points, samples).max() <= tolerance and
+            get_distances(samples, points).max() <= tolerance)
+
+# Return the distances from each of the (N,2) array of points to the nearest
+# segment of the polyline through the (M,2) array of vertices.
+def get_distances(points, vertices):
+    a = vertices[:-1]
+    segments = vertices[1:] - a
+    length2 = (segments*segments).sum(axis=1)
+    length2[length2 == 0] = 1
+
+    offsets = points[:,np.newaxis,:] - a[np.newaxis,:,:]
+    t = np.clip((offsets*segments).sum(axis=2)/length2, 0, 1)
+    closest = offsets - t[:,:,np.newaxis]*segments
+
+    return np.sqrt((closest*closest).sum(axis=2)).min(axis=1)
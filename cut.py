@@ -1,4 +1,6 @@
 
+import numpy as np
+
 # Encapsulates a single continuous cut to be printed to the laser printer.
 class Cut(object):
     def __init__(self, speed, power, frequency):
@@ -6,7 +8,7 @@ class Cut(object):
         self.power = power
         self.frequency = frequency
 
-        # Array of Vector2D objects.
+        # Array of Vector2D objects, or (N,2) array of X and Y.
         self.points = []
 
     def getSpeed(self):
@@ -18,15 +20,11 @@ class Cut(object):
     def getFrequency(self):
         return self.frequency
 
-    def getSpans(self, maxPoints):
-        spans = []
-        points = self.points[:]
-
-        while points:
-            spans.append(points[:maxPoints])
-
-            # Overlap by one point.
-            points = points[maxPoints - 1:]
-
-        return spans
+    # The (N,2) int array of the points, truncated to whole units.
+    def getPointArray(self):
+        if isinstance(self.points, np.ndarray):
+            points = self.points
+        else:
+            points = np.array([(p.x, p.y) for p in self.points], dtype=np.float64)
 
+        return points.reshape(-1, 2).astype(np.int64)
@@ -6,9 +6,28 @@
 
 import math
 
+import numpy as np
+
 # Output for the Epilog Fusion. If false then it's the Epilog Helix.
 FUSION = True
 
+# Number of scanlines after which a raster is ended and started again.
+RASTER_RESTART_ROWS = 388
+
+# Longest literal or repeated run of a TIFF (PackBits) compressed row.
+MAX_PACKBITS_RUN = 128
+
+# Shortest run of repeated bytes that's worth encoding as a repeat. Shorter
+# ones are added to the literals around them.
+MIN_PACKBITS_REPEAT = 3
+
+# Most points in one pen-down command. Cuts are split into spans of this
+# many points, overlapping by one.
+MAX_SPAN_POINTS = 100
+
+# Whether to print each cut as it's generated.
+VERBOSE = False
+
 
 SEP = ";"
 
@@ -261,8 +280,7 @@ def generate_prn(out, doc):
         out.write(V_INIT)
         out.write(SEP)
 
-        for cut in doc.getCuts():
-            generate_cut(out, cut)
+        generate_cuts(out, doc.getCuts())
 
         # Footer for the cut.
         out.write(HPGL_END)
@@ -283,85 +301,235 @@ def generate_prn(out, doc):
     out.flush()
 
 def generate_raster(out, raster):
-    # Raster direction.
-    out.write(R_DIRECTION % 0)
+    # Each row of the image packed to bits, with the zero bytes at either
+    # end trimmed off. Rows with nothing to engrave are skipped.
+    rows, lefts, row_lengths = pack_raster_rows(raster.image)
+    data, packed_lengths = compress_packbits(rows, lefts, row_lengths)
 
-    # Start this raster.
-    out.write(R_START)
+    parts = []
+    position = 0
+    row_count = 0
+    for row, (left, row_length, packed_length) in enumerate(
+            zip(lefts.tolist(), row_lengths.tolist(), packed_lengths.tolist())):
 
-    # Size of image.
-    width, height = raster.image.size
+        if row_length == 0:
+            continue
 
-    for row in range(height):
-        # We're always doing the top-down direction.
-        y = raster.y + row
+        # Restart the raster every RASTER_RESTART_ROWS scanlines.
+        if row_count % RASTER_RESTART_ROWS == 0:
+            if row_count > 0:
+                parts.append(R_END)
 
-        out.write(PCL_POS_Y % y)
-        out.write(PCL_POS_X % raster.x)
+            # Raster direction. We're always doing the top-down direction.
+            parts.append(R_DIRECTION % 0)
 
-        # XXX Restart (R_END - DIR - START) every 388 scanlines.
+            # Start this raster.
+            parts.append(R_START)
+        row_count += 1
 
-        # Width of image in bytes.
-        width_in_bytes = (width + 7) / 8
+        parts.append(PCL_POS_Y % (raster.y + row))
+        parts.append(PCL_POS_X % (raster.x + left*8))
 
-        buf = ""
-        for byte_index in range(width_in_bytes):
-            begin_col = byte_index*8
-            end_col = min((byte_index + 1)*8, width)
+        # Pad to multiple of 8 with no-op bytes.
+        padding = -packed_length % 8
 
-            bit = 128
-            ch = 0
-            for col in range(begin_col, end_col):
-                p = raster.image.getpixel((col, row))
-                if p > 128:
-                    ch |= bit
-                bit /= 2
-            buf += chr(ch)
-
-        # Literal length.
-        buf = chr(len(buf) - 1) + buf
-
-        # Pad to multiple of 8.
-        while len(buf) % 8 != 0:
-            buf += chr(0x80)
-
-        out.write(R_ROW_UNPACKED_BYTES % width_in_bytes)
-        out.write(R_ROW_PACKED_BYTES % len(buf))
-        out.write(buf)
+        parts.append(R_ROW_UNPACKED_BYTES % row_length)
+        parts.append(R_ROW_PACKED_BYTES % (packed_length + padding))
+        parts.append(data[position:position + packed_length])
+        parts.append(chr(0x80)*padding)
+        position += packed_length
 
     # End this raster.
-    out.write(R_END)
-
-def generate_cut(out, cut):
-    power_set = cut.getPower()
-    speed_set = cut.getSpeed()
-    freq_set = cut.getFrequency()
-
-    # We cut the points into spans of at most 100 points.
-    for spanIndex, points in enumerate(cut.getSpans(100)):
-        print "Span %d with %d points" % (spanIndex, len(points))
-
-        out.write(V_POWER % power_set)
-        out.write(SEP)
-        out.write(V_SPEED % speed_set)
-        out.write(SEP)
-        out.write(V_FREQUENCY % freq_set)
-        out.write(SEP)
-        out.write(V_UNKNOWN1)
-        out.write(SEP)
-        out.write(V_UNKNOWN2)
-        out.write(SEP)
-        out.write(HPGL_LINE_TYPE)
-
-        # Move to the first point.
-        firstPoint = points[0]
-        out.write(HPGL_PEN_UP)
-        out.write("%d,%d" % (firstPoint.x, firstPoint.y))
-        out.write(SEP)
-
-        # Draw the rest of the points.
-        restPoints = points[1:]
-        out.write(HPGL_PEN_DOWN)
-        out.write(",".join("%d,%d" % (p.x, p.y) for p in restPoints))
-        out.write(SEP)
-
+    if row_count > 0:
+        parts.append(R_END)
+
+    out.write("".join(parts))
+
+# Return the (H,W/8) uint8 array of the rows of the image packed to bits
+# (pixels brighter than 128 are on), the array of the first non-zero byte
+# of each row, and the array of the number of bytes from there to the last
+# non-zero byte, which is zero for rows that are all off.
+def pack_raster_rows(image):
+    if image.mode != "L":
+        image = image.convert("L")
+    pixels = np.asarray(image) > 128
+    rows = np.packbits(pixels, axis=1)
+
+    nonzero = rows != 0
+    lefts = np.argmax(nonzero, axis=1)
+    rights = rows.shape[1] - np.argmax(nonzero[:,::-1], axis=1)
+    row_lengths = np.where(nonzero.any(axis=1), rights - lefts, 0)
+
+    return rows, lefts, row_lengths
+
+# Compress the rows from pack_raster_rows(), trimmed to their "row_lengths"
+# bytes from "lefts", with TIFF PackBits, all at once. Each row is split
+# into runs of equal bytes. Runs of at least MIN_PACKBITS_REPEAT bytes are
+# written as a count byte of 1 - length and the byte; the bytes between
+# them are written as a count byte of length - 1 and the bytes themselves.
+# Returns the string of all the compressed rows and the array of the length
+# of each one.
+def compress_packbits(rows, lefts, row_lengths):
+    height, width = rows.shape
+    columns = np.arange(width)
+    data = rows[(columns >= lefts[:,np.newaxis]) &
+            (columns < (lefts + row_lengths)[:,np.newaxis])]
+    if len(data) == 0:
+        return "", np.zeros(height, dtype=int)
+
+    # Rows with something to engrave and where they start in "data".
+    filled_rows = np.flatnonzero(row_lengths)
+    row_starts = (np.cumsum(row_lengths) - row_lengths)[filled_rows]
+
+    # Row of each of the sorted indices into "data".
+    def get_rows(indices):
+        firsts = np.searchsorted(indices, row_starts)
+        return np.repeat(filled_rows, np.diff(np.append(firsts, len(indices))))
+
+    # Runs of equal bytes, not crossing rows.
+    is_start = np.empty(len(data), dtype=bool)
+    is_start[0] = True
+    is_start[1:] = data[1:] != data[:-1]
+    is_start[row_starts] = True
+    run_starts = np.flatnonzero(is_start)
+    run_lengths = np.diff(np.append(run_starts, len(data)))
+    is_repeat = run_lengths >= MIN_PACKBITS_REPEAT
+
+    # Literal spans are the runs of short runs, not crossing rows. A span
+    # starts at a short run after a repeat or at the start of a row.
+    run_rows = get_rows(run_starts)
+    new_span = np.ones(len(run_starts), dtype=bool)
+    new_span[1:] = is_repeat[:-1] | (run_rows[1:] != run_rows[:-1])
+    span_first = np.flatnonzero(~is_repeat & new_span)
+    span_next = np.flatnonzero(~is_repeat & np.append(
+        is_repeat[1:] | (run_rows[1:] != run_rows[:-1]), True)) + 1
+    span_starts = run_starts[span_first]
+    span_lengths = np.append(run_starts, len(data))[span_next] - span_starts
+    repeat_starts = run_starts[is_repeat]
+    repeat_lengths = run_lengths[is_repeat]
+
+    # Split both into pieces of at most MAX_PACKBITS_RUN bytes.
+    def split(starts, lengths):
+        counts = (lengths + MAX_PACKBITS_RUN - 1)//MAX_PACKBITS_RUN
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        piece_starts = np.repeat(starts, counts) + offsets*MAX_PACKBITS_RUN
+        piece_lengths = np.minimum(np.repeat(starts + lengths, counts) - piece_starts,
+                MAX_PACKBITS_RUN)
+        return piece_starts, piece_lengths
+
+    literal_starts, literal_lengths = split(span_starts, span_lengths)
+    repeat_starts, repeat_lengths = split(repeat_starts, repeat_lengths)
+
+    # All pieces in order, with their count byte and encoded size.
+    piece_starts = np.concatenate([literal_starts, repeat_starts])
+    piece_lengths = np.concatenate([literal_lengths, repeat_lengths])
+    piece_repeats = np.concatenate([np.zeros(len(literal_starts), dtype=bool),
+        np.ones(len(repeat_starts), dtype=bool)])
+    order = np.argsort(piece_starts, kind="mergesort")
+    piece_starts = piece_starts[order]
+    piece_lengths = piece_lengths[order]
+    piece_repeats = piece_repeats[order]
+    headers = np.where(piece_repeats, 257 - piece_lengths, piece_lengths - 1) % 256
+    copied = np.where(piece_repeats, 1, piece_lengths)
+
+    # Each count byte goes before the bytes copied from its piece: all of a
+    # literal's and the first of a repeat's.
+    keep = ~np.repeat(is_repeat, run_lengths)
+    keep[repeat_starts] = True
+    compressed = np.insert(data[keep], np.cumsum(copied) - copied, headers.astype(np.uint8))
+
+    # Compressed length of each row.
+    packed_lengths = np.bincount(get_rows(piece_starts), weights=1 + copied,
+            minlength=height).astype(int)
+
+    return compressed.tostring(), packed_lengths
+
+# Write the HPGL for the cuts. The power, speed, and frequency are only set
+# when they're different from the previous cut's, and the points of each
+# run of cuts with the same settings are written at once.
+def generate_cuts(out, cuts):
+    point_arrays = []
+    state = None
+    for cut in cuts:
+        points = cut.getPointArray()
+        if len(points) == 0:
+            continue
+
+        # A single point is drawn as a line to itself.
+        if len(points) == 1:
+            points = np.repeat(points, 2, axis=0)
+
+        new_state = (cut.getPower(), cut.getSpeed(), cut.getFrequency())
+        if new_state != state:
+            if point_arrays:
+                out.write(format_cuts(point_arrays))
+                point_arrays = []
+
+            out.write(V_POWER % new_state[0] + SEP +
+                    V_SPEED % new_state[1] + SEP +
+                    V_FREQUENCY % new_state[2] + SEP +
+                    V_UNKNOWN1 + SEP +
+                    V_UNKNOWN2 + SEP)
+
+            # See HPGL_LINE_TYPE about this being only before the first pen up.
+            if state is None:
+                out.write(HPGL_LINE_TYPE)
+            state = new_state
+
+        point_arrays.append(points)
+
+        if VERBOSE:
+            print "Cut with %d points in %d spans" % (len(points),
+                    (len(points) - 2)//(MAX_SPAN_POINTS - 1) + 1)
+
+    if point_arrays:
+        out.write(format_cuts(point_arrays))
+
+# Return the HPGL for the cuts, each an (N,2) int array of at least two
+# points. Cuts are split into spans of at most MAX_SPAN_POINTS points, each
+# one starting at the last point of the previous one. The pen moves up to
+# the first point of each span and draws the rest.
+def format_cuts(point_arrays):
+    points = np.concatenate(point_arrays)
+    lengths = np.array([len(cut_points) for cut_points in point_arrays])
+    step = MAX_SPAN_POINTS - 1
+
+    # Where each span starts in "points", and its length.
+    span_counts = (lengths - 2)//step + 1
+    span_cuts = np.repeat(np.arange(len(lengths)), span_counts)
+    span_numbers = np.arange(span_counts.sum()) - np.repeat(np.cumsum(span_counts) - span_counts,
+            span_counts)
+    span_starts = (np.cumsum(lengths) - lengths)[span_cuts] + span_numbers*step
+    span_lengths = np.minimum(lengths[span_cuts] - span_numbers*step, MAX_SPAN_POINTS)
+
+    # Index into "points" of each point of each span.
+    span_offsets = np.cumsum(span_lengths) - span_lengths
+    indices = np.repeat(span_starts - span_offsets, span_lengths) + np.arange(span_lengths.sum())
+
+    # Strings that go before the numbers.
+    COMMA, PEN_DOWN, PEN_UP, FIRST_PEN_UP = range(4)
+    prefixes = [",", SEP + HPGL_PEN_DOWN, SEP + HPGL_PEN_UP, HPGL_PEN_UP]
+    prefix_indices = np.zeros(len(indices)*2, dtype=np.int64)
+    prefix_indices[span_offsets*2] = PEN_UP
+    prefix_indices[span_offsets*2 + 2] = PEN_DOWN
+    prefix_indices[0] = FIRST_PEN_UP
+
+    return format_integers(points[indices].ravel(), prefix_indices, prefixes) + SEP
+
+# Return the string of the integers in the array "values", each one after
+# the string in "prefixes" that's picked by the same entry in
+# "prefix_indices". Each distinct number is formatted once into a table
+# with the prefixes, so the table grows with the number of points rather
+# than with the range of the coordinates, and the string is gathered from
+# that table all at once.
+def format_integers(values, prefix_indices, prefixes):
+    numbers, inverse = np.unique(values, return_inverse=True)
+    strings = prefixes + ["%d" % value for value in numbers]
+    table = np.array(strings)
+
+    # Prefixes and numbers alternate. The table's strings are padded with
+    # nulls, which are removed.
+    entries = np.column_stack([prefix_indices, inverse + len(prefixes)]).ravel()
+    text = table[entries].view(np.uint8)
+
+    return text[text != 0].tostring()
@@ -0,0 +1,247 @@
+
+# pip install numpy (http://www.numpy.org/)
+import numpy as np
+
+from vector import Vector3
+
+# Type of vertex coordinates and normals. Matches the Python floats that the
+# model files are parsed into, so results don't depend on the representation.
+VERTEX_DTYPE = np.float64
+
+# Type of face indices.
+FACE_DTYPE = np.int32
+
+# Number of faces whose normals are computed at once.
+NORMAL_CHUNK_FACES = 64*1024
+
+# An indexed triangle mesh. Vertices are stored once in an (N,3) array and
+# faces are (M,3) indices into that array, so memory is proportional to the
+# raw float data instead of to a graph of Python objects.
+class Mesh(object):
+    # Vertices is an (N,3) array of coordinates, faces an (M,3) array of indices
+    # into it. The normals are computed if not specified.
+    def __init__(self, vertices, faces, normals=None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=VERTEX_DTYPE).reshape(-1, 3)
+        self.faces = np.ascontiguousarray(faces, dtype=FACE_DTYPE).reshape(-1, 3)
+
+        if normals is None:
+            normals = self.computeNormals()
+        self.normals = normals
+
+    def __str__(self):
+        return "Mesh[%d vertices, %d faces]" % (self.getVertexCount(), self.getFaceCount())
+
+    def getVertexCount(self):
+        return len(self.vertices)
+
+    def getFaceCount(self):
+        return len(self.faces)
+
+    # Compute the unit normal of each face, same winding as the original
+    # Triangle3D. Zero-area faces get a zero normal.
+    # Done a chunk of faces at a time so the corners and temporaries don't
+    # take several times the memory of the mesh.
+    def computeNormals(self):
+        normals = np.empty((len(self.faces), 3), dtype=VERTEX_DTYPE)
+
+        for start in range(0, len(self.faces), NORMAL_CHUNK_FACES):
+            faces = self.faces[start:start + NORMAL_CHUNK_FACES]
+            v0 = self.vertices[faces[:,0]]
+            v1 = self.vertices[faces[:,1]]
+            v2 = self.vertices[faces[:,2]]
+
+            chunk = np.cross(v0 - v2, v0 - v1)
+            lengths = np.sqrt((chunk*chunk).sum(axis=1))
+            nonzero = lengths != 0
+            chunk[nonzero] /= lengths[nonzero][:,np.newaxis]
+            normals[start:start + NORMAL_CHUNK_FACES] = chunk
+
+        return normals
+
+    # Return a copy of the mesh without vertices that no face refers to.
+    def withoutUnusedVertices(self):
+        used = np.zeros(len(self.vertices), dtype=bool)
+        used[self.faces.ravel()] = True
+        if used.all():
+            return self
+
+        remap = np.cumsum(used, dtype=FACE_DTYPE) - 1
+        return Mesh(self.vertices[used], remap[self.faces], self.normals)
+
+    # Return a copy of the mesh with exactly coincident vertices merged.
+    def welded(self):
+        vertices, inverse = weld(self.vertices)
+        if len(vertices) == len(self.vertices):
+            return self
+
+        return Mesh(vertices, inverse[self.faces], self.normals)
+
+    # Return a copy of the mesh without faces that have no area or that
+    # repeat another face's vertices.
+    def withoutDegenerateFaces(self):
+        faces = self.faces
+
+        # Zero area, including faces that use a vertex twice.
+        keep = (self.normals != 0).any(axis=1)
+
+        # Same three vertices as an earlier face, in any order.
+        rows = np.sort(faces, axis=1)
+        rows = np.ascontiguousarray(rows).view(np.dtype((np.void, rows.dtype.itemsize*3))).ravel()
+        _, first = np.unique(rows, return_index=True)
+        unique = np.zeros(len(faces), dtype=bool)
+        unique[first] = True
+        keep &= unique
+
+        if keep.all():
+            return self
+
+        return Mesh(self.vertices, faces[keep], self.normals[keep])
+
+    # Return a copy of the mesh decimated by vertex clustering: the vertices
+    # in each cube of side "cell_size" are merged into their centroid, and
+    # faces that collapse are removed. No point of the surface moves more
+    # than the diagonal of a cell, cell_size*sqrt(3).
+    def clustered(self, cell_size):
+        cells = np.floor(self.vertices/cell_size).astype(np.int64)
+        rows = cells.view(np.dtype((np.void, cells.dtype.itemsize*3))).ravel()
+        _, inverse = np.unique(rows, return_inverse=True)
+
+        counts = np.bincount(inverse).astype(VERTEX_DTYPE)
+        vertices = np.column_stack([
+            np.bincount(inverse, weights=self.vertices[:,axis])/counts
+            for axis in range(3)])
+
+        return Mesh(vertices, inverse[self.faces]).withoutDegenerateFaces().withoutUnusedVertices()
+
+    # Return the (min,max) pair of Vector3 that bound the vertices.
+    def getBounds(self):
+        low = self.vertices.min(axis=0)
+        high = self.vertices.max(axis=0)
+        return Vector3(*low), Vector3(*high)
+
+    # Rotate the vertices around the Z axis by each of the angles and project
+    # them onto the X plane. Returns an (A,N) array of the horizontal
+    # coordinate of every vertex at every angle; the vertical coordinate is
+    # the vertex's Z for all angles.
+    def projectAngles(self, angle_list):
+        angle_list = np.asarray(angle_list, dtype=np.float64)[:,np.newaxis]
+
+        return np.sin(angle_list)*self.vertices[:,0] + np.cos(angle_list)*self.vertices[:,1]
+
+    # Distance of each vertex from a viewer looking at the mesh rotated by
+    # angle around the Z axis, as for projectAngles().
+    def getDepths(self, angle):
+        return np.cos(angle)*self.vertices[:,0] - np.sin(angle)*self.vertices[:,1]
+
+    # Face normals rotated by angle around the Z axis.
+    def getRotatedNormals(self, angle):
+        c = np.cos(angle)
+        s = np.sin(angle)
+        nx = self.normals[:,0]
+        ny = self.normals[:,1]
+
+        return np.column_stack((c*nx - s*ny, s*nx + c*ny, self.normals[:,2]))
+
+    # Return a copy of the mesh rotated 90 degrees around the X axis. This is for
+    # converting models from around-Y to around-Z.
+    def rotatex90(self):
+        def rotate(a):
+            return np.column_stack((a[:,0], -a[:,2], a[:,1]))
+
+        return Mesh(rotate(self.vertices), self.faces, rotate(self.normals))
+
+    # Translate this mesh by the vector.
+    def __add__(self, vector3):
+        offset = np.array([vector3.x, vector3.y, vector3.z], dtype=VERTEX_DTYPE)
+        return Mesh(self.vertices + offset, self.faces, self.normals)
+
+    # Translate this mesh by the negative of the vector.
+    def __sub__(self, vector3):
+        return self + -vector3
+
+# Concatenate a list of meshes into one.
+def concatenate(meshes):
+    if not meshes:
+        return Mesh(np.zeros((0, 3)), np.zeros((0, 3)))
+
+    faces = []
+    vertexOffset = 0
+    for mesh in meshes:
+        faces.append(mesh.faces + vertexOffset)
+        vertexOffset += mesh.getVertexCount()
+
+    return Mesh(
+        np.concatenate([mesh.vertices for mesh in meshes]),
+        np.concatenate(faces),
+        np.concatenate([mesh.normals for mesh in meshes]))
+
+# Given a (K,3) array of points, return an (N,3) array of the distinct points
+# and a length-K array of indices into it. Points are merged only if their
+# coordinates are exactly equal.
+def weld(points):
+    points = np.asarray(points)
+    welder = Welder(np.float32 if points.dtype == np.float32 else VERTEX_DTYPE)
+    indices = welder.add(points)
+    vertices, remap = welder.finish()
+
+    return vertices, remap[indices]
+
+# Welds a mesh a chunk at a time without holding all of its unshared
+# corners. Each chunk is welded on its own as it's added, which leaves few
+# points, and those are welded together once at the end. Points are
+# compared in "dtype", which can be the file's own single precision, and
+# only the distinct ones are converted.
+class Welder(object):
+    def __init__(self, dtype=VERTEX_DTYPE):
+        self.dtype = np.dtype(dtype)
+        self.key_dtype = np.dtype((np.void, self.dtype.itemsize*3))
+
+        # Distinct points of each chunk.
+        self.points = []
+        self.count = 0
+
+    # Add the (K,3) array of points and return a length-K array of their
+    # indices among the points added so far, for finish()'s "remap".
+    def add(self, points):
+        # Adding zero turns -0.0 into 0.0 so that the two compare equal below.
+        points = np.ascontiguousarray(points, dtype=self.dtype).reshape(-1, 3) + self.dtype.type(0)
+        distinct, indices = self.getDistinct(points)
+
+        self.points.append(distinct)
+        indices += self.count
+        self.count += len(distinct)
+
+        return indices
+
+    # Return the (N,3) array of the distinct vertices, and an array that
+    # maps the indices returned by add() to indices into it.
+    def finish(self):
+        if not self.points:
+            return np.zeros((0, 3), dtype=VERTEX_DTYPE), np.zeros(0, dtype=FACE_DTYPE)
+
+        points = np.concatenate(self.points)
+        self.points = []
+        distinct, remap = self.getDistinct(points)
+
+        return distinct.astype(VERTEX_DTYPE), remap
+
+    # Return the distinct rows of the (K,3) array of points, sorted, and the
+    # length-K array of the index of each point among them. Like unique()
+    # with return_inverse, but without its extra index arrays, since this
+    # takes most of the memory of welding.
+    def getDistinct(self, points):
+        # View each row as a single opaque value so that the sort compares
+        # whole points without a lexicographic sort on three keys.
+        keys = points.view(self.key_dtype).ravel()
+        order = np.argsort(keys, kind="mergesort")
+        keys = keys[order]
+
+        starts = np.empty(len(keys), dtype=bool)
+        starts[:1] = True
+        starts[1:] = keys[1:] != keys[:-1]
+        distinct = keys[starts].view(self.dtype).reshape(-1, 3)
+
+        indices = np.empty(len(keys), dtype=FACE_DTYPE)
+        indices[order] = np.cumsum(starts, dtype=FACE_DTYPE) - 1
+
+        return distinct, indices
@@ -0,0 +1,132 @@
+
+# On-disk cache of compiled meshes. Parsing a large model takes far longer
+# than reading back its vertex and face arrays, so we store those arrays in a
+# flat binary file named by a fingerprint of the source file and of the
+# processing that was applied to it. Files are memory-mapped on load, so only the parts
+# that are used get read.
+
+import os
+import struct
+import hashlib
+import zlib
+
+import numpy as np
+
+import mesh as meshlib
+
+# Bump this whenever the layout below or the processing of loaded meshes changes.
+FORMAT_VERSION = 1
+
+MAGIC = "LTHRMESH"
+
+# Magic, version, vertex count, face count, payload CRC-32, key. Padded to
+# 64 bytes so that the float arrays that follow are aligned.
+HEADER_FORMAT = "<8sIQQI20s"
+HEADER_SIZE = 64
+
+# Bytes hashed from each end of the source file.
+KEY_SAMPLE_BYTES = 1024*1024
+
+# Return the hex key for this source file processed with these parameters.
+# Hashing a whole large model would take as long as the rest of a cached
+# load, so the key covers the file's size, modification time and its first
+# and last KEY_SAMPLE_BYTES.
+def get_key(filename, rotation_count):
+    size = os.path.getsize(filename)
+
+    h = hashlib.sha1()
+    h.update("v%d;rotation_count=%d;size=%d;mtime=%r;" % (FORMAT_VERSION,
+        rotation_count, size, os.path.getmtime(filename)))
+
+    f = open(filename, "rb")
+    h.update(f.read(KEY_SAMPLE_BYTES))
+    if size > 2*KEY_SAMPLE_BYTES:
+        f.seek(size - KEY_SAMPLE_BYTES)
+    h.update(f.read())
+    f.close()
+
+    return h.hexdigest()
+
+# Return the pathname of the cache file for this key.
+def get_pathname(cache_dir, key):
+    return os.path.join(cache_dir, key + ".mesh")
+
+# Byte size of the three arrays for these counts.
+def get_payload_size(vertex_count, face_count):
+    vertex_bytes = vertex_count*3*np.dtype(meshlib.VERTEX_DTYPE).itemsize
+    normal_bytes = face_count*3*np.dtype(meshlib.VERTEX_DTYPE).itemsize
+    face_bytes = face_count*3*np.dtype(meshlib.FACE_DTYPE).itemsize
+    return vertex_bytes, normal_bytes, face_bytes
+
+# Write the mesh to the cache. The file is written under a temporary name and
+# renamed, so a crash never leaves a partial file under the real name.
+def write_mesh(cache_dir, key, mesh):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Normals go before faces so that they stay 8-byte aligned.
+    arrays = [
+        np.ascontiguousarray(mesh.vertices, dtype=meshlib.VERTEX_DTYPE),
+        np.ascontiguousarray(mesh.normals, dtype=meshlib.VERTEX_DTYPE),
+        np.ascontiguousarray(mesh.faces, dtype=meshlib.FACE_DTYPE),
+    ]
+
+    crc = 0
+    for array in arrays:
+        crc = zlib.crc32(array.data, crc)
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION,
+            mesh.getVertexCount(), mesh.getFaceCount(), crc & 0xFFFFFFFF, key.decode("hex"))
+    header += "\0"*(HEADER_SIZE - len(header))
+
+    pathname = get_pathname(cache_dir, key)
+    tmp_pathname = "%s.%d.tmp" % (pathname, os.getpid())
+    out = open(tmp_pathname, "wb")
+    out.write(header)
+    for array in arrays:
+        out.write(array.data)
+    out.close()
+    os.rename(tmp_pathname, pathname)
+
+# Return the cached mesh for this key, or None if there isn't a valid one.
+# The arrays of the returned mesh are read-only memory maps of the file.
+# The header, key and size are always checked. If "check" is true the CRC
+# of the arrays is checked too, which reads the whole file.
+def read_mesh(cache_dir, key, check=True):
+    pathname = get_pathname(cache_dir, key)
+    if not os.path.exists(pathname):
+        return None
+
+    f = open(pathname, "rb")
+    header = f.read(HEADER_SIZE)
+    f.close()
+
+    if len(header) != HEADER_SIZE:
+        print "Mesh cache file \"%s\" is truncated." % pathname
+        return None
+
+    magic, version, vertex_count, face_count, crc, raw_key = \
+            struct.unpack(HEADER_FORMAT, header[:struct.calcsize(HEADER_FORMAT)])
+    if magic != MAGIC or version != FORMAT_VERSION or raw_key.encode("hex") != key:
+        print "Mesh cache file \"%s\" is stale." % pathname
+        return None
+
+    vertex_bytes, normal_bytes, face_bytes = get_payload_size(vertex_count, face_count)
+    if os.path.getsize(pathname) != HEADER_SIZE + vertex_bytes + normal_bytes + face_bytes:
+        print "Mesh cache file \"%s\" has the wrong size." % pathname
+        return None
+
+    if vertex_count == 0 or face_count == 0:
+        # Can't map empty arrays.
+        return None
+
+    data = np.memmap(pathname, dtype=np.uint8, mode="r", offset=HEADER_SIZE)
+    if check and zlib.crc32(data) & 0xFFFFFFFF != crc:
+        print "Mesh cache file \"%s\" is corrupt." % pathname
+        return None
+
+    vertices = data[:vertex_bytes].view(meshlib.VERTEX_DTYPE).reshape(-1, 3)
+    normals = data[vertex_bytes:vertex_bytes + normal_bytes].view(meshlib.VERTEX_DTYPE).reshape(-1, 3)
+    faces = data[vertex_bytes + normal_bytes:].view(meshlib.FACE_DTYPE).reshape(-1, 3)
+
+    return meshlib.Mesh(vertices, faces, normals)
@@ -0,0 +1,162 @@
+
+# Loaders for STL (binary and ASCII) and OBJ model files. Faces are read in
+# chunks into NumPy arrays, so peak memory stays close to the size of
+# the final mesh rather than to that of a parsed document.
+
+import os
+
+import numpy as np
+
+import mesh as meshlib
+
+# Number of triangles read at once from a binary STL file.
+STL_CHUNK_TRIANGLES = 64*1024
+
+# One triangle record of a binary STL file.
+STL_RECORD = np.dtype([
+    ("normal", "<f4", (3,)),
+    ("vertices", "<f4", (3, 3)),
+    ("attribute", "<u2"),
+])
+
+STL_HEADER_SIZE = 80
+
+# Number of values in each block of a Blocks array. A multiple of three, so
+# that vertices and triangles never straddle two blocks.
+BLOCK_SIZE = 3*64*1024
+
+# Return the mesh in the STL file, binary or ASCII.
+def load_stl(filename):
+    f = open(filename, "rb")
+    header = f.read(STL_HEADER_SIZE + 4)
+
+    # ASCII files start with "solid", but so do some binary ones, so check
+    # whether the size matches the triangle count first.
+    if len(header) == STL_HEADER_SIZE + 4:
+        count = np.frombuffer(header[STL_HEADER_SIZE:], dtype="<u4")[0]
+        if os.path.getsize(filename) == STL_HEADER_SIZE + 4 + count*STL_RECORD.itemsize:
+            mesh = load_binary_stl(f, count)
+            f.close()
+            return mesh
+
+    f.close()
+
+    if not header.lstrip().startswith("solid"):
+        raise Exception("%s is not an STL file" % filename)
+
+    return load_ascii_stl(filename)
+
+# Return the mesh of the binary STL file positioned just past its header.
+# Each chunk's corners are welded as it's read, in the file's own single
+# precision, so only its distinct vertices are kept until the end.
+def load_binary_stl(f, count):
+    welder = meshlib.Welder(np.float32)
+    faces = np.empty((count, 3), dtype=meshlib.FACE_DTYPE)
+
+    start = 0
+    while start < count:
+        n = min(STL_CHUNK_TRIANGLES, count - start)
+        data = f.read(n*STL_RECORD.itemsize)
+        if len(data) != n*STL_RECORD.itemsize:
+            raise Exception("STL file is truncated")
+        corners = np.frombuffer(data, dtype=STL_RECORD)["vertices"]
+        faces[start:start + n] = welder.add(corners).reshape(-1, 3)
+        start += n
+
+    vertices, remap = welder.finish()
+    for start in range(0, count, STL_CHUNK_TRIANGLES):
+        faces[start:start + STL_CHUNK_TRIANGLES] = remap[faces[start:start + STL_CHUNK_TRIANGLES]]
+
+    return meshlib.Mesh(vertices, faces)
+
+# Return the mesh of the ASCII STL file. Corners are parsed into a block of
+# STL_CHUNK_TRIANGLES triangles and welded a block at a time, like
+# load_binary_stl() does.
+def load_ascii_stl(filename):
+    welder = meshlib.Welder()
+    indices = Blocks(meshlib.FACE_DTYPE)
+    coords = np.empty(STL_CHUNK_TRIANGLES*9, dtype=np.float64)
+    count = 0
+
+    for line in open(filename):
+        fields = line.split()
+        if fields and fields[0] == "vertex":
+            coords[count:count + 3] = [float(value) for value in fields[1:4]]
+            count += 3
+            if count == len(coords):
+                indices.add(welder.add(coords))
+                count = 0
+
+    if count % 9 != 0:
+        raise Exception("%s has a facet without three vertices" % filename)
+    if count > 0:
+        indices.add(welder.add(coords[:count]))
+
+    faces = indices.finish().reshape(-1, 3)
+    vertices, remap = welder.finish()
+    for start in range(0, len(faces), STL_CHUNK_TRIANGLES):
+        faces[start:start + STL_CHUNK_TRIANGLES] = remap[faces[start:start + STL_CHUNK_TRIANGLES]]
+
+    return meshlib.Mesh(vertices, faces)
+
+# Return the mesh in the OBJ file. Polygons are split into triangle fans.
+def load_obj(filename):
+    coords = Blocks(np.float64)
+    indices = Blocks(meshlib.FACE_DTYPE)
+
+    vertex_count = 0
+    for line in open(filename):
+        fields = line.split()
+        if not fields:
+            continue
+
+        if fields[0] == "v":
+            coords.extend([float(value) for value in fields[1:4]])
+            vertex_count += 1
+        elif fields[0] == "f":
+            # Corners are "v", "v/vt", "v//vn" or "v/vt/vn", one-based, or
+            # negative to count back from the latest vertex.
+            corners = []
+            for field in fields[1:]:
+                index = int(field.split("/")[0])
+                corners.append(index - 1 if index > 0 else vertex_count + index)
+
+            for i in range(1, len(corners) - 1):
+                indices.extend((corners[0], corners[i], corners[i + 1]))
+
+    faces = indices.finish().reshape(-1, 3)
+    if len(faces) > 0 and (faces.min() < 0 or faces.max() >= vertex_count):
+        raise Exception("%s has a face with an out-of-range vertex" % filename)
+
+    return meshlib.Mesh(coords.finish().reshape(-1, 3), faces)
+
+# Growing flat array of numbers, filled into preallocated NumPy blocks of
+# BLOCK_SIZE values.
+class Blocks(object):
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.blocks = []
+        self.block = np.empty(BLOCK_SIZE, dtype=dtype)
+        self.count = 0
+
+    # Append the sequence of values, which must fit in what's left of a
+    # block when the block isn't empty.
+    def extend(self, values):
+        self.block[self.count:self.count + len(values)] = values
+        self.count += len(values)
+        if self.count == BLOCK_SIZE:
+            self.blocks.append(self.block)
+            self.block = np.empty(BLOCK_SIZE, dtype=self.dtype)
+            self.count = 0
+
+    # Append a NumPy array as a block of its own.
+    def add(self, values):
+        self.blocks.append(np.asarray(values, dtype=self.dtype))
+
+    # Return all the values in one array.
+    def finish(self):
+        blocks = self.blocks + [self.block[:self.count]]
+        self.blocks = []
+        self.block = None
+
+        return np.concatenate(blocks)
@@ -0,0 +1,89 @@
+
+# Whole-image morphology on NumPy arrays.
+
+import math
+
+import numpy as np
+
+# Return the grayscale dilation of the 2D array by a disk of "radius": each
+# value becomes the maximum of the values whose pixel centers are within
+# "radius" of its own. On a coverage image this pushes the edges out by the
+# radius while keeping their anti-aliasing.
+def dilate_disk(values, radius):
+    values = np.asarray(values)
+    height, width = values.shape
+    r = int(math.floor(radius))
+    if r <= 0:
+        return values.copy()
+
+    # Pad so that windows never leave the array. Zero is the lowest value
+    # of the unsigned images we use.
+    padded = np.zeros((height + 2*r, width + 2*r), dtype=values.dtype)
+    padded[r:r + height, r:r + width] = values
+
+    # table[k][:,x] is the maximum of padded[:,x:x + 2**k].
+    table = [padded]
+    while 2**len(table) <= 2*r + 1:
+        previous = table[-1]
+        half = 2**(len(table) - 1)
+        table.append(np.maximum(previous[:,:-half], previous[:,half:]))
+
+    result = np.zeros_like(values)
+    for dy in range(-r, r + 1):
+        # Half-width of the disk on this row.
+        w = int(math.floor(math.sqrt(radius*radius - dy*dy)))
+        length = 2*w + 1
+
+        # Maximum over columns [x - w, x + w] from two overlapping windows
+        # of a power-of-two length.
+        k = length.bit_length() - 1
+        level = table[k]
+        rows = level[r + dy:r + dy + height]
+        start = r - w
+        end = r + w + 1 - 2**k
+        row_max = np.maximum(rows[:,start:start + width], rows[:,end:end + width])
+
+        np.maximum(result, row_max, out=result)
+
+    return result
+
+# Return the dilation of the 2D boolean array by a disk of "radius", with
+# the same disk as dilate_disk() but in time independent of the radius. The
+# distance from each pixel to the nearest set pixel of its column picks the
+# widest row of the disk centered on that pixel that reaches a set pixel,
+# and the union of those rows is filled with a difference array.
+def dilate_binary_disk(mask, radius):
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+
+    distance = get_column_distances(mask)
+    reach_ys, reach_xs = np.nonzero(distance <= radius)
+    dy = distance[reach_ys, reach_xs].astype(np.int64)
+
+    # Half-width of the disk's row at each distance. Fix up the square root
+    # so that it's exact for fractional radii.
+    left = radius*radius - dy*dy
+    w = np.floor(np.sqrt(left)).astype(np.int64)
+    w[(w + 1)*(w + 1) <= left] += 1
+    w[w*w > left] -= 1
+
+    start = np.maximum(reach_xs - w, 0)
+    end = np.minimum(reach_xs + w + 1, width)
+
+    # One extra column so the end markers of full rows have a place.
+    size = height*(width + 1)
+    counts = np.bincount(reach_ys*(width + 1) + start, minlength=size)
+    counts -= np.bincount(reach_ys*(width + 1) + end, minlength=size)
+
+    return np.cumsum(counts.reshape(height, width + 1), axis=1)[:,:width] > 0
+
+# Return the vertical distance from each pixel of the 2D boolean array to
+# the nearest set pixel in its column, or infinity where the column has none.
+def get_column_distances(mask):
+    height, width = mask.shape
+    y = np.arange(height, dtype=np.float64)[:,np.newaxis]
+
+    above = np.maximum.accumulate(np.where(mask, y, -np.inf), axis=0)
+    below = np.minimum.accumulate(np.where(mask, y, np.inf)[::-1], axis=0)[::-1]
+
+    return np.minimum(y - above, below - y)
@@ -0,0 +1,446 @@
+
+# Offsetting of outlines by a distance, for the laser kerf. Each edge is
+# moved sideways by the distance and convex corners get round joins. Where
+# that makes the curve overlap itself or another curve, the parts that are
+# closer than the distance to the original outlines are cut away, so narrow
+# gaps close up and nearby shapes merge the way a dilation would.
+
+import math
+
+import numpy as np
+
+from vector import Vector2
+import ordering
+
+# Most segments in a round join, however large the radius.
+MAX_JOIN_SEGMENTS = 16
+
+# Precision to which points are merged when joining pieces, in output units.
+SNAP = 1e-6
+
+# Number of pairs of segments, or of points and edges, tested at a time.
+CHUNK_SIZE = 65536
+
+# Return the list of paths offset by "radius". Paths are lists of Vector2
+# and closed paths have their first vertex repeated at their end. "sides"
+# has a number per path: 1 to offset it towards the reciprocal() of its
+# edges, -1 to offset it the other way. "fixed" optionally has a list of
+# booleans per path, one per edge, of edges that don't move, such as edges
+# that were made by clipping. Round joins deviate from the true circle by
+# at most "tolerance", unless that would take more than MAX_JOIN_SEGMENTS
+# segments.
+def offset_paths(paths, sides, radius, tolerance, fixed=None):
+    if fixed is None:
+        fixed = [[False]*(len(path) - 1) for path in paths]
+
+    curves = []
+    real_edges = []
+    fixed_edges = []
+    for path, side, path_fixed in zip(paths, sides, fixed):
+        vertices, distances = get_edges(path, path_fixed, radius)
+        if len(vertices) < 2:
+            continue
+
+        closed = vertices[0] == vertices[-1]
+        points, centers = get_raw_curve(vertices, distances, side, radius, tolerance, closed)
+        curves.append((points, centers, closed))
+        for a, b, distance in zip(vertices[:-1], vertices[1:], distances):
+            if distance > 0:
+                real_edges.append((a, b))
+            else:
+                length = math.hypot(b[0] - a[0], b[1] - a[1])
+                normal = (-(b[1] - a[1])*side/length, (b[0] - a[0])*side/length)
+                fixed_edges.append((a, b, normal))
+
+    if not curves:
+        return []
+
+    # Segments of all raw curves, split where they cross.
+    pieces = split_segments(curves)
+
+    # Keep the pieces that are no closer to the original outlines than the
+    # radius. Chords of round joins are tested on the circle they cut
+    # across, and nothing is kept on the far side of fixed edges.
+    mids = np.array([get_test_point(piece, radius) for piece in pieces])
+    distances = get_distances(mids, real_edges, radius)
+    beyond = get_beyond(mids, fixed_edges)
+    pieces = [piece for piece, distance, is_beyond in zip(pieces, distances, beyond)
+            if distance >= radius*(1 - 1e-9) and not is_beyond]
+
+    # Chords of round joins capped at MAX_JOIN_SEGMENTS stray further than
+    # the tolerance. Joins turn less than half a circle.
+    deviation = min(max(tolerance, radius*(1 - math.cos(math.pi/(2*MAX_JOIN_SEGMENTS)))), radius)
+    chord = 2*math.sqrt(2*radius*deviation - deviation*deviation)
+    return join_pieces(pieces, max(4*deviation, chord))
+
+# Return the point at which to test whether the piece is kept: its middle,
+# or for the chord of a round join the point of the circle next to that.
+def get_test_point(piece, radius):
+    a, b, _, _, corner = piece
+    x = (a[0] + b[0])/2
+    y = (a[1] + b[1])/2
+    if corner is not None:
+        dx = x - corner[0]
+        dy = y - corner[1]
+        length = math.hypot(dx, dy)
+        if length > 0:
+            x = corner[0] + dx*radius/length
+            y = corner[1] + dy*radius/length
+
+    return x, y
+
+# Return a boolean array of whether each point is across one of the fixed
+# edges, a list of (start, end, normal) tuples, from the side its path is
+# offset to.
+def get_beyond(points, fixed_edges):
+    beyond = np.zeros(len(points), dtype=bool)
+    for (ax, ay), (bx, by), (nx, ny) in fixed_edges:
+        dx = bx - ax
+        dy = by - ay
+        rx = points[:,0] - ax
+        ry = points[:,1] - ay
+        t = (rx*dx + ry*dy)/(dx*dx + dy*dy)
+        across = rx*nx + ry*ny
+        beyond |= (t > 0) & (t < 1) & (across < -SNAP)
+
+    return beyond
+
+# Return the vertices of the path without repeated vertices, and the
+# offset distance of each edge between them.
+def get_edges(path, path_fixed, radius):
+    vertices = [(path[0].x, path[0].y)]
+    distances = []
+    for v, is_fixed in zip(path[1:], path_fixed):
+        if (v.x, v.y) != vertices[-1]:
+            vertices.append((v.x, v.y))
+            distances.append(0 if is_fixed else radius)
+
+    return vertices, distances
+
+# Return the list of (x,y) points of the curve made of the edges moved
+# sideways by their distance, with joins between them, and for each segment
+# between the points the corner it goes around if it's part of a round
+# join, or None. Closed curves start and end at the same point.
+def get_raw_curve(vertices, distances, side, radius, tolerance, closed):
+    edge_count = len(distances)
+    normals = []
+    for (ax, ay), (bx, by) in zip(vertices[:-1], vertices[1:]):
+        length = math.hypot(bx - ax, by - ay)
+        normals.append((-(by - ay)*side/length, (bx - ax)*side/length))
+
+    def moved(vertex, edge):
+        return (vertex[0] + normals[edge][0]*distances[edge],
+                vertex[1] + normals[edge][1]*distances[edge])
+
+    points = [moved(vertices[0], 0)]
+    centers = []
+    for edge in range(edge_count):
+        if edge > 0:
+            join_points, join_centers = get_join(vertices[edge], normals[edge - 1], normals[edge],
+                    distances[edge - 1], distances[edge], side, radius, tolerance)
+            points.extend(join_points)
+            centers.extend(join_centers)
+        points.append(moved(vertices[edge + 1], edge))
+        centers.append(None)
+
+    if closed:
+        join_points, join_centers = get_join(vertices[0], normals[-1], normals[0],
+                distances[-1], distances[0], side, radius, tolerance)
+        points.extend(join_points)
+        centers.extend(join_centers)
+
+    return points, centers
+
+# Return the points after the end of an edge moved by "da" along normal
+# "na" up to the start of the next edge moved by "db" along "nb", around the
+# vertex between them, and the corner of each segment to them as for
+# get_raw_curve().
+def get_join(vertex, na, nb, da, db, side, radius, tolerance):
+    px, py = vertex
+    (nax, nay), (nbx, nby) = na, nb
+    start = (px + nax*da, py + nay*da)
+    end = (px + nbx*db, py + nby*db)
+    if start == end:
+        return [], []
+
+    # The corner is convex if the edges turn away from the side they move to.
+    turn = nax*nby - nay*nbx
+    if da == db and turn*side < 0:
+        # Round join. The angle turned is under half a circle.
+        angle = math.atan2(turn, nax*nbx + nay*nby)
+        if tolerance < radius:
+            step = 2*math.acos(1 - tolerance/radius)
+        else:
+            step = math.pi
+        count = min(max(int(math.ceil(abs(angle)/step)), 1), MAX_JOIN_SEGMENTS)
+        start_angle = math.atan2(nay, nax)
+
+        points = []
+        for i in range(1, count):
+            a = start_angle + angle*i/count
+            points.append((px + math.cos(a)*radius, py + math.sin(a)*radius))
+        points.append(end)
+        return points, [vertex]*count
+
+    # Where a moving edge meets a fixed one, go to the fixed edge's line
+    # along the moving edge's, so the two cross cleanly even when they're
+    # nearly in line with the join.
+    if (da == 0) != (db == 0):
+        if da == 0:
+            (nfx, nfy), (nmx, nmy), d = na, nb, db
+        else:
+            (nfx, nfy), (nmx, nmy), d = nb, na, da
+        det = nfx*nmy - nfy*nmx
+        if abs(det) > 0.2:
+            miter = (px - nfy*d/det, py + nfx*d/det)
+            if da == 0:
+                return [vertex, miter], [None, None]
+            else:
+                return [miter, vertex, end], [None, None, None]
+
+    # Concave or uneven: go through the vertex. The loop this makes is cut
+    # away later since it's closer than the radius to the edges.
+    return [vertex, end], [None, None]
+
+# Return the segments of the curves as (start, end, curve index, segment
+# index, corner) pieces, split at every crossing with another segment.
+def split_segments(curves):
+    starts = []
+    ends = []
+    owners = []
+    corners = []
+    for curve_index, (points, curve_corners, closed) in enumerate(curves):
+        corners.extend(curve_corners)
+        for segment in range(len(points) - 1):
+            starts.append(points[segment])
+            ends.append(points[segment + 1])
+            owners.append((curve_index, segment, len(points) - 1, closed))
+
+    p0 = np.array(starts)
+    p1 = np.array(ends)
+    d = p1 - p0
+    count = len(p0)
+
+    # Parameters along each segment where it's split.
+    splits = [[] for i in range(count)]
+
+    # Only segments whose boxes share a cell of the grid may cross. Boxes
+    # are grown a little for the tolerance of the crossing test.
+    eps = 1e-9
+    pad = (np.abs(d).max(axis=1) + 1)*eps + SNAP
+    low = np.minimum(p0, p1) - pad[:,np.newaxis]
+    high = np.maximum(p0, p1) + pad[:,np.newaxis]
+    grid = BoxGrid(low, high, (high - low).max(axis=1).mean())
+    first, second = grid.getPairs()
+
+    for start in range(0, len(first), CHUNK_SIZE):
+        i = first[start:start + CHUNK_SIZE]
+        j = second[start:start + CHUNK_SIZE]
+        di = d[i]
+        e = d[j]
+        denominator = di[:,0]*e[:,1] - di[:,1]*e[:,0]
+        w = p0[j] - p0[i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (w[:,0]*e[:,1] - w[:,1]*e[:,0])/denominator
+            u = (w[:,0]*di[:,1] - w[:,1]*di[:,0])/denominator
+            crossing = ((np.abs(denominator) > 1e-12) & (t >= -eps) & (t <= 1 + eps) &
+                    (u >= -eps) & (u <= 1 + eps))
+        for k in np.nonzero(crossing)[0]:
+            this = i[k]
+            other = j[k]
+            if adjacent(owners[this], owners[other]):
+                continue
+
+            t_ij = min(max(t[k], 0.0), 1.0)
+            point = (p0[this,0] + d[this,0]*t_ij, p0[this,1] + d[this,1]*t_ij)
+            splits[this].append((t_ij, point))
+            splits[other].append((min(max(u[k], 0.0), 1.0), point))
+
+    pieces = []
+    for i in range(count):
+        curve_index, segment = owners[i][:2]
+        points = [starts[i]] + [split_point for _, split_point in sorted(splits[i])] + [ends[i]]
+        for a, b in zip(points[:-1], points[1:]):
+            if abs(a[0] - b[0]) > SNAP or abs(a[1] - b[1]) > SNAP:
+                pieces.append((a, b, curve_index, segment, corners[i]))
+
+    return pieces
+
+# Whether the two segments follow each other in their curve.
+def adjacent(first, second):
+    curve_a, segment_a, count, closed = first
+    curve_b, segment_b = second[:2]
+    if curve_a != curve_b:
+        return False
+
+    difference = abs(segment_a - segment_b)
+    return difference == 1 or (closed and difference == count - 1)
+
+# Return an array of the distance from each point to the nearest of the
+# edges, a list of ((x,y), (x,y)) pairs. Only distances under "reach" are
+# exact: points with no edge that close get a larger distance or infinity.
+def get_distances(points, edges, reach):
+    distances = np.full(len(points), np.inf)
+    if not edges or len(points) == 0:
+        return distances
+
+    a = np.array([edge[0] for edge in edges])
+    b = np.array([edge[1] for edge in edges])
+    d = b - a
+    length2 = (d*d).sum(axis=1)
+
+    # Each point is tested against the edges whose boxes, grown by the
+    # reach, cover its cell.
+    low = np.minimum(a, b) - reach
+    high = np.maximum(a, b) + reach
+    grid = BoxGrid(low, high, (high - low).max(axis=1).mean())
+    point_indices, edge_indices = grid.getBoxesAt(points)
+
+    for start in range(0, len(point_indices), CHUNK_SIZE):
+        i = point_indices[start:start + CHUNK_SIZE]
+        j = edge_indices[start:start + CHUNK_SIZE]
+        p = points[i]
+        t = np.clip(((p - a[j])*d[j]).sum(axis=1)/length2[j], 0, 1)
+        closest = a[j] + t[:,np.newaxis]*d[j]
+        np.minimum.at(distances, i, np.sqrt(((p - closest)**2).sum(axis=1)))
+
+    return distances
+
+# Grid of square cells over a set of axis-aligned boxes, to find the boxes
+# that may overlap each other or contain a point without testing them all.
+class BoxGrid(object):
+    # "low" and "high" are (N,2) arrays of the corners of the boxes.
+    def __init__(self, low, high, cell_size):
+        self.origin = low.min(axis=0)
+        self.cell_size = max(cell_size, 1e-9)
+        first = np.floor((low - self.origin)/self.cell_size).astype(np.int64)
+        last = np.floor((high - self.origin)/self.cell_size).astype(np.int64)
+        self.columns = last[:,0].max() + 1
+        self.count = len(low)
+
+        # One entry per cell that each box overlaps, sorted by cell.
+        spans = last - first + 1
+        counts = spans[:,0]*spans[:,1]
+        boxes = np.repeat(np.arange(self.count), counts)
+        offsets = np.arange(len(boxes)) - np.repeat(np.cumsum(counts) - counts, counts)
+        widths = spans[boxes,0]
+        cells = ((first[boxes,1] + offsets//widths)*self.columns +
+                first[boxes,0] + offsets % widths)
+        order = np.argsort(cells, kind="mergesort")
+        self.cells = cells[order]
+        self.boxes = boxes[order]
+
+    # Return arrays of the indices of the first and second box of each pair
+    # of boxes that share a cell, with the first lower, sorted and without
+    # repeats.
+    def getPairs(self):
+        entries = len(self.cells)
+        ends = np.searchsorted(self.cells, self.cells, side="right")
+        counts = ends - np.arange(entries) - 1
+        firsts = np.repeat(np.arange(entries), counts)
+        seconds = firsts + 1 + np.arange(len(firsts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        a = self.boxes[firsts]
+        b = self.boxes[seconds]
+        keys = np.unique(np.minimum(a, b)*self.count + np.maximum(a, b))
+
+        return keys//self.count, keys % self.count
+
+    # Return arrays of the indices of the point and the box of each box
+    # whose cell contains one of the points, an (N,2) array.
+    def getBoxesAt(self, points):
+        cells = np.floor((points - self.origin)/self.cell_size).astype(np.int64)
+        valid = np.flatnonzero((cells[:,0] >= 0) & (cells[:,0] < self.columns) & (cells[:,1] >= 0))
+        cells = cells[valid,1]*self.columns + cells[valid,0]
+        starts = np.searchsorted(self.cells, cells, side="left")
+        counts = np.searchsorted(self.cells, cells, side="right") - starts
+        point_indices = np.repeat(valid, counts)
+        entries = (np.arange(len(point_indices)) +
+                np.repeat(starts - np.cumsum(counts) + counts, counts))
+
+        return point_indices, self.boxes[entries]
+
+# Join the pieces end to start into paths of Vector2. Pieces are joined
+# where the end of one is the start of another. Where several start there,
+# the chain takes the sharpest left turn, which keeps the shape, always on
+# the left of the pieces, to one side of the chain so that loops touching at
+# a point stay apart. Where two round joins cross, their chords can leave a
+# gap at the crossing, and where two barely overlap, no chord may cross the
+# other while both are cut away, leaving a gap of up to a chord. So chains
+# that would end otherwise jump to the nearest start, or close, over gaps of
+# up to "gap".
+def join_pieces(pieces, gap):
+    def key(point):
+        return (int(round(point[0]/SNAP)), int(round(point[1]/SNAP)))
+
+    by_start = {}
+    for index, (a, b, _, _, _) in enumerate(pieces):
+        by_start.setdefault(key(a), []).append(index)
+    end_keys = set(key(b) for a, b, _, _, _ in pieces)
+
+    # Chains that start where nothing ends, then the loops.
+    order = [index for index, (a, b, _, _, _) in enumerate(pieces) if key(a) not in end_keys]
+    order.extend(range(len(pieces)))
+
+    # Starts of the pieces not used yet.
+    if pieces:
+        starts = ordering.PointGrid(np.array([piece[0] for piece in pieces]))
+
+    used = [False]*len(pieces)
+    paths = []
+    for first in order:
+        if used[first]:
+            continue
+
+        used[first] = True
+        starts.remove(first)
+        chain = [pieces[first][0], pieces[first][1]]
+        current = first
+        while True:
+            end = chain[-1]
+            candidates = [index for index in by_start.get(key(end), []) if not used[index]]
+            if not candidates:
+                # Back to the start of this chain, or the nearest close start.
+                if key(end) == key(chain[0]):
+                    break
+                index = starts.findNearest(end[0], end[1])
+                if index is None:
+                    break
+                a = pieces[index][0]
+                distance = math.hypot(a[0] - end[0], a[1] - end[1])
+                if distance > gap or distance >= math.hypot(chain[0][0] - end[0], chain[0][1] - end[1]):
+                    break
+                candidates = [index]
+
+            current = min(candidates, key=lambda candidate:
+                    get_turn(chain[-2], end, pieces[candidate][1]))
+            used[current] = True
+            starts.remove(current)
+            if key(pieces[current][0]) != key(end):
+                chain.append(pieces[current][0])
+            chain.append(pieces[current][1])
+
+        # Close loops, including over a gap.
+        first_point = chain[0]
+        last_point = chain[-1]
+        if math.hypot(last_point[0] - first_point[0], last_point[1] - first_point[1]) <= gap:
+            if len(chain) <= 2:
+                # What's left of a hole smaller than the gap.
+                continue
+            if key(last_point) == key(first_point):
+                chain[-1] = first_point
+            else:
+                chain.append(first_point)
+        paths.append([Vector2(x, y) for x, y in chain])
+
+    return paths
+
+
+# Return how far right the path from "previous" to "point" turns to go on to
+# "target", as an angle from -pi to pi.
+def get_turn(previous, point, target):
+    ix = point[0] - previous[0]
+    iy = point[1] - previous[1]
+    ox = target[0] - point[0]
+    oy = target[1] - point[1]
+
+    return -math.atan2(ix*oy - iy*ox, ix*ox + iy*oy)
@@ -0,0 +1,181 @@
+# Ordering of paths to cut down on the distance that the laser head travels
+# with the laser off between them. Paths are picked nearest first, entering
+# open paths at either end and closed paths at any vertex, and the order is
+# then improved by reversing runs of paths (2-opt).
+
+import math
+
+import numpy as np
+
+# Most passes of 2-opt over the paths.
+MAX_IMPROVE_PASSES = 10
+
+# Finds the nearest of a set of points, which can be removed as they're used.
+class PointGrid(object):
+    # "points" is an (N,2) array.
+    def __init__(self, points):
+        self.points = points
+        self.count = len(points)
+
+        # Square cells with about one point each.
+        low = points.min(axis=0)
+        size = points.max(axis=0) - low
+        self.cell_size = max(math.sqrt(size[0]*size[1]/self.count), size.max()/self.count, 1e-9)
+        self.low = low
+        cells = np.floor((points - low)/self.cell_size).astype(int)
+        self.cell_max = cells.max(axis=0)
+
+        # Map from (column,row) to the set of indices of the points in that cell.
+        self.cells = {}
+        for index, cell in enumerate(map(tuple, cells.tolist())):
+            self.cells.setdefault(cell, set()).add(index)
+        self.point_cells = cells
+
+    def remove(self, index):
+        self.cells[tuple(self.point_cells[index])].remove(index)
+        self.count -= 1
+
+    # Return the index of the point nearest to (x,y), or None if there are none left.
+    def findNearest(self, x, y):
+        if self.count == 0:
+            return None
+
+        column = int(min(max(math.floor((x - self.low[0])/self.cell_size), 0), self.cell_max[0]))
+        row = int(min(max(math.floor((y - self.low[1])/self.cell_size), 0), self.cell_max[1]))
+        last_ring = max(column, row, self.cell_max[0] - column, self.cell_max[1] - row)
+
+        # Look in rings of cells around (x,y)'s cell until the next ring
+        # can't be closer.
+        best = None
+        best_distance = float("inf")
+        for ring in range(last_ring + 1):
+            if best is not None and best_distance <= (ring - 1)*self.cell_size:
+                break
+            for cell in get_ring(column, row, ring):
+                for index in self.cells.get(cell, ()):
+                    px, py = self.points[index]
+                    distance = math.hypot(px - x, py - y)
+                    if distance < best_distance:
+                        best = index
+                        best_distance = distance
+
+        return best
+
+# Return the list of cells at "ring" cells away from (column,row), counting diagonals as one.
+def get_ring(column, row, ring):
+    if ring == 0:
+        return [(column, row)]
+
+    cells = []
+    for i in range(-ring, ring + 1):
+        cells.append((column + i, row - ring))
+        cells.append((column + i, row + ring))
+    for i in range(-ring + 1, ring):
+        cells.append((column - ring, row + i))
+        cells.append((column + ring, row + i))
+    return cells
+
+# Return whether the path, a list of Vector2, ends where it starts.
+def is_closed(path):
+    return len(path) > 2 and path[0] == path[-1]
+
+# Return the total length of the moves from "start" (Vector2) to the first
+# path and between the end of each path and the start of the next.
+def get_travel(paths, start):
+    travel = 0
+    position = start
+    for path in paths:
+        if path:
+            travel += (path[0] - position).length()
+            position = path[-1]
+    return travel
+
+# Return the paths in the order, and with the start and direction, that
+# make the travel from "start" (Vector2) through all of them short.
+def order_paths(paths, start):
+    paths = [path for path in paths if path]
+    if not paths:
+        return paths
+
+    paths = get_nearest_order(paths, start)
+    return improve_order(paths, start)
+
+# Return the paths picked greedily, each one entered at its point nearest
+# to the end of the previous one.
+def get_nearest_order(paths, start):
+    # Ways into each path: both ends of open paths and every vertex of
+    # closed ones, except the repeated last one.
+    entries = []
+    for path_index, path in enumerate(paths):
+        if is_closed(path):
+            vertex_indices = range(len(path) - 1)
+        else:
+            vertex_indices = [0, len(path) - 1]
+        for vertex_index in vertex_indices:
+            entries.append((path_index, vertex_index))
+
+    grid = PointGrid(np.array([(paths[p][v].x, paths[p][v].y) for p, v in entries]))
+    path_entries = [[] for path in paths]
+    for entry_index, (path_index, vertex_index) in enumerate(entries):
+        path_entries[path_index].append(entry_index)
+
+    ordered = []
+    position = start
+    while True:
+        entry_index = grid.findNearest(position.x, position.y)
+        if entry_index is None:
+            break
+        path_index, vertex_index = entries[entry_index]
+        for other in path_entries[path_index]:
+            grid.remove(other)
+
+        path = paths[path_index]
+        if is_closed(path):
+            path = path[vertex_index:] + path[1:vertex_index + 1]
+        elif vertex_index != 0:
+            path = path[::-1]
+        ordered.append(path)
+        position = path[-1]
+
+    return ordered
+
+# Return the paths reordered by 2-opt: runs of paths are reversed, each path
+# being cut backwards, while that shortens the travel from "start".
+def improve_order(paths, start):
+    count = len(paths)
+    entries = np.array([(path[0].x, path[0].y) for path in paths])
+    exits = np.array([(path[-1].x, path[-1].y) for path in paths])
+    reversed_flags = np.zeros(count, dtype=bool)
+    order = np.arange(count)
+
+    def distance(a, b):
+        return np.sqrt(((a - b)**2).sum(axis=-1))
+
+    for improve_pass in range(MAX_IMPROVE_PASSES):
+        improved = False
+        for i in range(count):
+            # Where the head is before path i.
+            before = exits[i - 1] if i > 0 else np.array([start.x, start.y])
+
+            # Reversing paths i to j connects "before" to the exit of j and
+            # the entry of i to the entry of j + 1.
+            j = np.arange(i, count)
+            after = np.append(entries[i + 1:], [entries[-1]], axis=0)
+            has_after = j < count - 1
+            old = distance(before, entries[i]) + np.where(has_after, distance(exits[j], after), 0)
+            new = distance(before, exits[j]) + np.where(has_after, distance(entries[i], after), 0)
+            gains = old - new
+
+            best = np.argmax(gains)
+            if gains[best] > 1e-9:
+                j = i + best
+                entries[i:j + 1], exits[i:j + 1] = exits[i:j + 1][::-1].copy(), entries[i:j + 1][::-1].copy()
+                order[i:j + 1] = order[i:j + 1][::-1].copy()
+                reversed_flags[i:j + 1] = ~reversed_flags[i:j + 1][::-1]
+                improved = True
+
+        if not improved:
+            break
+
+    return [paths[index][::-1] if flipped else paths[index]
+            for index, flipped in zip(order.tolist(), reversed_flags.tolist())]
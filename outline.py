@@ -18,19 +18,35 @@ import json
 import math
 import collections
 import time
+import multiprocessing
 
 # pip install Pillow (https://python-pillow.github.io/)
 from PIL import Image, ImageDraw
 from PIL.GifImagePlugin import getheader, getdata
 
+# pip install numpy (http://www.numpy.org/)
+import numpy as np
+
 # https://raw.githubusercontent.com/python-pillow/Pillow/master/Scripts/gifmaker.py
 import gifmaker
 
 from vector import Vector2, Vector3
+import mesh as meshlib
 
 from document import Document
 from cut import Cut
 import epilog
+import prnfile
+import meshcache
+import meshfile
+import rasterize
+import contour
+import morphology
+import offset
+import simplify
+import curves
+import ordering
+import svg
 
 # What kind of image to make. Use "L" for GIF compatibility.
 RASTER_MODE = "L"
@@ -65,6 +81,79 @@ IMAGE_SIZE = 256
 # but low-res, 5 is slower but high-res.
 RENDER_SCALE = 2
 
+# Whether to weld, clean up and decimate the mesh before rendering. The
+# decimation error is kept below DECIMATE_ERROR_PIXELS rendered pixels (raster
+# pixels divided by ANTIALIAS_FACTOR) so that silhouettes stay within a pixel
+# of the full-detail ones.
+DECIMATE_MESH = False
+DECIMATE_ERROR_PIXELS = 0.5
+
+# Whether to draw silhouettes with the batch rasterizer instead of one
+# ImageDraw.polygon() call per triangle. The two give the same image, which
+# CHECK_RASTERIZER verifies on every render.
+BATCH_RASTERIZER = True
+CHECK_RASTERIZER = False
+
+# Whether the batch rasterizer draws silhouettes coarse to fine, refining
+# only near their boundary. Several times faster at raster sizes of a few
+# thousand pixels and up, but slower for big meshes at small sizes. The
+# image is the same as the full rasterizer's, which CHECK_RASTERIZER
+# verifies on every render.
+ADAPTIVE_RASTERIZER = False
+
+# Whether to compare the kerf with the one drawn by draw_kerf_arcs(), the
+# circle-drawing version it replaced, and print the number of different
+# pixels. Slow.
+CHECK_KERF = False
+
+# Number of samples across each pixel when rendering silhouettes. Above 1
+# the silhouette is anti-aliased and outlines are traced at sub-pixel
+# positions, which gives the accuracy of a RENDER_SCALE this many times
+# larger at a fraction of the cost. Requires BATCH_RASTERIZER.
+ANTIALIAS_FACTOR = 1
+
+# Number of rows of the silhouette to render and trace at a time, or None to
+# process whole images. Bands keep memory proportional to the band instead
+# of to the image, for very large RENDER_SCALEs, and give the same paths.
+# Requires ANTIALIAS_FACTOR above 1, and can't be used with
+# GENERATE_LIT_VERSION or INCREMENTAL_PASSES, which need whole images. No
+# intermediate images are saved.
+TILE_ROWS = None
+
+# How to simplify outlines. "rdp" (Ramer-Douglas-Peucker) keeps every vertex
+# that adds more than a pixel of detail. "visvalingam" (Visvalingam-Whyatt)
+# removes the vertices that add the least area until a path has at most
+# SIMPLIFY_VERTEX_BUDGET vertices and none adds less than a square pixel.
+SIMPLIFY_METHOD = "rdp"
+SIMPLIFY_VERTEX_BUDGET = 500
+
+# Whether to replace the outlines with lines, circular arcs and cubic curves
+# that are within CURVE_TOLERANCE_IN of them. SVG files get the curves
+# themselves. Other outputs get them cut back into straight segments that
+# are within CURVE_TOLERANCE_IN of the curves, for each outline where that
+# takes fewer points than the outline itself. The tolerance is about a
+# raster pixel, the detail that simplify_outlines() keeps, since a tighter
+# one fits the steps of the pixels and only adds points.
+FIT_CURVES = False
+CURVE_TOLERANCE_IN = MODEL_DIAMETER/(IMAGE_SIZE*RENDER_SCALE)
+
+# Whether to reorder the paths of each angle of each pass, and pick where to
+# start closed paths and which way to cut open ones, so that the laser head
+# travels less between them. The heat sensor and time waster paths stay
+# where they are.
+ORDER_PATHS = True
+
+# Whether a pass at an angle updates the outlines of the previous pass at
+# that angle, when they differ only in the width of the shade, instead of
+# processing and tracing the whole image again. Only for ANTIALIAS_FACTOR 1.
+# The outlines are the same either way, but come in a different order.
+# CHECK_INCREMENTAL_PASSES compares them with a full trace on every update.
+INCREMENTAL_PASSES = False
+CHECK_INCREMENTAL_PASSES = False
+
+# Number of rows at the top of the image that are filled when we're shading.
+CLEAR_TOP_ROWS = 2
+
 # Whether to also generate a lit version of the raster.
 GENERATE_LIT_VERSION = False
 
@@ -80,6 +169,20 @@ KERF_RADIUS_IN = 0.002
 # Extra spacing for rough cuts, in inches.
 ROUGH_EXTRA_IN = 1/16.0
 
+# Whether to apply the kerf and the rough cut spacing by offsetting the
+# outlines instead of growing the shape in the image, so that they're exact
+# at any RENDER_SCALE.
+VECTOR_KERF = False
+
+# Most that the rounded corners of the vector kerf may stray from a circle,
+# in inches.
+KERF_JOIN_TOLERANCE_IN = 0.0005
+
+# Whether to check that the vector kerf leaves no more open outlines than
+# there were before it, since only outlines clipped by the edge of the image
+# should be open, and print the number of extra ones.
+CHECK_VECTOR_KERF = False
+
 # Dots per inch in the SVG file. Don't change this.
 DPI = 72
 
@@ -87,11 +190,33 @@ DPI = 72
 SVG_WIDTH = 32*DPI
 SVG_HEIGHT = 20*DPI
 
+# Directory of compiled meshes, so we only parse each model once. Set to None
+# to always parse the model file.
+MESH_CACHE_DIR = "cache"
+
+# Whether to check the CRC of the whole cached mesh on every load, so that
+# corrupt files are rebuilt. Reads the whole file. Without it only the
+# header, key and size are checked.
+CHECK_MESH_CACHE = True
+
+# Maximum size of the rendered images kept for reuse by later passes, in bytes.
+RENDER_CACHE_BYTES = 256*1024*1024
+
+# Number of processes to spread the angles of all passes over. 1 does all
+# the work in this process, None uses one per CPU. The output is the same.
+PROCESS_COUNT = 1
+
 # Output file type.
 OUTPUT_EXTENSION = "svg"     # For Illustrator
+# OUTPUT_EXTENSION = "svgz"    # Compressed SVG
 # OUTPUT_EXTENSION = "vector"  # For Ctrl-cut
 # OUTPUT_EXTENSION = "prn"     # For direct printing
 
+# Decimal places of the coordinates in SVG files, and whether to write each
+# point as the difference from the previous one, which is shorter.
+SVG_DECIMALS = 3
+SVG_RELATIVE = True
+
 # We can only output integers, so we translate to a much higher DPI.
 VECTOR_DPI = 1200
 
@@ -175,10 +300,6 @@ class BoundingBox2D(object):
         self.min = self.min.min(v)
         self.max = self.max.max(v)
 
-    def addTriangle(self, triangle):
-        for vertex in triangle.vertices:
-            self.addPoint(vertex)
-
     def addMargin(self, margin):
         self.min.x -= margin
         self.min.y -= margin
@@ -204,9 +325,11 @@ class BoundingBox3D(object):
         self.min = self.min.min(v)
         self.max = self.max.max(v)
 
-    def addTriangle(self, triangle):
-        for vertex in triangle.vertices:
-            self.addPoint(vertex)
+    def addMesh(self, mesh):
+        if mesh.getVertexCount() > 0:
+            low, high = mesh.getBounds()
+            self.addPoint(low)
+            self.addPoint(high)
 
     def addMargin(self, margin):
         self.min.x -= margin
@@ -225,150 +348,271 @@ class BoundingBox3D(object):
     def __str__(self):
         return "BBOX([%g,%g,%g] - [%g,%g,%g])" % (self.min.x, self.min.y, self.min.z, self.max.x, self.max.y, self.max.z)
 
-# A 2-dimensional triangle.
-class Triangle2D(object):
-    # Vertices is a list of Vector2.
-    def __init__(self, vertices):
-        self.vertices = vertices
-
-# A 3-dimensional triangle.
-class Triangle3D(object):
-    # Vertices is a list of Vector3.
-    def __init__(self, vertices):
-        self.vertices = vertices
-
-        # Compute normal.
-        v1 = vertices[0] - vertices[2]
-        v2 = vertices[0] - vertices[1]
-        self.normal = v1.cross(v2)
-        if self.normal.length() != 0:
-            self.normal = self.normal.normalized()
-
-    # Rotate this 3D triangle by angle, transform it, project it onto 2D, and return
-    # a 2D triangle.
-    def project(self, transform, angle):
-        return Triangle2D([vertex.project(transform, angle) for vertex in self.vertices])
-
-    # Return a copy of the triangle rotated 90 degrees around the X axis. This is for
-    # converting models from around-Y to around-Z.
-    def rotatex90(self):
-        return Triangle3D([v.rotatex90() for v in self.vertices])
-
-    # Translate this triangle by the vector.
-    def __add__(self, vector3):
-        return Triangle3D([v + vector3 for v in self.vertices])
-
-    # Translate this triangle by the negative of the vector.
-    def __sub__(self, vector3):
-        return Triangle3D([v - vector3 for v in self.vertices])
-
-# Two 2D vectors representing an edge of the object.
-class Edge(object):
-    def __init__(self, v1, v2):
-        self.v1 = v1
-        self.v2 = v2
-
-        # Flag for whether we've used this edge in the path-building algorithm.
-        self.used = False
-
-    def __hash__(self):
-        # Don't hash "used", that's not part of the value.
-        return hash((self.v1, self.v2))
-
-    def __eq__(self, other):
-        return (self.v1, self.v2) == (other.v1, other.v2)
-
-# Return an image of the 3D triangles in an image of the width and height
-# specified.  The triangles are rotated by angle around the Z axis. If
+# Return an image of the 3D mesh in an image of the width and height
+# specified.  The mesh is rotated by angle around the Z axis. If
 # the "light" 3D vector is not None, the triangles are lit by a light
-# pointed to by that vector.
-def render(triangles, width, height, angle, light):
+# pointed to by that vector. The result of project_mesh() for this
+# angle can be passed in "projection" if it's already known.
+def render(mesh, width, height, angle, light, projection=None):
     print "Rendering at angle %g" % int(angle*180/math.pi)
 
-    bbox = BoundingBox2D()
+    if projection is None:
+        projection = project_mesh(mesh, width, height, angle)
+    transform, xs, ys = projection
+
+    if not light and BATCH_RASTERIZER and ANTIALIAS_FACTOR > 1:
+        coverage = rasterize.fill_coverage(xs, ys, mesh.faces, width, height, ANTIALIAS_FACTOR,
+                adaptive=ADAPTIVE_RASTERIZER)
+        img = Image.fromarray(coverage, RASTER_MODE)
+
+        if CHECK_RASTERIZER and ADAPTIVE_RASTERIZER:
+            check_coverage = rasterize.fill_coverage(xs, ys, mesh.faces, width, height,
+                    ANTIALIAS_FACTOR)
+            different = (coverage != check_coverage).sum()
+            if different != 0:
+                print "Adaptive rasterizer differs from the full one in %d pixels." % different
+    elif not light and BATCH_RASTERIZER:
+        if ADAPTIVE_RASTERIZER:
+            coverage = rasterize.fill_triangles_adaptive(xs, ys, mesh.faces, width, height)
+        else:
+            coverage = rasterize.fill_triangles(xs, ys, mesh.faces, width, height)
+        img = Image.fromarray(np.where(coverage, RASTER_WHITE, RASTER_BLACK).astype(np.uint8), RASTER_MODE)
+
+        if CHECK_RASTERIZER:
+            check_img = draw_triangles(mesh, xs, ys, width, height, angle, None)
+            different = (np.asarray(img) != np.asarray(check_img)).sum()
+            if different != 0:
+                print "Batch rasterizer differs from PIL in %d pixels." % different
+    elif BATCH_RASTERIZER:
+        # Each pixel shows the nearest front-facing triangle.
+        front, colors = get_face_colors(mesh, angle, light)
+        pixels = rasterize.fill_triangles_depth_tested(xs, ys, mesh.getDepths(angle),
+                mesh.faces[front], colors, width, height)
+        img = Image.fromarray(pixels, RASTER_MODE)
+    else:
+        img = draw_triangles(mesh, xs, ys, width, height, angle, light)
 
-    transform = Transform.makeIdentity()
+    return img, transform
 
-    for triangle in triangles:
-        triangle2d = triangle.project(transform, angle)
-        bbox.addTriangle(triangle2d)
+# Return a boolean array of the faces of the mesh that face the viewer when
+# it's rotated by angle around the Z axis, and an array of their pixel values
+# when lit by a light pointed to by the "light" vector.
+def get_face_colors(mesh, angle, light):
+    normals = mesh.getRotatedNormals(angle)
 
-    # Pad so we don't run into the edge of the image.
-    bbox.addMargin(bbox.size().x/10)
+    # Remove backfacing triangles.
+    front = normals[:,0] <= 0
 
-    # Map from object bounding box to raster size.
-    transform = Transform.makeMap(bbox, width, height)
+    # Compute diffuse component of lighting and convert to pixel value.
+    diffuse = normals[front].dot([light.x, light.y, light.z])
+    colors = (np.maximum(diffuse, 0)*255 + 0.5).astype(np.uint8)
 
-    # Create image.
-    img = Image.new(RASTER_MODE, (width, height))
-    draw = ImageDraw.Draw(img)
+    return front, colors
 
-    # Draw the triangles.
-    for triangle in triangles:
-        triangle2d = triangle.project(transform, angle)
+# Least-recently-used cache of rendered images, so that passes after the
+# first don't render the same silhouettes again. Holds at most "max_bytes"
+# of pixels.
+class RenderCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
 
-        if light:
-            # Remove backfacing triangles.
-            if triangle.normal.x > 0:
-                continue
+        # Map from key to (mesh, image, transform), oldest first. The mesh is
+        # kept so its id isn't reused while it's in a key.
+        self.entries = collections.OrderedDict()
 
-            # Compute diffuse component of lighting.
-            diffuse = triangle.normal.dot(light)
-            if diffuse < 0:
-                diffuse = 0
+    @staticmethod
+    def makeKey(mesh, width, height, angle, light):
+        light_key = None if light is None else (light.x, light.y, light.z)
+        return (id(mesh), width, height, angle, light_key)
+
+    # Return a copy of the cached (image,transform) pair for these parameters,
+    # or None if it's not in the cache.
+    def get(self, mesh, width, height, angle, light):
+        key = RenderCache.makeKey(mesh, width, height, angle, light)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+
+        # Move to the most-recently-used end.
+        self.entries[key] = entry
+        _, image, transform = entry
+        return image.copy(), Transform(transform.scale, transform.offx, transform.offy)
+
+    # Store a copy of the image, evicting the least-recently-used images to make room.
+    def put(self, mesh, width, height, angle, light, image, transform):
+        size = get_image_bytes(image)
+        if size > self.max_bytes:
+            return
+
+        key = RenderCache.makeKey(mesh, width, height, angle, light)
+        old_entry = self.entries.pop(key, None)
+        if old_entry is not None:
+            self.bytes -= get_image_bytes(old_entry[1])
+
+        while self.entries and self.bytes + size > self.max_bytes:
+            _, (_, old_image, _) = self.entries.popitem(last=False)
+            self.bytes -= get_image_bytes(old_image)
+
+        self.entries[key] = (mesh, image.copy(), transform)
+        self.bytes += size
+
+# Number of bytes of pixel data in the image.
+def get_image_bytes(image):
+    width, height = image.size
+    return width*height*len(image.getbands())
+
+# Renders of this process.
+render_cache = RenderCache(RENDER_CACHE_BYTES)
+
+# Same as render(), but returns a copy of an earlier image if it's been made
+# before with the same parameters.
+def render_cached(mesh, width, height, angle, light, projection=None):
+    result = render_cache.get(mesh, width, height, angle, light)
+    if result is None:
+        result = render(mesh, width, height, angle, light, projection)
+        render_cache.put(mesh, width, height, angle, light, *result)
+    else:
+        print "Reusing render at angle %g" % int(angle*180/math.pi)
 
-            # Convert to pixel value.
-            color = int(diffuse*255 + 0.5)
-        else:
-            color = RASTER_WHITE
+    return result
 
-        draw.polygon([(v.x, v.y) for v in triangle2d.vertices], fill=color, outline=color)
+# Draw the faces of the mesh one by one with PIL at the raster coordinates
+# "xs" and "ys", and return the image. Lit like render(), with the faces
+# sorted back-to-front.
+def draw_triangles(mesh, xs, ys, width, height, angle, light):
+    # Create image.
+    img = Image.new(RASTER_MODE, (width, height))
+    draw = ImageDraw.Draw(img)
 
-    return img, transform
+    faces = mesh.faces
+    if light:
+        front, colors = get_face_colors(mesh, angle, light)
+        faces = faces[front]
 
-# Return the height below the object where there are no on pixels.
-def get_base_height(image):
-    width, height = image.size
+        # Painter's algorithm, farthest first.
+        order = np.argsort(-mesh.getDepths(angle)[faces].mean(axis=1), kind="mergesort")
+        faces = faces[order]
+        colors = colors[order].tolist()
+    else:
+        colors = None
 
-    for y in range(height):
-        for x in range(width):
-            pixel = image.getpixel((x, height - 1 - y))
-            if pixel != 0:
-                return y
+    # (M,3,2) array of projected triangles, as nested lists for PIL.
+    triangles = np.dstack((xs[faces], ys[faces])).tolist()
 
-    raise Exception("base not found")
+    # Draw the triangles.
+    for index, triangle in enumerate(triangles):
+        color = colors[index] if colors else RASTER_WHITE
+        draw.polygon([tuple(v) for v in triangle], fill=color, outline=color)
+
+    return img
+
+# Project the mesh rotated by angle around the Z axis, and fit it into an
+# image of the width and height specified. Returns the transform from model
+# to raster coordinates and arrays of the raster X and Y of each vertex.
+def project_mesh(mesh, width, height, angle):
+    transforms, xs, ys = project_mesh_angles(mesh, width, height, [angle])
+    return transforms[0], xs[0], ys[0]
+
+# Same as project_mesh() but for all the angles in one go. Returns a list of
+# transforms and (A,N) arrays of raster X and Y, one row per angle.
+def project_mesh_angles(mesh, width, height, angle_list):
+    xs = mesh.projectAngles(angle_list)
+    zs = mesh.vertices[:,2]
+
+    # The vertical extent doesn't depend on the angle.
+    min_z = zs.min()
+    max_z = zs.max()
+    min_xs = xs.min(axis=1)
+    max_xs = xs.max(axis=1)
+
+    transforms = []
+    for min_x, max_x in zip(min_xs, max_xs):
+        bbox = BoundingBox2D()
+        bbox.addPoint(Vector2(min_x, min_z))
+        bbox.addPoint(Vector2(max_x, max_z))
+
+        # Pad so we don't run into the edge of the image.
+        bbox.addMargin(bbox.size().x/10)
+
+        # Map from object bounding box to raster size.
+        transforms.append(Transform.makeMap(bbox, width, height))
+
+    scales = np.array([t.scale for t in transforms])[:,np.newaxis]
+    offxs = np.array([t.offx for t in transforms])[:,np.newaxis]
+    offys = np.array([t.offy for t in transforms])[:,np.newaxis]
+
+    return transforms, xs*scales + offxs, zs*scales + offys
+
+# Return a copy of the mesh cleaned up and decimated as much as is possible
+# without any silhouette rendered at this size moving by more than
+# DECIMATE_ERROR_PIXELS. "scale" converts from model units to dots.
+def decimate_for_render(mesh, width, height, angle_list, scale):
+    # Smallest rendered pixel of any angle, in model units. Anti-aliased
+    # silhouettes are rendered ANTIALIAS_FACTOR times finer than the raster.
+    transforms, _, _ = project_mesh_angles(mesh, width, height, angle_list)
+    pixel_size = min(1.0/transform.scale for transform in transforms)/ANTIALIAS_FACTOR
+    max_error = DECIMATE_ERROR_PIXELS*pixel_size
+    print "Decimating to %.5f inches (%g pixels)..." % (max_error*scale/DPI, DECIMATE_ERROR_PIXELS)
+
+    face_count = mesh.getFaceCount()
+    mesh = mesh.welded()
+    cleaned = mesh.withoutDegenerateFaces().withoutUnusedVertices()
+    print "Removed %d degenerate or duplicate faces." % (face_count - cleaned.getFaceCount())
+
+    # The centroid of a cluster is within its cell's diagonal of every vertex.
+    decimated = cleaned.clustered(max_error/math.sqrt(3))
+    print "Decimation removed %d faces, leaving %d of %d." % (
+            cleaned.getFaceCount() - decimated.getFaceCount(),
+            decimated.getFaceCount(), face_count)
+
+    return decimated
+
+# Return the lowest row of the pixels, a 2D array, that has an on pixel.
+def get_lowest_row(pixels):
+    on_rows = np.nonzero(pixels.any(axis=1))[0]
+    if len(on_rows) == 0:
+        raise Exception("base not found")
+
+    return on_rows[-1]
+
+# Modify the pixels in-place to add a base below "lowest_row" and a
+# rectangle of width "shade_width" down the middle of the image so we can
+# spiral into the rod. "pixels" holds the rows of the image starting at
+# "first_row".
+def add_base_and_shade(pixels, lowest_row, shade_width, shade_center_x, first_row=0):
+    start_x = shade_center_x - shade_width/2
 
-# Modify the image in-place to add a base to the bottom of it.
-def add_base(image):
-    width, height = image.size
-    base_height = get_base_height(image)
+    pixels[max(lowest_row + 1 - first_row, 0):] = RASTER_WHITE
+    pixels[:,max(start_x, 0):max(start_x + shade_width, 0)] = RASTER_WHITE
 
-    for y in range(base_height):
-        for x in range(width):
-            image.putpixel((x, height - 1 - y), RASTER_WHITE)
+# Set the top "size" rows of the image to color, in-place. "pixels" is as
+# for add_base_and_shade().
+def clear_top(pixels, size, color, first_row=0):
+    pixels[:max(size - first_row, 0)] = color
 
-# Draw a rectangle of width "shade_width" down the middle of the image
-# so we can spiral into the rod.
-def add_shade(image, shade_width, shade_center_x):
-    width, height = image.size
-    start_x = shade_center_x - shade_width/2
+# Extend the shape in the pixels by the radius and return the new pixels.
+def add_kerf(pixels, radius):
+    print "Adding kerf of radius %.2f" % radius
 
-    for y in range(height):
-        for x in range(shade_width):
-            image.putpixel((start_x + x, y), RASTER_WHITE)
+    if ANTIALIAS_FACTOR > 1:
+        # Keep the anti-aliasing.
+        return morphology.dilate_disk(pixels, radius)
 
-# Clear the top "size" pixels of the image.
-def clear_top(image, size, color):
-    width, height = image.size
+    mask = morphology.dilate_binary_disk(pixels == RASTER_WHITE, radius)
+    new_pixels = np.where(mask, RASTER_WHITE, RASTER_BLACK).astype(np.uint8)
 
-    for y in range(0, size):
-        for x in range(width):
-            image.putpixel((x, y), color)
+    if CHECK_KERF:
+        check_image = draw_kerf_arcs(Image.fromarray(pixels, RASTER_MODE), radius)
+        different = (new_pixels != np.asarray(check_image)).sum()
+        print "Kerf differs from arcs in %d pixels." % different
 
-# Extend the shape in the image by the radius and return the new image.
-def add_kerf(image, radius):
-    print "Adding kerf of radius %.2f" % radius
+    return new_pixels
 
+# Extend the shape in the image by drawing a circle of the radius around
+# each of its pixels, and return the new image. This was add_kerf() before
+# it used a disk dilation, and is slow.
+def draw_kerf_arcs(image, radius):
     width, height = image.size
     new_image = Image.new(RASTER_MODE, (width, height))
     draw = ImageDraw.Draw(new_image)
@@ -381,31 +625,46 @@ def add_kerf(image, radius):
 
     return new_image
 
-# Return a list of 3D triangles.
+# Return the model as a mesh.Mesh. The format is picked by the extension:
+# STL, OBJ, or the JSON made by http://www.greentoken.de/onlineconv/.
 def loadFile(filename):
     print "Loading model..."
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "stl":
+        return meshfile.load_stl(filename).withoutUnusedVertices()
+    elif extension == "obj":
+        return meshfile.load_obj(filename).withoutUnusedVertices()
+
     data = json.load(open(filename))
 
-    vertices = []
-    triangles = []
+    meshes = []
 
-    for mesh in data["meshes"]:
-        rawVertices = mesh["vertices"]
-        rawNormals = mesh["normals"]
-        rawFaces = mesh["faces"]
+    for rawMesh in data["meshes"]:
+        meshes.append(meshlib.Mesh(rawMesh["vertices"], rawMesh["faces"]))
 
-        vertexOffset = len(vertices)
+    return meshlib.concatenate(meshes).withoutUnusedVertices()
 
-        vertices.extend([
-            Vector3(rawVertices[i*3 + 0], rawVertices[i*3 + 1], rawVertices[i*3 + 2])
-            for i in range(len(rawVertices)/3)])
+# Return the model in the file rotated "rotation_count" times around X,
+# using the compiled mesh cache if possible.
+def load_model(filename, rotation_count):
+    if MESH_CACHE_DIR is not None:
+        key = meshcache.get_key(filename, rotation_count)
+        mesh = meshcache.read_mesh(MESH_CACHE_DIR, key, CHECK_MESH_CACHE)
+        if mesh is not None:
+            print "Loaded model from mesh cache."
+            return mesh
 
-        triangles.extend([Triangle3D([
-            vertices[vertexOffset + face[0]],
-            vertices[vertexOffset + face[1]],
-            vertices[vertexOffset + face[2]]]) for face in rawFaces])
+    mesh = loadFile(filename)
 
-    return triangles
+    for i in range(rotation_count):
+        # We need the model to be around Z. If it's around Y, transform the initial
+        # geometry so that the rest of the program doesn't have to concern itself with it.
+        mesh = mesh.rotatex90()
+
+    if MESH_CACHE_DIR is not None:
+        meshcache.write_mesh(MESH_CACHE_DIR, key, mesh)
+
+    return mesh
 
 # Return "count" angles (in radians) going around the circle.
 def angles(count):
@@ -419,114 +678,41 @@ def half_list(lst):
 def identify_last(lst):
     return [(index == len(lst) - 1, item) for index, item in enumerate(lst)]
 
-# Return a list of paths of Vector2() for this image.
+# Return a list of paths of Vector2() along the edges of the white pixels of
+# this image.
 def get_outlines(image):
-    edges = []
-
-    # Generate edges for each pixel.
-    print "Generating edges..."
-    width, height = image.size
-    for y in range(height - 1):
-        for x in range(width - 1):
-            this = image.getpixel((x, y))
-            right = image.getpixel((x + 1, y))
-            down = image.getpixel((x, y + 1))
-
-            if this != right:
-                edges.append(Edge(Vector2(x + 1, y), Vector2(x + 1, y + 1)))
-            if this != down:
-                edges.append(Edge(Vector2(x, y + 1), Vector2(x + 1, y + 1)))
-    print "Made %d edges." % len(edges)
-    if not edges:
+    print "Tracing outlines..."
+    paths, holes = contour.get_pixel_outlines(np.asarray(image) == RASTER_WHITE)
+    print "Made %d paths (%d around holes) with %d vertices." % (len(paths),
+            sum(holes), sum(len(path) for path in paths))
+    if not paths:
         print "Error: Found no pixels in image."
         sys.exit(1)
 
-    # Put into a hash by the edges.
-    print "Hashing edges..."
-    edgemap = collections.defaultdict(list)
-    for edge in edges:
-        edgemap[edge.v1].append(edge)
-        edgemap[edge.v2].append(edge)
-    print "Found %d unique vertices." % len(edgemap)
-
-    # Walk around, starting at any edge.
-    print "Making sequence of vertices..."
-    paths = []
-    vertices = []
-    paths.append(vertices)
-    edge = edges[0]
-    vertices.append(edge.v1)
-    vertex = edge.v2
-    while True:
-        edge.used = True
-        vertices.append(vertex)
-        connected_edges = [edge for edge in edgemap[vertex] if not edge.used]
-        if not connected_edges:
-            edges = [edge for edge in edges if not edge.used]
-            if not edges:
-                # No more vertices to add.
-                break
-            # Done on this end. See if we can continue on the other end, in case
-            # it's not a closed path.
-            vertices.reverse()
-            vertex = vertices[-1]
-            connected_edges = [edge for edge in edgemap[vertex] if not edge.used]
-        if not connected_edges:
-            # Start new path.
-            vertices = []
-            paths.append(vertices)
-            edge = edges[0]
-            vertices.append(edge.v1)
-            vertex = edge.v2
-        else:
-            # Extend current path.
-            edge = connected_edges[0]
-            if edge.v1 == vertex:
-                vertex = edge.v2
-            else:
-                vertex = edge.v1
-    edges = [edge for edge in edges if not edge.used]
-    print "Sequence has %d vertices, with %d edges unused." % (len(vertices), len(edges))
+    return paths
+
+# Return a list of paths of Vector2() around the shapes of this anti-aliased
+# image, traced half-way between black and white at sub-pixel positions.
+def get_subpixel_outlines(image):
+    print "Tracing sub-pixel contours..."
+    paths = contour.get_contours(image, (RASTER_BLACK + RASTER_WHITE)/2.0)
+    print "Made %d paths with %d vertices." % (len(paths), sum(len(path) for path in paths))
+    if not paths:
+        print "Error: Found no pixels in image."
+        sys.exit(1)
 
     return paths
 
-# Given points v1 and v2 and point v, returns the distance from v to the line v1,v2.
-def distance_to_line(v, v1, v2):
-    segment = v1 - v2
-    n = segment.reciprocal().normalized()
-    return math.fabs((v - v1).dot(n))
-
-# Given a list of vertices and a distance, returns a new list with vertices
-# removed if they add less than epsilon of detail.
-def simplify_vertices(vertices, epsilon):
-    # http://en.wikipedia.org/wiki/Ramer%E2%80%93Douglas%E2%80%93Peucker_algorithm
-
-    # Find the point with the maximum distance
-    max_dist = 0
-    index = 0
-    first = 0
-    last = len(vertices) - 1
-    for i in range(first + 1, last):
-        # print vertices[i], vertices[first], vertices[last]
-        if vertices[first] == vertices[last]:
-            dist = (vertices[i] - vertices[first]).length()
-        else:
-            dist = distance_to_line(vertices[i], vertices[first], vertices[last])
-        if dist > max_dist:
-            index = i
-            max_dist = dist
-
-    # If max distance is greater than epsilon, recursively simplify
-    if max_dist > epsilon:
-        # Recursive call
-        first_half = simplify_vertices(vertices[first:index+1], epsilon)
-        second_half = simplify_vertices(vertices[index:last+1], epsilon)
-
-        # Skip the duplicate middle vertex.
-        return first_half[:-1] + second_half
+# Given a list of paths and a distance, returns a new list of paths with
+# vertices removed if they add less than epsilon of detail, as set by
+# SIMPLIFY_METHOD.
+def simplify_outlines(paths, epsilon):
+    if SIMPLIFY_METHOD == "visvalingam":
+        return simplify.simplify_paths(paths, epsilon, SIMPLIFY_VERTEX_BUDGET, epsilon*epsilon)
+    elif SIMPLIFY_METHOD == "rdp":
+        return simplify.simplify_paths(paths, epsilon)
     else:
-        # None are far enough, just keep the ends.
-        return [vertices[first], vertices[last]]
+        raise Exception("unknown simplification method " + SIMPLIFY_METHOD)
 
 # Return the vertices transformed by the inverse of the transform.
 def transform_vertices(vertices, transform, scale):
@@ -578,59 +764,412 @@ def make_time_waster(long_delay):
     return [points]
 
 
-def generate_svg(out, paths):
-    out.write("""<?xml version="1.0" encoding="utf-8"?>
-<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.0//EN"
-"http://www.w3.org/TR/2001/REC-SVG-20010904/DTD/svg10.dtd" [
-<!ENTITY ns_svg "http://www.w3.org/2000/svg">
-]>
-<svg xmlns="&ns_svg;" width="%d" height="%d" overflow="visible" style="background: %s">
-""" % (SVG_WIDTH, SVG_HEIGHT, BACKGROUND_COLOR))
+def generate_svg(filename, paths):
+    writer = svg.SvgWriter.open(filename, SVG_WIDTH, SVG_HEIGHT, FOREGROUND_COLOR,
+            STROKE_WIDTH, BACKGROUND_COLOR, SVG_DECIMALS, SVG_RELATIVE)
     for path in paths:
-        out.write("""<polyline fill="none" stroke="%s" stroke-width="%g" points=" """ % (FOREGROUND_COLOR, STROKE_WIDTH))
-        for vertex in path:
-            out.write(" %g,%g" % (vertex.x, vertex.y))
-        out.write(""" "/>\n""")
-    out.write("""</svg>
-""")
+        writer.addPath(path)
+    writer.close()
+
+# Return the paths as (N,2) int arrays at "dpi", without the vertices that
+# don't change the cut once they're truncated to whole units. See
+# simplify.quantize_paths().
+def quantize_outlines(paths, dpi):
+    vertex_count = sum(len(path) for path in paths)
+    quantized, repeated_count, collinear_count, dropped_count = simplify.quantize_paths(
+            [np.array([(v.x, v.y) for v in path], dtype=np.float64).reshape(-1, 2)*dpi/DPI
+                for path in paths])
+    print "Quantized %d vertices to %d DPI, leaving %d: removed %d repeated, %d collinear, and %d paths." % (
+            vertex_count, dpi, sum(len(points) for points in quantized),
+            repeated_count, collinear_count, dropped_count)
+
+    return quantized
 
 def generate_vector(out, paths):
-    for path in paths:
-        for index, vertex in enumerate(path):
-            command = "M" if index == 0 else "L"
-            x = int(vertex.x*VECTOR_DPI/DPI)
-            y = int(vertex.y*VECTOR_DPI/DPI)
-            out.write("%s%d,%d\n" % (command, y, x))
+    for points in quantize_outlines(paths, VECTOR_DPI):
+        # Y comes first.
+        out.write(("M%d,%d\n" + "L%d,%d\n"*(len(points) - 1)) %
+                tuple(points[:,::-1].ravel().tolist()))
     out.write("X\n")
 
 def generate_prn(out, paths, title):
     doc = Document(title)
-    dpi = doc.getResolution()
-    for path in paths:
+    for points in quantize_outlines(paths, doc.getResolution()):
         cut = Cut(4, 100, 50)
-        # Convert to doc's resolution.
-        cut.points = [Vector2(p.x*dpi/DPI, p.y*dpi/DPI) for p in path]
+        cut.points = points
         doc.addCut(cut)
 
     epilog.generate_prn(out, doc)
+    print "Estimated job time: %s." % prnfile.estimate_time(doc)
+
+# Return the list of paths as curves.CurvePath objects, fitted as for
+# FIT_CURVES.
+def fit_curves(paths):
+    tolerance = CURVE_TOLERANCE_IN*DPI
+    curve_paths = [curves.fit_path(path, tolerance) for path in paths]
+    print "Fitted %d lines, %d arcs and %d cubic curves to %d vertices." % tuple(
+            [sum(path.getSegmentCount(kind) for path in curve_paths)
+                for kind in (curves.LINE, curves.ARC, curves.CUBIC)] +
+            [sum(len(path) for path in paths)])
+
+    return curve_paths
 
 def generate_file(basename, paths):
     filename = basename + "." + OUTPUT_EXTENSION
 
-    out = open(filename, "w")
-    if OUTPUT_EXTENSION == "svg":
-        generate_svg(out, paths)
-    elif OUTPUT_EXTENSION == "vector":
-        generate_vector(out, paths)
-    elif OUTPUT_EXTENSION == "prn":
-        generate_prn(out, paths, basename)
+    if FIT_CURVES:
+        curve_paths = fit_curves(paths)
+        if OUTPUT_EXTENSION in ("svg", "svgz"):
+            paths = curve_paths
+        else:
+            tessellated = [path.tessellate(CURVE_TOLERANCE_IN*DPI) for path in curve_paths]
+            paths = [points if len(points) < len(path) else path
+                    for points, path in zip(tessellated, paths)]
+            print "Kept the curves of %d of %d outlines." % (
+                    sum(1 for points, path in zip(tessellated, paths) if points is path), len(paths))
+
+    if OUTPUT_EXTENSION in ("svg", "svgz"):
+        generate_svg(filename, paths)
     else:
-        raise Exception("Unknown extension " + OUTPUT_EXTENSION)
-    out.close()
+        out = open(filename, "wb" if OUTPUT_EXTENSION == "prn" else "w")
+        if OUTPUT_EXTENSION == "vector":
+            generate_vector(out, paths)
+        elif OUTPUT_EXTENSION == "prn":
+            generate_prn(out, paths, basename)
+        else:
+            raise Exception("Unknown extension " + OUTPUT_EXTENSION)
+        out.close()
 
     print "Generated \"%s\"." % filename
 
+# Return the distance to grow the shape by for the kerf, in inches.
+def get_kerf_in(shade_percent):
+    kerf = KERF_RADIUS_IN
+    if shade_percent != 0:
+        # Rough cut, add some spacing so we don't char the wood.
+        kerf += ROUGH_EXTRA_IN
+
+    return kerf
+
+# Simplify the outlines, which are in raster coordinates, convert them to
+# dots, and offset them for the kerf if VECTOR_KERF.
+def finish_outlines(paths, shade_percent, transform, scale):
+    paths = simplify_outlines(paths, 1)
+
+    # Edges along the top, which clear_top() made, stay put.
+    top = CLEAR_TOP_ROWS + 0.5 if shade_percent > 0 else -1
+    fixed = [[a.y <= top and b.y <= top for a, b in zip(vertices[:-1], vertices[1:])]
+            for vertices in paths]
+
+    paths = [transform_vertices(vertices, transform, scale) for vertices in paths]
+
+    if VECTOR_KERF:
+        radius = get_kerf_in(shade_percent)*DPI
+        print "Offsetting by kerf of %.2f dots" % radius
+        # Outlines have the white pixels on the reciprocal() side of their edges.
+        sides = [-1]*len(paths)
+        kerf_paths = offset.offset_paths(paths, sides, radius, KERF_JOIN_TOLERANCE_IN*DPI, fixed)
+
+        if CHECK_VECTOR_KERF:
+            opened = (sum(1 for path in kerf_paths if not path[0] == path[-1]) -
+                    sum(1 for path in paths if not path[0] == path[-1]))
+            if opened > 0:
+                print "Vector kerf opened %d outlines." % opened
+
+        paths = kerf_paths
+
+    return paths
+
+# Everything the per-angle work needs to know about the model.
+class AngleJob(object):
+    def __init__(self, mesh, cut_angles, projections, scale, light):
+        self.mesh = mesh
+        self.cut_angles = cut_angles
+        self.projections = projections
+        self.scale = scale
+        self.light = light
+
+        # What the last pass made, for INCREMENTAL_PASSES.
+        self.previous_pass = None
+
+    # Make the image for one angle of one pass and return its paths. "task"
+    # is a tuple of (index, pass_number, shade_percent, angle_index).
+    def run(self, task):
+        index, pass_number, shade_percent, angle_index = task
+        angle = self.cut_angles[angle_index]
+        projection = self.projections[angle_index]
+        mesh = self.mesh
+        scale = self.scale
+
+        print "------------------ Making pass %d (%d%%), angle %d" % (pass_number, shade_percent, angle_index)
+
+        if TILE_ROWS is not None:
+            paths, transform = get_tiled_outlines(mesh, IMAGE_SIZE*RENDER_SCALE,
+                    IMAGE_SIZE*RENDER_SCALE, projection, shade_percent, scale)
+            paths = finish_outlines(paths, shade_percent, transform, scale)
+            print
+
+            return paths
+
+        if GENERATE_LIT_VERSION:
+            image, _ = render_cached(mesh, IMAGE_SIZE*RENDER_SCALE, IMAGE_SIZE*RENDER_SCALE, angle, self.light, projection)
+            image.save("out%02d-lit.png" % index)
+        image, transform = render_cached(mesh, IMAGE_SIZE*RENDER_SCALE, IMAGE_SIZE*RENDER_SCALE, angle, None, projection)
+        image.save("out%02d-render.png" % index)
+        pixels = np.array(image)
+
+        # Add the base and the shade (for spiraling). The "transform"
+        # converts from model units to raster coordinates. "scale" converts
+        # from model units to dots. DPI converts from inches to dots.
+        shade_width = int(ROD_DIAMETER*shade_percent/100.0*transform.scale/scale*DPI)
+        shade_center_x = int(transform.offx)
+        add_base_and_shade(pixels, get_lowest_row(pixels), shade_width, shade_center_x)
+        Image.fromarray(pixels, RASTER_MODE).save("out%02d-shade.png" % index)
+
+        kerf_radius = 0 if VECTOR_KERF else get_kerf_in(shade_percent)*transform.scale/scale*DPI
+        previous = self.previous_pass
+        self.previous_pass = None
+        if (INCREMENTAL_PASSES and ANTIALIAS_FACTOR == 1 and previous is not None and
+                previous.angle_index == angle_index and previous.kerf_radius == kerf_radius and
+                previous.cleared == (shade_percent > 0)):
+
+            paths = previous.update(self, pixels, shade_percent, transform)
+            Image.fromarray(self.previous_pass.pixels, RASTER_MODE).save("out%02d-kerf.png" % index)
+            print
+
+            return paths
+
+        shaded = pixels
+
+        # Expand to take into account the kerf.
+        if not VECTOR_KERF:
+            pixels = add_kerf(pixels, kerf_radius)
+
+        # Cut off the sides when we're shading.
+        if shade_percent > 0:
+            clear_top(pixels, CLEAR_TOP_ROWS, RASTER_WHITE)
+
+        image = Image.fromarray(pixels, RASTER_MODE)
+        image.save("out%02d-kerf.png" % index)
+
+        if ANTIALIAS_FACTOR > 1:
+            paths = get_subpixel_outlines(image)
+        else:
+            paths = get_outlines(image)
+        finished_paths = finish_outlines(paths, shade_percent, transform, scale)
+        print
+
+        if INCREMENTAL_PASSES:
+            self.previous_pass = PassResult(angle_index, kerf_radius, shade_percent > 0,
+                    shaded, pixels, paths, finished_paths)
+
+        return finished_paths
+
+# The images and outlines of a pass at one angle, which the next pass at the
+# same angle can update when only its shade has changed.
+class PassResult(object):
+    def __init__(self, angle_index, kerf_radius, cleared, shaded, pixels, paths, finished_paths):
+        self.angle_index = angle_index
+        self.kerf_radius = kerf_radius
+        self.cleared = cleared
+
+        # The pixels before and after add_kerf() and clear_top().
+        self.shaded = shaded
+        self.pixels = pixels
+
+        # The outlines before and after finish_outlines().
+        self.paths = paths
+        self.finished_paths = finished_paths
+
+    # Return the finished paths for the "shaded" pixels of a pass with the
+    # same kerf and clearing. Only the columns of the image that the new
+    # shade changes, and those the kerf reaches from them, are processed
+    # and traced again. Sets the job's previous pass to the result.
+    def update(self, job, shaded, shade_percent, transform):
+        height, width = shaded.shape
+        reach = int(math.ceil(self.kerf_radius))
+        pixels = self.pixels.copy()
+
+        # The kerf of a column only depends on those within its reach.
+        changed = np.nonzero((shaded != self.shaded).any(axis=0))[0]
+        for first, last in get_column_runs(changed, 2*reach):
+            first = max(first - reach, 0)
+            last = min(last + reach, width - 1)
+            if VECTOR_KERF:
+                pixels[:,first:last + 1] = shaded[:,first:last + 1]
+            else:
+                left = max(first - reach, 0)
+                right = min(last + reach + 1, width)
+                band = add_kerf(shaded[:,left:right], self.kerf_radius)
+                pixels[:,first:last + 1] = band[:,first - left:last - left + 1]
+        if self.cleared:
+            clear_top(pixels, CLEAR_TOP_ROWS, RASTER_WHITE)
+
+        # Runs of changed columns that are traced together, far enough
+        # apart that the tracing of one doesn't see the others.
+        changed = np.nonzero((pixels != self.pixels).any(axis=0))[0]
+        runs = get_column_runs(changed, 3)
+        if not runs:
+            print "Reusing %d paths." % len(self.paths)
+            paths = self.paths
+            finished_paths = self.finished_paths
+        else:
+            paths = self.paths
+            kept = range(len(paths))
+            for first, last in runs:
+                print "Updating outlines in columns %d to %d..." % (first, last)
+                paths, run_kept = contour.update_pixel_outlines(paths, pixels == RASTER_WHITE, first, last)
+                kept = [kept[index] if index != -1 else -1 for index in run_kept]
+            print "Made %d paths (%d unchanged) with %d vertices." % (len(paths),
+                    sum(1 for index in kept if index != -1), sum(len(path) for path in paths))
+
+            if CHECK_INCREMENTAL_PASSES:
+                check_paths, _ = contour.get_pixel_outlines(pixels == RASTER_WHITE)
+                def get_key(paths):
+                    return sorted([(v.x, v.y) for v in path] for path in paths)
+                if get_key(paths) != get_key(check_paths):
+                    print "Updated outlines differ from a full trace: %d paths against %d." % (
+                            len(paths), len(check_paths))
+
+            if VECTOR_KERF:
+                # The offset of each path depends on all of them.
+                finished_paths = finish_outlines(paths, shade_percent, transform, job.scale)
+            else:
+                new_indices = [i for i, index in enumerate(kept) if index == -1]
+                new_finished = finish_outlines([paths[i] for i in new_indices],
+                        shade_percent, transform, job.scale)
+                finished_paths = [self.finished_paths[index] if index != -1 else None
+                        for index in kept]
+                for i, finished in zip(new_indices, new_finished):
+                    finished_paths[i] = finished
+
+        job.previous_pass = PassResult(self.angle_index, self.kerf_radius, self.cleared,
+                shaded, pixels, paths, finished_paths)
+
+        return finished_paths
+
+# Return a list of (first,last) pairs of the runs of the sorted array of
+# columns, with runs that are no more than "gap" apart merged.
+def get_column_runs(columns, gap):
+    runs = []
+    for column in columns.tolist():
+        if runs and column - runs[-1][1] <= gap + 1:
+            runs[-1][1] = column
+        else:
+            runs.append([column, column])
+
+    return [tuple(run) for run in runs]
+
+# Same as the render, add_base_and_shade(), add_kerf(), clear_top() and
+# get_subpixel_outlines() steps of AngleJob.run(), but TILE_ROWS rows at a
+# time, so the whole image is never in memory. Returns the paths and the
+# transform.
+def get_tiled_outlines(mesh, width, height, projection, shade_percent, scale):
+    transform, xs, ys = projection
+    faces = mesh.faces
+
+    # Rows that each face may touch, allowing for truncation.
+    face_ys = ys[faces]
+    face_top = np.floor(face_ys.min(axis=1)).astype(int) - 1
+    face_bottom = np.floor(face_ys.max(axis=1)).astype(int) + 1
+
+    # Rows [first_row, last_row] of the silhouette.
+    def render_rows(first_row, last_row):
+        selected = faces[(face_bottom >= first_row) & (face_top <= last_row)]
+        return rasterize.fill_coverage(xs, ys, selected, width, last_row - first_row + 1,
+                ANTIALIAS_FACTOR, first_row, ADAPTIVE_RASTERIZER)
+
+    # Find the lowest row with any pixel, for the base, searching up from the bottom.
+    lowest_row = None
+    for last_row in range(height - 1, -1, -TILE_ROWS):
+        first_row = max(last_row - TILE_ROWS + 1, 0)
+        band = render_rows(first_row, last_row)
+        if band.any():
+            lowest_row = first_row + get_lowest_row(band)
+            break
+    if lowest_row is None:
+        raise Exception("base not found")
+
+    # See AngleJob.run().
+    shade_width = int(ROD_DIAMETER*shade_percent/100.0*transform.scale/scale*DPI)
+    shade_center_x = int(transform.offx)
+    if VECTOR_KERF:
+        kerf_radius = 0
+    else:
+        kerf_radius = get_kerf_in(shade_percent)*transform.scale/scale*DPI
+        print "Adding kerf of radius %.2f" % kerf_radius
+
+    # Rows beyond a band that the kerf reaches into it from.
+    halo = int(math.floor(kerf_radius))
+
+    tracer = contour.ContourTracer(width, height, (RASTER_BLACK + RASTER_WHITE)/2.0)
+    first_row = 0
+    while True:
+        last_row = min(first_row + TILE_ROWS, height - 1)
+        render_first = max(first_row - halo, 0)
+        render_last = min(last_row + halo, height - 1)
+
+        band = render_rows(render_first, render_last)
+        add_base_and_shade(band, lowest_row, shade_width, shade_center_x, render_first)
+        band = morphology.dilate_disk(band, kerf_radius)
+        band = band[first_row - render_first:last_row - render_first + 1]
+
+        if shade_percent > 0:
+            clear_top(band, CLEAR_TOP_ROWS, RASTER_WHITE, first_row)
+
+        # Consecutive bands share their boundary row.
+        tracer.addRows(band, first_row)
+        if last_row == height - 1:
+            break
+        first_row = last_row
+
+    return tracer.getPaths(), transform
+
+# The job of this worker process. Workers get it when they start (inherited
+# when forking), so the mesh isn't pickled for every task.
+worker_job = None
+
+def init_worker(job):
+    global worker_job
+    worker_job = job
+
+def run_worker_task(task):
+    return worker_job.run(task)
+
+# Run the tasks of the job and return their paths in task order, which is
+# the same whether or not they ran in parallel.
+def run_angle_tasks(job, tasks):
+    # Do all passes of an angle together, in the same process, so that only
+    # the first has to render it.
+    order = sorted(range(len(tasks)), key=lambda i: (tasks[i][3], tasks[i][1]))
+    ordered_tasks = [tasks[i] for i in order]
+
+    if PROCESS_COUNT == 1 or len(tasks) <= 1:
+        ordered_results = [job.run(task) for task in ordered_tasks]
+    else:
+        pool = multiprocessing.Pool(PROCESS_COUNT, init_worker, (job,))
+        try:
+            # Hand out one angle (all of its passes) at a time.
+            ordered_results = pool.map(run_worker_task, ordered_tasks, len(PASS_SHADES))
+        finally:
+            pool.terminate()
+
+    results = [None]*len(tasks)
+    for i, paths in zip(order, ordered_results):
+        results[i] = paths
+
+    return results
+
 def main():
+    if ANTIALIAS_FACTOR > 1 and not BATCH_RASTERIZER:
+        raise Exception("ANTIALIAS_FACTOR above 1 requires BATCH_RASTERIZER")
+    if TILE_ROWS is not None and ANTIALIAS_FACTOR <= 1:
+        raise Exception("TILE_ROWS requires ANTIALIAS_FACTOR above 1")
+    if TILE_ROWS is not None and GENERATE_LIT_VERSION:
+        raise Exception("TILE_ROWS can't be used with GENERATE_LIT_VERSION")
+    if TILE_ROWS is not None and INCREMENTAL_PASSES:
+        raise Exception("TILE_ROWS can't be used with INCREMENTAL_PASSES")
+
     model = 0
 
     if model == 0:
@@ -643,18 +1182,12 @@ def main():
         filename = "data/DNA.json"
         rotation_count = 2
 
-    triangles = loadFile(filename)
-    print "The model has %d triangles." % len(triangles)
-
-    for i in range(rotation_count):
-        # We need the model to be around Z. If it's around Y, transform the initial
-        # geometry so that the rest of the program doesn't have to concern itself with it.
-        triangles = [triangle.rotatex90() for triangle in triangles]
+    mesh = load_model(filename, rotation_count)
+    print "The model has %d triangles." % mesh.getFaceCount()
 
     # Single image.
     if True:
-        img, _ = render(triangles, 1024, 1024, 0, None)
-        # add_base(img)
+        img, _ = render(mesh, 1024, 1024, 0, None)
         before = time.time()
         img.save("out.png")
         after = time.time()
@@ -663,7 +1196,7 @@ def main():
 
     # Animated GIF.
     if False:
-        images = [render(triangles, IMAGE_SIZE, IMAGE_SIZE, angle)[0] for angle in angles(ANGLE_COUNT)]
+        images = [render(mesh, IMAGE_SIZE, IMAGE_SIZE, angle)[0] for angle in angles(ANGLE_COUNT)]
 
         fp = open("out.gif", "wb")
         gifmaker.makedelta(fp, images)
@@ -671,27 +1204,37 @@ def main():
 
     # Single SVG.
     if False:
-        image, _ = render(triangles, IMAGE_SIZE*RENDER_SCALE, IMAGE_SIZE*RENDER_SCALE, 0)
+        image, _ = render(mesh, IMAGE_SIZE*RENDER_SCALE, IMAGE_SIZE*RENDER_SCALE, 0)
         paths = get_outlines(image)
-        paths = [simplify_vertices(vertices, 1) for vertices in paths]
+        paths = simplify_outlines(paths, 1)
         generate_file("out", paths)
 
     # All SVGs.
     if True:
         bbox3d = BoundingBox3D()
-        for triangle in triangles:
-            bbox3d.addTriangle(triangle)
+        bbox3d.addMesh(mesh)
 
         center = bbox3d.center()
 
         # Move center to origin.
-        triangles = [triangle - center for triangle in triangles]
+        mesh = mesh - center
 
         # Find scaling factor.
         size = bbox3d.size()
         max_size = max(size.x, size.y)
         scale = MODEL_DIAMETER / max_size * DPI
 
+        cut_angles = half_list(angles(ANGLE_COUNT))
+
+        if DECIMATE_MESH:
+            mesh = decimate_for_render(mesh, IMAGE_SIZE*RENDER_SCALE, IMAGE_SIZE*RENDER_SCALE,
+                    cut_angles, scale)
+
+        # Project the mesh for all angles at once. Each pass reuses these.
+        transforms, xs, ys = project_mesh_angles(mesh, IMAGE_SIZE*RENDER_SCALE,
+                IMAGE_SIZE*RENDER_SCALE, cut_angles)
+        projections = zip(transforms, xs, ys)
+
         # Light vector (to light).
         light = Vector3(-1, 1, 1).normalized()
 
@@ -703,49 +1246,34 @@ def main():
         thetas_file = open("thetas.txt", "w")
         thetas_file.write("lathser://sequence/add?name=fromlink")
 
-        index = 0
+        # Queue up the work for every angle of every pass.
+        tasks = []
+        last_flags = []
         for pass_number, shade_percent in enumerate(PASS_SHADES):
-            print "------------------ Making pass %d (%d%%)" % (pass_number, shade_percent)
-
-            for is_last, angle in identify_last(half_list(angles(ANGLE_COUNT))):
+            for is_last, angle_index in identify_last(range(len(cut_angles))):
                 # We append these into a deep link that can be fed into the app.
-                thetas_file.write("&%g" % angle)
-                if GENERATE_LIT_VERSION:
-                    image, _ = render(triangles, IMAGE_SIZE*RENDER_SCALE, IMAGE_SIZE*RENDER_SCALE, angle, light)
-                    image.save("out%02d-lit.png" % index)
-                image, transform = render(triangles, IMAGE_SIZE*RENDER_SCALE, IMAGE_SIZE*RENDER_SCALE, angle, None)
-                image.save("out%02d-render.png" % index)
-                add_base(image)
-
-                # Add the shade (for spiraling). The "transform" converts from
-                # model units to raster coordinates. "scale" converts from
-                # model units to dots. DPI converts from inches to dots.
-                shade_width = int(ROD_DIAMETER*shade_percent/100.0*transform.scale/scale*DPI)
-                shade_center_x = int(transform.offx)
-                add_shade(image, shade_width, shade_center_x)
-                image.save("out%02d-shade.png" % index)
-
-                # Expand to take into account the kerf.
-                kerf_radius = KERF_RADIUS_IN*transform.scale/scale*DPI
-                if shade_percent != 0:
-                    # Rough cut, add some spacing so we don't char the wood.
-                    kerf_radius += ROUGH_EXTRA_IN*transform.scale/scale*DPI
-                image = add_kerf(image, kerf_radius)
-
-                # Cut off the sides when we're shading.
-                if shade_percent > 0:
-                    clear_top(image, 2, RASTER_WHITE)
-
-                image.save("out%02d-kerf.png" % index)
-
-                paths = get_outlines(image)
-                paths = [simplify_vertices(vertices, 1) for vertices in paths]
-                paths = [transform_vertices(vertices, transform, scale) for vertices in paths]
-                all_paths.extend(paths)
-                all_paths.extend(make_heat_sensor())
-                all_paths.extend(make_time_waster(is_last))
-                index += 1
-                print
+                thetas_file.write("&%g" % cut_angles[angle_index])
+                tasks.append((len(tasks), pass_number, shade_percent, angle_index))
+                last_flags.append(is_last)
+
+        job = AngleJob(mesh, cut_angles, projections, scale, light)
+        results = run_angle_tasks(job, tasks)
+
+        # The head starts at the origin.
+        start = Vector2(0, 0)
+        unordered_paths = []
+        for is_last, paths in zip(last_flags, results):
+            fixed_paths = make_heat_sensor() + make_time_waster(is_last)
+            unordered_paths.extend(paths + fixed_paths)
+            if ORDER_PATHS:
+                paths = ordering.order_paths(paths, all_paths[-1][-1] if all_paths else start)
+            all_paths.extend(paths)
+            all_paths.extend(fixed_paths)
+
+        if ORDER_PATHS:
+            print "Travel between paths: %.1f in, was %.1f in." % (
+                    ordering.get_travel(all_paths, start)/DPI,
+                    ordering.get_travel(unordered_paths, start)/DPI)
 
         generate_file("out", all_paths)
 
@@ -0,0 +1,458 @@
+# Reading of Epilog PRN files as made by epilog.generate_prn(). The PJL,
+# PCL and HPGL are parsed back into a Document of cuts and rasters, and
+# anything out of place in the structure is reported as a problem. The time
+# a job takes on the cutter can be estimated from any Document, read or
+# generated.
+
+import sys
+import re
+import math
+
+# pip install Pillow (https://python-pillow.github.io/)
+from PIL import Image
+
+# pip install numpy (http://www.numpy.org/)
+import numpy as np
+
+from document import Document
+from cut import Cut
+from raster import Raster
+import epilog
+
+# Speed of the head at 100% speed, cutting and engraving, in inches per
+# second. Speeds below 100% scale these. The numbers are rough, and meant
+# for comparing jobs rather than for predicting to the second.
+MAX_VECTOR_SPEED_IN_PER_S = 30.0
+MAX_RASTER_SPEED_IN_PER_S = 100.0
+
+# Speed of the head between cuts, with the laser off.
+TRAVEL_SPEED_IN_PER_S = 30.0
+
+# Acceleration of the head. It's assumed to stop at every vertex of a cut.
+ACCELERATION_IN_PER_S2 = 200.0
+
+# Distance the head goes past either end of an engraved line, and the time
+# it takes to turn around for the next one.
+RASTER_OVERSCAN_IN = 0.25
+RASTER_TURNAROUND_S = 0.02
+
+# PCL escape sequence: a group character, an optional parameter character,
+# and values each followed by a command character, which is lower case if
+# another value follows. Or a two-character escape such as reset.
+PCL_COMMAND = re.compile(r"\x1B(?:([!-/])([`-~]?)((?:[-+]?\d*(?:\.\d*)?[`-~])*[-+]?\d*(?:\.\d*)?[@-^])|([0-~]))")
+PCL_VALUE = re.compile(r"([-+]?\d*(?:\.\d*)?)([@-~])")
+
+# End of the file after the PJL footer.
+FUSION_TRAILER = re.compile(r" *FusionKYMC$")
+HELIX_TRAILER = re.compile(r" *Mini\]\n$")
+
+# Return the Document in the PRN file and the list of problems found in it.
+def load_prn(filename):
+    f = open(filename, "rb")
+    data = f.read()
+    f.close()
+
+    return parse_prn(data)
+
+# Return the Document in the PRN data and the list of problems, as strings,
+# found with its structure.
+def parse_prn(data):
+    parser = PrnParser(data)
+    parser.parse()
+    return parser.doc, parser.problems
+
+# Parses the PRN data into a Document.
+class PrnParser(object):
+    def __init__(self, data):
+        self.data = data
+        self.doc = Document("")
+        self.problems = []
+
+        # Last value set by each PCL command, by its group, parameter and
+        # command characters, such as "*pX".
+        self.pcl = {}
+
+        # Engraved rows of the raster being read, as (x, y, bits).
+        self.raster_rows = None
+        self.unpacked_bytes = None
+
+        # HPGL state. "points" is the cut being drawn.
+        self.hpgl_state = None
+        self.pen = None
+        self.points = None
+        self.points_state = None
+
+        self.saw_header = False
+        self.saw_footer = False
+
+    def addProblem(self, position, message):
+        self.problems.append("At byte %d: %s" % (position, message))
+
+    def parse(self):
+        data = self.data
+        position = 0
+        while position < len(data):
+            if data[position] != "\x1B":
+                next_position = data.find("\x1B", position)
+                if next_position == -1:
+                    next_position = len(data)
+                if not self.saw_footer:
+                    self.addProblem(position, "%d bytes outside of any command" %
+                            (next_position - position))
+                elif not (FUSION_TRAILER.match(data, position) or
+                        HELIX_TRAILER.match(data, position)):
+                    self.addProblem(position, "Padding after the job isn't spaces and a trailer")
+                position = next_position
+                continue
+
+            match = PCL_COMMAND.match(data, position)
+            if match is None:
+                self.addProblem(position, "Bad escape sequence %r" % data[position:position + 8])
+                position += 1
+                continue
+            position = match.end()
+
+            if match.group(4) is not None:
+                # Two-character escape. Reset may be followed by PJL.
+                if match.group(4) == "E":
+                    position = self.parsePjl(position)
+                else:
+                    self.addProblem(match.start(), "Unknown escape %r" % match.group(0))
+                continue
+
+            group, parameter = match.group(1), match.group(2)
+            for value, command in PCL_VALUE.findall(match.group(3)):
+                command = command.upper()
+                try:
+                    value = int(value) if value not in ("", "+", "-") else 0
+                except ValueError:
+                    value = int(float(value))
+                position = self.handlePcl(match.start(), position, group + parameter + command, value)
+
+        if not self.saw_header:
+            self.problems.insert(0, "No PJL header")
+        if not self.saw_footer:
+            self.addProblem(len(data), "No PJL footer")
+        if self.raster_rows is not None:
+            self.addProblem(len(data), "Raster isn't ended")
+            self.finishRaster()
+
+    # Handle the PCL command, which ends at "position", and return the
+    # position after any data that goes with it.
+    def handlePcl(self, start, position, command, value):
+        data = self.data
+
+        if command == "%X":
+            # Universal exit, followed by PJL.
+            position = self.parsePjl(position)
+        elif command == "%B":
+            if value == 1:
+                position = self.parseHpgl(position)
+            elif value != 0:
+                self.addProblem(start, "Unknown language switch %d" % value)
+        elif command == "*rA":
+            if self.raster_rows is not None:
+                self.addProblem(start, "Raster started inside a raster")
+                self.finishRaster()
+            self.raster_rows = []
+        elif command == "*rC":
+            if self.raster_rows is None:
+                self.addProblem(start, "Raster ended outside of a raster")
+            else:
+                self.finishRaster()
+        elif command == "*bA":
+            self.unpacked_bytes = value
+        elif command == "*bW":
+            row = data[position:position + value]
+            if len(row) < value:
+                self.addProblem(start, "Raster row has %d bytes, not %d" % (len(row), value))
+            position += len(row)
+            self.handleRow(start, row)
+        else:
+            self.pcl[command] = value
+            if command == "&uD" and value != self.doc.getResolution():
+                self.addProblem(start, "Resolution is %d, not %d" %
+                        (value, self.doc.getResolution()))
+            elif command == "*bM" and value not in (0, 1, 2):
+                self.addProblem(start, "Unknown raster compression %d" % value)
+
+        return position
+
+    # Parse the PJL lines starting at "position", if any, and return the
+    # position after them.
+    def parsePjl(self, position):
+        data = self.data
+        while data.startswith("@PJL", position):
+            end = data.find("\n", position)
+            end = len(data) if end == -1 else end + 1
+            self.handlePjl(position, data[position:end].strip())
+            position = end
+
+        return position
+
+    def handlePjl(self, position, line):
+        if line.startswith("@PJL JOB NAME="):
+            self.doc.title = line[len("@PJL JOB NAME="):]
+        elif line == "@PJL ENTER LANGUAGE=PCL":
+            if self.saw_header:
+                self.addProblem(position, "PJL header repeated")
+            self.saw_header = True
+        elif line == "@PJL EOJ":
+            if not self.saw_header:
+                self.addProblem(position, "PJL footer before the header")
+            self.saw_footer = True
+        else:
+            self.addProblem(position, "Unknown PJL line %r" % line)
+
+    def handleRow(self, position, row):
+        if self.raster_rows is None:
+            self.addProblem(position, "Raster row outside of a raster")
+            return
+        if self.unpacked_bytes is None:
+            self.addProblem(position, "Raster row without its unpacked size")
+            return
+
+        compression = self.pcl.get("*bM", 0)
+        if compression == 2:
+            row = decode_packbits(row)
+        elif compression == 1:
+            row = "".join([row[i + 1]*(ord(row[i]) + 1) for i in range(0, len(row) - 1, 2)])
+        if len(row) != self.unpacked_bytes:
+            self.addProblem(position, "Raster row unpacks to %d bytes, not %d" %
+                    (len(row), self.unpacked_bytes))
+            return
+
+        bits = np.unpackbits(np.frombuffer(row, dtype=np.uint8))
+        self.raster_rows.append((self.pcl.get("*pX", 0), self.pcl.get("*pY", 0), bits))
+        self.unpacked_bytes = None
+
+    # Add the rows read since the raster started to the document.
+    def finishRaster(self):
+        rows = self.raster_rows
+        self.raster_rows = None
+        if not rows:
+            return
+
+        left = min(x for x, y, bits in rows)
+        right = max(x + len(bits) for x, y, bits in rows)
+        top = min(y for x, y, bits in rows)
+        bottom = max(y for x, y, bits in rows) + 1
+        pixels = np.zeros((bottom - top, right - left), dtype=np.uint8)
+        for x, y, bits in rows:
+            pixels[y - top, x - left:x - left + len(bits)] |= bits*255
+
+        self.doc.addRaster(Raster(Image.fromarray(pixels), left, top,
+            self.pcl.get("&zS", 0), self.pcl.get("&yP", 0)))
+
+    # Parse the HPGL starting at "position" and return the position of the
+    # escape that ends it.
+    def parseHpgl(self, position):
+        data = self.data
+        end = data.find("\x1B", position)
+        if end == -1:
+            self.addProblem(position, "HPGL isn't ended")
+            end = len(data)
+
+        for match in re.finditer(r"[^;]+", data[position:end]):
+            command_start = position + match.start()
+            command = match.group(0).strip()
+
+            # The line type isn't terminated before the first pen up. See
+            # epilog.HPGL_LINE_TYPE.
+            if command.startswith(epilog.HPGL_LINE_TYPE) and command[2:3].isalpha():
+                command = command[2:]
+
+            self.handleHpgl(command_start, command[:2].upper(), command[2:])
+
+        self.finishCut()
+        return end
+
+    def handleHpgl(self, position, mnemonic, parameters):
+        if mnemonic in ("PU", "PD"):
+            try:
+                values = [int(value) for value in parameters.split(",")] if parameters else []
+            except ValueError:
+                self.addProblem(position, "Bad coordinates in %s%s" % (mnemonic, parameters))
+                return
+            if len(values) % 2 != 0:
+                self.addProblem(position, "Odd number of coordinates in %s" % mnemonic)
+                values = values[:-1]
+            points = zip(values[0::2], values[1::2])
+
+            if mnemonic == "PU":
+                # Moving to where the cut ends continues it, since cuts
+                # are split into spans that start where the last one ended.
+                if points and not (self.points and points == [self.points[-1]] and
+                        self.points_state == self.hpgl_state):
+                    self.finishCut()
+                if points:
+                    self.pen = points[-1]
+            else:
+                if self.hpgl_state is None or None in self.hpgl_state:
+                    self.addProblem(position, "Pen down before the power, speed and frequency are set")
+                if self.pen is None:
+                    self.addProblem(position, "Pen down before the first pen up")
+                    self.pen = (0, 0)
+                if self.points is None:
+                    self.points = [self.pen]
+                    self.points_state = self.hpgl_state
+                self.points.extend(points)
+                if points:
+                    self.pen = points[-1]
+        elif mnemonic == "IN":
+            self.finishCut()
+            self.hpgl_state = (None, None, None)
+            self.pen = None
+        elif mnemonic in ("YP", "ZS", "XR"):
+            if self.hpgl_state is None:
+                self.addProblem(position, "%s before IN" % mnemonic)
+                self.hpgl_state = (None, None, None)
+            try:
+                value = int(parameters)
+            except ValueError:
+                self.addProblem(position, "Bad value in %s%s" % (mnemonic, parameters))
+                return
+            state = list(self.hpgl_state)
+            state[("YP", "ZS", "XR").index(mnemonic)] = value
+            self.hpgl_state = tuple(state)
+        elif mnemonic not in ("XS", "XP", "LT"):
+            self.addProblem(position, "Unknown HPGL command %r" % (mnemonic + parameters))
+
+    # Add the cut being drawn to the document.
+    def finishCut(self):
+        points = self.points
+        self.points = None
+        if points is None:
+            return
+
+        power, speed, frequency = self.points_state or (None, None, None)
+        cut = Cut(speed, power, frequency)
+        cut.points = np.array(points, dtype=np.int64)
+        self.doc.addCut(cut)
+
+        # The bed is set in PCL before the HPGL.
+        width = self.pcl.get("*rS")
+        height = self.pcl.get("*rT")
+        if width is not None and height is not None:
+            low = cut.points.min(axis=0)
+            high = cut.points.max(axis=0)
+            if low.min() < 0 or high[0] > width or high[1] > height:
+                self.addProblem(len(self.data), "Cut %d goes outside the bed" %
+                        (len(self.doc.getCuts()) - 1))
+
+# Return the bytes of the TIFF PackBits data, as written by
+# epilog.compress_packbits().
+def decode_packbits(data):
+    parts = []
+    position = 0
+    while position < len(data):
+        count = ord(data[position])
+        position += 1
+        if count < 128:
+            parts.append(data[position:position + count + 1])
+            position += count + 1
+        elif count > 128:
+            parts.append(data[position:position + 1]*(257 - count))
+            position += 1
+
+    return "".join(parts)
+
+# How long a job takes on the cutter.
+class JobEstimate(object):
+    def __init__(self):
+        # Seconds.
+        self.cut_time = 0.0
+        self.travel_time = 0.0
+        self.raster_time = 0.0
+
+        # Inches, and counts.
+        self.cut_length = 0.0
+        self.travel_length = 0.0
+        self.cut_count = 0
+        self.segment_count = 0
+        self.raster_lines = 0
+
+    def getTotalTime(self):
+        return self.cut_time + self.travel_time + self.raster_time
+
+    def __str__(self):
+        return "%s (cutting %s for %.1f in in %d segments, moving %s for %.1f in, engraving %s for %d lines)" % (
+                format_duration(self.getTotalTime()),
+                format_duration(self.cut_time), self.cut_length, self.segment_count,
+                format_duration(self.travel_time), self.travel_length,
+                format_duration(self.raster_time), self.raster_lines)
+
+# Return the seconds as a string like "1h 2m 3s".
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%dh %dm %ds" % (seconds/3600, seconds/60 % 60, seconds % 60)
+    if seconds >= 60:
+        return "%dm %ds" % (seconds/60, seconds % 60)
+    return "%ds" % seconds
+
+# Return the array of the seconds it takes to go each of the array of
+# lengths (inches) at "speed" (inches per second), starting and ending at
+# rest.
+def get_move_times(lengths, speed):
+    # Length over which the head speeds up to "speed" and slows down again.
+    ramp = speed*speed/ACCELERATION_IN_PER_S2
+    return np.where(lengths >= ramp,
+            lengths/speed + speed/ACCELERATION_IN_PER_S2,
+            2*np.sqrt(lengths/ACCELERATION_IN_PER_S2))
+
+# Return the JobEstimate of the Document. Cuts are done after rasters, and
+# the head starts at the origin.
+def estimate_time(doc):
+    estimate = JobEstimate()
+    resolution = float(doc.getResolution())
+
+    if doc.getEnableEngraving():
+        for raster in doc.getRasters():
+            # Only the rows with something to engrave are scanned, from the
+            # first byte with something in it to the last.
+            rows, lefts, row_lengths = epilog.pack_raster_rows(raster.image)
+            row_lengths = row_lengths[row_lengths > 0]
+            speed = MAX_RASTER_SPEED_IN_PER_S*max(raster.speed, 1)/100.0
+            line_lengths = row_lengths*8/resolution + 2*RASTER_OVERSCAN_IN
+            estimate.raster_lines += len(row_lengths)
+            estimate.raster_time += (get_move_times(line_lengths, speed).sum() +
+                    len(row_lengths)*RASTER_TURNAROUND_S)
+
+    if doc.getEnableCut():
+        position = np.zeros(2)
+        for cut in doc.getCuts():
+            points = cut.getPointArray()/resolution
+            if len(points) == 0:
+                continue
+
+            travel = math.hypot(*(points[0] - position))
+            estimate.travel_length += travel
+            estimate.travel_time += get_move_times(np.array([travel]), TRAVEL_SPEED_IN_PER_S).sum()
+            position = points[-1]
+
+            lengths = np.sqrt(((points[1:] - points[:-1])**2).sum(axis=1))
+            speed = MAX_VECTOR_SPEED_IN_PER_S*max(cut.getSpeed(), 1)/100.0
+            estimate.cut_count += 1
+            estimate.segment_count += len(lengths)
+            estimate.cut_length += lengths.sum()
+            estimate.cut_time += get_move_times(lengths, speed).sum()
+
+    return estimate
+
+# Print the problems with and the estimated time of each PRN file.
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write("usage: python prnfile.py FILE.prn ...\n")
+        sys.exit(1)
+
+    for filename in sys.argv[1:]:
+        doc, problems = load_prn(filename)
+        print "%s: \"%s\", %d cuts, %d rasters." % (filename, doc.getTitle(),
+                len(doc.getCuts()), len(doc.getRasters()))
+        for problem in problems:
+            print "    " + problem
+        print "    Estimated time: %s." % estimate_time(doc)
+
+if __name__ == "__main__":
+    main()
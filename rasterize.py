@@ -0,0 +1,428 @@
+
+# Batch triangle rasterizer. Fills a coverage mask from whole arrays of
+# projected triangles at once, instead of one ImageDraw.polygon() call per
+# triangle.
+#
+# The coverage matches what ImageDraw.polygon(..., fill=c, outline=c) draws
+# for each triangle, pixel for pixel: vertices are truncated to integers,
+# each integer row between the top and bottom vertex is filled between the
+# edge crossings (computed in single precision and rounded inward by half a
+# pixel), and horizontal edges are drawn as lines.
+
+import numpy as np
+
+# Number of triangles processed at once. Bounds the size of the temporary
+# per-row arrays.
+CHUNK_SIZE = 64*1024
+
+# Side of the cells of fill_triangles_adaptive(), in pixels.
+CELL_SIZE = 8
+
+# Distance from the edges of the triangles, in pixels, within which
+# fill_triangles_adaptive() draws at full resolution. The full rasterizer
+# truncates vertices and rounds spans, which puts pixels up to about two
+# and a half pixels off the true edge. EDGE_MARGIN plus half of
+# EDGE_SAMPLE_SPACING must be at most CELL_SIZE.
+EDGE_MARGIN = 3
+EDGE_SAMPLE_SPACING = 4
+
+# Return a (height,width) boolean array of the pixels covered by any of the
+# triangles. "xs" and "ys" are raster coordinates of the vertices and
+# "faces" is an (M,3) array of indices into them. If "first_row" is given,
+# the array holds the rows of the image starting there. With "row_step",
+# only the middle row of each band of that many rows is drawn, and the
+# array has one row per band.
+def fill_triangles(xs, ys, faces, width, height, first_row=0, row_step=1):
+    # Truncate like PIL does.
+    ixs = np.asarray(xs).astype(np.int32)
+    iys = np.asarray(ys).astype(np.int32) - first_row
+    bands = (height - row_step//2 + row_step - 1)//row_step
+
+    # One extra column so the end-of-span markers of full rows have a place.
+    counts = np.zeros(bands*(width + 1), dtype=np.int32)
+
+    for start in range(0, len(faces), CHUNK_SIZE):
+        chunk = faces[start:start + CHUNK_SIZE]
+        _, rows, x0, x1 = get_clipped_spans(ixs[chunk], iys[chunk], width, height, row_step)
+        rows //= row_step
+
+        # Mark the start and just past the end of each span.
+        size = len(counts)
+        counts += np.bincount(rows*(width + 1) + x0, minlength=size).astype(np.int32)
+        counts -= np.bincount(rows*(width + 1) + x1 + 1, minlength=size).astype(np.int32)
+
+    # A pixel is covered if more spans have started than ended before it.
+    coverage = np.cumsum(counts.reshape(bands, width + 1), axis=1)[:,:width]
+
+    return coverage > 0
+
+# Same as fill_triangles(), but coarse to fine. The image is split into
+# CELL_SIZE*CELL_SIZE cells. Cells within EDGE_MARGIN pixels of an edge
+# that can be on the outline (see get_outline_edges()) are refined: only
+# the parts of spans that fall inside them are drawn, at full resolution,
+# into a buffer that holds just those cells. Every pixel of any other cell
+# is on or off alike, since no edge comes near enough for the rounding of
+# the full rasterizer to reach it, so those cells are drawn at one pixel
+# per cell, from the spans of the rows through their centers. The result
+# is the same as fill_triangles()'s, and the work follows the length of the
+# edges rather than the area of the shape.
+def fill_triangles_adaptive(xs, ys, faces, width, height, first_row=0):
+    size = CELL_SIZE
+    cols = (width + size - 1)//size
+    rows = (height + size - 1)//size
+
+    # Truncate like PIL does.
+    ixs = np.asarray(xs).astype(np.int32)
+    iys = np.asarray(ys).astype(np.int32) - first_row
+
+    refine = get_edge_cells(np.asarray(xs), np.asarray(ys) - first_row,
+            get_outline_edges(xs, ys, faces), cols, rows)
+
+    # Cells cut off by the edge of the image have no center pixel to go by.
+    if width % size != 0:
+        refine[:,-1] = True
+    if height % size != 0:
+        refine[-1,:] = True
+
+    cells = fill_cell_centers(ixs, iys, faces, width, height, cols, rows)
+
+    # Triangles whose bounds reach a refined cell, using a summed-area table
+    # of the refined cells.
+    fx = ixs[faces]
+    fy = iys[faces]
+    left = np.clip(fx.min(axis=1)//size, 0, cols)
+    right = np.clip(fx.max(axis=1)//size + 1, 0, cols)
+    top = np.clip(fy.min(axis=1)//size, 0, rows)
+    bottom = np.clip(fy.max(axis=1)//size + 1, 0, rows)
+    table = np.zeros((rows + 1, cols + 1), dtype=np.int32)
+    table[1:,1:] = refine.cumsum(axis=0).cumsum(axis=1)
+    count = table[bottom,right] - table[top,right] - table[bottom,left] + table[top,left]
+    tiles = fill_refined_cells(ixs, iys, faces[count > 0], width, height, refine)
+
+    # Spread the cells to their pixels and put the refined ones on top.
+    image = np.empty((rows, size, cols, size), dtype=bool)
+    image[...] = cells[:,np.newaxis,:,np.newaxis]
+    cell_rows, cell_cols = np.nonzero(refine)
+    image[cell_rows,:,cell_cols,:] = tiles
+
+    return image.reshape(rows*size, cols*size)[:height,:width]
+
+# Return the (rows,cols) boolean array of whether the center pixel of each
+# cell of fill_triangles_adaptive() is covered by the triangles, drawn at
+# one pixel per cell. "ixs" and "iys" are the truncated vertices.
+def fill_cell_centers(ixs, iys, faces, width, height, cols, rows):
+    size = CELL_SIZE
+    half = size//2
+    counts = np.zeros(rows*(cols + 1), dtype=np.int32)
+
+    for start in range(0, len(faces), CHUNK_SIZE):
+        chunk = faces[start:start + CHUNK_SIZE]
+        _, span_rows, x0, x1 = get_clipped_spans(ixs[chunk], iys[chunk], width, height, size)
+
+        # Cells whose center column is within each span.
+        c0 = (x0 - half + size - 1)//size
+        c1 = np.minimum((x1 - half)//size, cols - 1)
+        keep = c0 <= c1
+        span_rows = span_rows[keep]//size
+        c0 = c0[keep]
+        c1 = c1[keep]
+
+        total = len(counts)
+        counts += np.bincount(span_rows*(cols + 1) + c0, minlength=total).astype(np.int32)
+        counts -= np.bincount(span_rows*(cols + 1) + c1 + 1, minlength=total).astype(np.int32)
+
+    return np.cumsum(counts.reshape(rows, cols + 1), axis=1)[:,:cols] > 0
+
+# Return the (K,CELL_SIZE,CELL_SIZE) boolean array of the pixels covered by
+# the triangles in each of the K cells that are true in "refine", a
+# (rows,cols) array, in row-major order. Each row of pixels keeps only its
+# refined cells, side by side, so a span is cut down to those cells by
+# mapping its ends to the number of refined pixels to their left.
+def fill_refined_cells(ixs, iys, faces, width, height, refine):
+    size = CELL_SIZE
+    rows, cols = refine.shape
+
+    # Refined cells to the left of each cell, and whether each is refined,
+    # with an extra column for the end of full rows.
+    before = np.zeros((rows, cols + 1), dtype=np.int64)
+    before[:,1:] = refine.cumsum(axis=1)
+    refined = np.zeros((rows, cols + 1), dtype=bool)
+    refined[:,:cols] = refine
+
+    # Start of each pixel row in the buffer. Rows get one extra pixel for
+    # the end-of-span markers of full rows.
+    row_lengths = np.repeat(before[:,-1]*size + 1, size)
+    row_starts = np.cumsum(row_lengths) - row_lengths
+    counts = np.zeros(row_lengths.sum(), dtype=np.int32)
+
+    def position(span_rows, x):
+        cell_rows = span_rows//size
+        cell_cols = x//size
+        inside = np.where(refined[cell_rows,cell_cols], x % size, 0)
+        return row_starts[span_rows] + before[cell_rows,cell_cols]*size + inside
+
+    for start in range(0, len(faces), CHUNK_SIZE):
+        chunk = faces[start:start + CHUNK_SIZE]
+        _, span_rows, x0, x1 = get_clipped_spans(ixs[chunk], iys[chunk], width, height)
+
+        first = position(span_rows, x0)
+        last = position(span_rows, x1 + 1)
+        keep = first < last
+
+        total = len(counts)
+        counts += np.bincount(first[keep], minlength=total).astype(np.int32)
+        counts -= np.bincount(last[keep], minlength=total).astype(np.int32)
+
+    # Every span ends within its row, so one running sum covers all rows.
+    coverage = np.cumsum(counts) > 0
+
+    # Gather each cell's pixels from the rows it spans.
+    cell_rows, cell_cols = np.nonzero(refine)
+    offsets = np.arange(size)
+    pixel_rows = cell_rows[:,np.newaxis]*size + offsets
+    index = (row_starts[pixel_rows][:,:,np.newaxis] +
+            (before[cell_rows,cell_cols]*size)[:,np.newaxis,np.newaxis] + offsets)
+    return coverage[index]
+
+# Return the (E,2) array of the vertex indices of the edges of the faces
+# that can be on the outline of their rasterized union. An edge that's
+# shared by exactly two faces lying on opposite sides of it, with the
+# vertices truncated like the rasterizer does, is inside the union: the
+# spans of the two faces meet at it with no gap. All other edges are kept,
+# including those of unwelded meshes, which are only slower.
+def get_outline_edges(xs, ys, faces):
+    ixs = np.asarray(xs).astype(np.int64)
+    iys = np.asarray(ys).astype(np.int64)
+
+    # Each edge of each face, from its lower vertex index to its higher one,
+    # and the side of it that the face's third vertex is on.
+    edges = []
+    sides = []
+    for i in range(3):
+        a = faces[:,i]
+        b = faces[:,(i + 1) % 3]
+        c = faces[:,(i + 2) % 3]
+        low = np.minimum(a, b)
+        high = np.maximum(a, b)
+        side = ((ixs[high] - ixs[low])*(iys[c] - iys[low]) -
+                (iys[high] - iys[low])*(ixs[c] - ixs[low]))
+        edges.append(np.column_stack([low, high]))
+        sides.append(np.sign(side))
+    edges = np.concatenate(edges)
+    sides = np.concatenate(sides)
+
+    # Group the copies of each edge.
+    order = np.lexsort((edges[:,1], edges[:,0]))
+    edges = edges[order]
+    sides = sides[order]
+    starts = np.ones(len(edges), dtype=bool)
+    starts[1:] = (edges[1:] != edges[:-1]).any(axis=1)
+    first = np.flatnonzero(starts)
+    counts = np.diff(np.append(first, len(edges)))
+
+    inside = np.zeros(len(first), dtype=bool)
+    pairs = counts == 2
+    inside[pairs] = sides[first[pairs]]*sides[first[pairs] + 1] < 0
+
+    return edges[first[~inside]]
+
+# Return the (rows,cols) boolean array of the cells of fill_triangles_adaptive()
+# that have a pixel within EDGE_MARGIN pixels of any of the edges, an (E,2)
+# array of vertex indices. Points are taken along each edge at most
+# EDGE_SAMPLE_SPACING apart, and the cells at the corners, middles of the
+# sides and center of the square around each one are marked. The square
+# reaches far enough to cover the margin and the gap to the next point, and
+# is no wider than two cells, so those nine cells include every cell it
+# touches.
+def get_edge_cells(xs, ys, edges, cols, rows):
+    size = CELL_SIZE
+    reach = EDGE_MARGIN + EDGE_SAMPLE_SPACING/2.0
+    cells = np.zeros(rows*cols, dtype=bool)
+
+    for start in range(0, len(edges), CHUNK_SIZE):
+        chunk = edges[start:start + CHUNK_SIZE]
+        x0 = xs[chunk[:,0]]
+        y0 = ys[chunk[:,0]]
+        dx = xs[chunk[:,1]] - x0
+        dy = ys[chunk[:,1]] - y0
+
+        # Points at both ends and evenly between.
+        gaps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))/EDGE_SAMPLE_SPACING).astype(np.int64)
+        gaps = np.maximum(gaps, 1)
+        edge = np.repeat(np.arange(len(chunk)), gaps + 1)
+        t = (np.arange(len(edge)) - np.repeat(np.cumsum(gaps + 1) - gaps - 1, gaps + 1)
+                )/gaps[edge].astype(np.float64)
+        px = x0[edge] + t*dx[edge]
+        py = y0[edge] + t*dy[edge]
+
+        for ox in (-reach, 0, reach):
+            cx = np.floor((px + ox)/size).astype(np.int64)
+            for oy in (-reach, 0, reach):
+                cy = np.floor((py + oy)/size).astype(np.int64)
+                inside = (cx >= 0) & (cx < cols) & (cy >= 0) & (cy < rows)
+                cells[cy[inside]*cols + cx[inside]] = True
+
+    return cells.reshape(rows, cols)
+
+# Return a (height,width) array of the colors of the triangles, each pixel
+# taking the color of the triangle nearest to the viewer there, and 0 where
+# there is none. "depths" are the distances of the vertices from the viewer
+# and "colors" an array of one color per face.
+def fill_triangles_depth_tested(xs, ys, depths, faces, colors, width, height):
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+    ixs = xs.astype(np.int32)
+    iys = ys.astype(np.int32)
+
+    depth_buffer = np.full(height*width, np.inf)
+    color_buffer = np.zeros(height*width, dtype=np.uint8)
+
+    for start in range(0, len(faces), CHUNK_SIZE):
+        chunk = faces[start:start + CHUNK_SIZE]
+        face, rows, x0, x1 = get_clipped_spans(ixs[chunk], iys[chunk], width, height)
+
+        # Expand the spans to one fragment per pixel.
+        lengths = x1 - x0 + 1
+        span = np.repeat(np.arange(len(face)), lengths)
+        first_fragment = np.cumsum(lengths) - lengths
+        frag_x = x0[span] + np.arange(len(span)) - first_fragment[span]
+        frag_y = rows[span]
+        frag_face = face[span]
+
+        # Depth of each fragment at its pixel's center, from the plane of its face.
+        a, b, c, low, high = get_depth_planes(xs[chunk], ys[chunk], depths[chunk])
+        frag_depth = a[frag_face]*(frag_x + 0.5) + b[frag_face]*(frag_y + 0.5) + c[frag_face]
+        frag_depth = np.clip(frag_depth, low[frag_face], high[frag_face])
+
+        # Nearest fragment of each pixel in this chunk.
+        pixel = frag_y*width + frag_x
+        order = np.lexsort((frag_depth, pixel))
+        pixel = pixel[order]
+        nearest = np.ones(len(pixel), dtype=bool)
+        nearest[1:] = pixel[1:] != pixel[:-1]
+        pixel = pixel[nearest]
+        frag_depth = frag_depth[order][nearest]
+        frag_face = frag_face[order][nearest]
+
+        # Keep those nearer than what's already drawn.
+        closer = frag_depth < depth_buffer[pixel]
+        pixel = pixel[closer]
+        depth_buffer[pixel] = frag_depth[closer]
+        color_buffer[pixel] = colors[start + frag_face[closer]]
+
+    return color_buffer.reshape(height, width)
+
+# Return the coefficients (a,b,c) of the planes depth = a*x + b*y + c of
+# the triangles, and the lowest and highest depth of each. Triangles seen
+# edge-on get the average of their depths.
+def get_depth_planes(vx, vy, vd):
+    x1 = vx[:,1] - vx[:,0]
+    y1 = vy[:,1] - vy[:,0]
+    d1 = vd[:,1] - vd[:,0]
+    x2 = vx[:,2] - vx[:,0]
+    y2 = vy[:,2] - vy[:,0]
+    d2 = vd[:,2] - vd[:,0]
+
+    det = x1*y2 - x2*y1
+    flat = np.abs(det) < 1e-9
+    det[flat] = 1
+
+    a = np.where(flat, 0, (d1*y2 - d2*y1)/det)
+    b = np.where(flat, 0, (x1*d2 - x2*d1)/det)
+    c = np.where(flat, vd.mean(axis=1), vd[:,0] - a*vx[:,0] - b*vy[:,0])
+
+    return a, b, c, vd.min(axis=1), vd.max(axis=1)
+
+# Return the face indices, rows, first and last columns of the spans of
+# get_spans() that are within the image, clipped to it.
+def get_clipped_spans(vx, vy, width, height, row_step=1):
+    face, rows, x0, x1 = get_spans(vx, vy, row_step)
+
+    x0 = np.maximum(x0, 0)
+    x1 = np.minimum(x1, width - 1)
+    keep = (rows >= 0) & (rows < height) & (x0 <= x1)
+
+    return face[keep], rows[keep], x0[keep], x1[keep]
+
+# Return a (height,width) array of the fraction of each pixel covered by the
+# triangles, from 0 to 255. Pixels are split into factor*factor samples.
+# "first_row" is as for fill_triangles(). If "adaptive" is true the samples
+# are drawn by fill_triangles_adaptive().
+def fill_coverage(xs, ys, faces, width, height, factor, first_row=0, adaptive=False):
+    fill = fill_triangles_adaptive if adaptive else fill_triangles
+    samples = fill(np.asarray(xs)*factor, np.asarray(ys)*factor, faces,
+            width*factor, height*factor, first_row*factor)
+    counts = samples.reshape(height, factor, width, factor).sum(axis=3).sum(axis=1)
+
+    total = factor*factor
+    return ((counts*255 + total//2)//total).astype(np.uint8)
+
+# Given (M,3) arrays of the integer vertices of triangles, return the face
+# index, row, first and last column of every horizontal span that fills them.
+# With "row_step", only the middle row of each band of that many rows is
+# filled.
+def get_spans(vx, vy, row_step=1):
+    top = vy.min(axis=1)
+    bottom = vy.max(axis=1)
+
+    # First filled row of each triangle.
+    top = top + (row_step//2 - top) % row_step
+
+    # Expand to one entry per (triangle,row).
+    row_counts = np.maximum((bottom - top)//row_step + 1, 0)
+    face = np.repeat(np.arange(len(vx)), row_counts)
+    first_row_index = np.cumsum(row_counts) - row_counts
+    rows = top[face] + (np.arange(len(face)) - first_row_index[face])*row_step
+
+    # Lowest and highest crossing of the non-horizontal edges, in floats.
+    scan_min = np.full(len(face), np.inf, dtype=np.float32)
+    scan_max = np.full(len(face), -np.inf, dtype=np.float32)
+
+    # Extent of the horizontal edges.
+    line_min = np.full(len(face), np.iinfo(np.int32).max, dtype=np.int32)
+    line_max = np.full(len(face), np.iinfo(np.int32).min, dtype=np.int32)
+
+    for i in range(3):
+        # Edges go from each vertex to the next, same as PIL.
+        ex0 = vx[face,i]
+        ey0 = vy[face,i]
+        ex1 = vx[face,(i + 1) % 3]
+        ey1 = vy[face,(i + 1) % 3]
+        ymin = np.minimum(ey0, ey1)
+        ymax = np.maximum(ey0, ey1)
+
+        horizontal = ey0 == ey1
+        on_line = horizontal & (rows == ey0)
+        line_min[on_line] = np.minimum(line_min[on_line], np.minimum(ex0, ex1)[on_line])
+        line_max[on_line] = np.maximum(line_max[on_line], np.maximum(ex0, ex1)[on_line])
+
+        crossing = ~horizontal & (rows >= ymin) & (rows <= ymax)
+        dy = np.where(horizontal, 1, ey1 - ey0)[crossing].astype(np.float32)
+        dx = (ex1 - ex0)[crossing].astype(np.float32)/dy
+        x = (rows - ey0)[crossing].astype(np.float32)*dx + ex0[crossing].astype(np.float32)
+        scan_min[crossing] = np.minimum(scan_min[crossing], x)
+        scan_max[crossing] = np.maximum(scan_max[crossing], x)
+
+    # Round the crossings inward. A span narrower than a pixel can round to
+    # an inverted pair, which PIL draws swapped.
+    scanned = scan_min <= scan_max
+    first = round_up(scan_min[scanned])
+    last = round_down(scan_max[scanned])
+    x0 = line_min.copy()
+    x1 = line_max.copy()
+    x0[scanned] = np.minimum(x0[scanned], np.minimum(first, last))
+    x1[scanned] = np.maximum(x1[scanned], np.maximum(first, last))
+
+    # Every row should have a crossing or a horizontal edge, but don't trust it.
+    keep = x0 <= x1
+    return face[keep], rows[keep], x0[keep], x1[keep]
+
+# PIL's rounding of the left end of a span.
+def round_up(f):
+    half = np.float32(0.5)
+    return np.where(f >= 0, np.floor(f + half), -np.floor(np.abs(f) + half)).astype(np.int32)
+
+# PIL's rounding of the right end of a span.
+def round_down(f):
+    half = np.float32(0.5)
+    return np.where(f >= 0, np.ceil(f - half), -np.ceil(np.abs(f) - half)).astype(np.int32)
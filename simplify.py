@@ -0,0 +1,152 @@
+
+# Polyline simplification over coordinate arrays.
+
+import heapq
+
+import numpy as np
+
+# Return the sorted array of the indices of the points, an (N,2) array, that
+# Ramer-Douglas-Peucker keeps: the ends, and recursively the point farthest
+# from the line between the ends of each range if it's farther than
+# "epsilon". If the ends are the same point, distances are to that point.
+# http://en.wikipedia.org/wiki/Ramer%E2%80%93Douglas%E2%80%93Peucker_algorithm
+def get_rdp_indices(points, epsilon):
+    points = np.asarray(points, dtype=np.float64)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Ranges left to split, as (first, last) indices.
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2:
+            continue
+
+        inner = points[first + 1:last]
+        v1 = points[first]
+        v2 = points[last]
+        if (v1 == v2).all():
+            distances = np.sqrt(((inner - v1)**2).sum(axis=1))
+        else:
+            segment = v1 - v2
+            length = np.sqrt((segment*segment).sum())
+            normal = np.array([-segment[1], segment[0]])/length
+            distances = np.abs((inner[:,0] - v1[0])*normal[0] + (inner[:,1] - v1[1])*normal[1])
+
+        # The first of the farthest points.
+        index = np.argmax(distances)
+        if distances[index] > epsilon:
+            index += first + 1
+            keep[index] = True
+            ranges.append((first, index))
+            ranges.append((index, last))
+
+    return np.nonzero(keep)[0]
+
+# Return the sorted array of the indices of the points, an (N,2) array, that
+# Visvalingam-Whyatt keeps. Points are removed in order of the area of the
+# triangle they make with their neighbors, smallest first, until there are
+# at most "max_count" of them and all the triangles have at least
+# "min_area". The ends are always kept. Removing a point never makes its
+# neighbors' areas smaller than its own, so points are removed in order of
+# importance.
+# http://en.wikipedia.org/wiki/Visvalingam%E2%80%93Whyatt_algorithm
+def get_visvalingam_indices(points, max_count, min_area=0):
+    points = np.asarray(points, dtype=np.float64)
+    count = len(points)
+    if count <= 2:
+        return np.arange(count)
+
+    xs = points[:,0].tolist()
+    ys = points[:,1].tolist()
+    previous = range(-1, count - 1)
+    following = range(1, count + 1)
+    removed = [False]*count
+
+    def area(i):
+        a = previous[i]
+        b = following[i]
+        return abs((xs[a] - xs[i])*(ys[b] - ys[i]) - (xs[b] - xs[i])*(ys[a] - ys[i]))/2
+
+    # Heap of (area, index). Entries go stale when a neighbor is removed
+    # and are skipped.
+    areas = [0.0]*count
+    heap = []
+    for i in range(1, count - 1):
+        areas[i] = area(i)
+        heap.append((areas[i], i))
+    heapq.heapify(heap)
+
+    remaining = count
+    while heap:
+        smallest, i = heapq.heappop(heap)
+        if removed[i] or smallest != areas[i]:
+            continue
+        if remaining <= max_count and smallest >= min_area:
+            break
+
+        removed[i] = True
+        remaining -= 1
+        a = previous[i]
+        b = following[i]
+        following[a] = b
+        previous[b] = a
+
+        for neighbor in (a, b):
+            if 0 < neighbor < count - 1:
+                areas[neighbor] = max(area(neighbor), smallest)
+                heapq.heappush(heap, (areas[neighbor], neighbor))
+
+    return np.nonzero(~np.array(removed))[0]
+
+# Return the paths, lists of Vector2, simplified by Ramer-Douglas-Peucker
+# with "epsilon", or by Visvalingam-Whyatt to at most "max_count" vertices
+# and triangles of at least "min_area" if "max_count" is given.
+def simplify_paths(paths, epsilon, max_count=None, min_area=0):
+    simplified = []
+    for vertices in paths:
+        points = np.array([(v.x, v.y) for v in vertices])
+        if max_count is None:
+            indices = get_rdp_indices(points, epsilon)
+        else:
+            indices = get_visvalingam_indices(points, max_count, min_area)
+        simplified.append([vertices[i] for i in indices.tolist()])
+
+    return simplified
+
+# Return the paths, (N,2) arrays of coordinates in units of an output
+# device, truncated to whole units as (N,2) int arrays. Vertices that land
+# on the one before them, or on the straight line between their neighbors,
+# are removed since they don't change what's cut. Paths that shrink to a
+# point are dropped. Also returns the numbers of repeated vertices,
+# collinear vertices and paths that were removed.
+def quantize_paths(paths):
+    quantized = []
+    repeated_count = 0
+    collinear_count = 0
+    dropped_count = 0
+
+    for points in paths:
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2).astype(np.int64)
+
+        count = len(points)
+        if count > 1:
+            keep = np.ones(count, dtype=bool)
+            keep[1:] = (points[1:] != points[:-1]).any(axis=1)
+            points = points[keep]
+            repeated_count += count - len(points)
+        if len(points) < 2:
+            dropped_count += 1
+            continue
+
+        # Keep vertices where the path turns or goes back on itself. The
+        # ends are always kept.
+        deltas = points[1:] - points[:-1]
+        cross = deltas[:-1,0]*deltas[1:,1] - deltas[:-1,1]*deltas[1:,0]
+        dot = (deltas[:-1]*deltas[1:]).sum(axis=1)
+        keep = np.ones(len(points), dtype=bool)
+        keep[1:-1] = (cross != 0) | (dot < 0)
+        collinear_count += len(points) - keep.sum()
+        quantized.append(points[keep])
+
+    return quantized, repeated_count, collinear_count, dropped_count
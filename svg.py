@@ -0,0 +1,134 @@
+# Writing of SVG files from paths as they're made, with the output buffered
+# so that large files take few writes.
+
+import gzip
+import math
+
+import numpy as np
+
+import curves
+
+# Bytes of output to collect before writing them out.
+BUFFER_SIZE = 1024*1024
+
+# Writes paths (lists of Vector2 or curves.CurvePath objects) to an SVG
+# file. Coordinates are rounded to "decimals" places, and with "relative"
+# each point is written as the difference from the previous one, which is
+# shorter. The differences are of the rounded coordinates, so rounding
+# errors don't add up along a path.
+class SvgWriter(object):
+    def __init__(self, out, width, height, stroke, stroke_width, background,
+            decimals=3, relative=True):
+
+        self.out = out
+        self.decimals = decimals
+        self.relative = relative
+        self.buffer = []
+        self.buffer_size = 0
+
+        self.write("""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.0//EN"
+"http://www.w3.org/TR/2001/REC-SVG-20010904/DTD/svg10.dtd" [
+<!ENTITY ns_svg "http://www.w3.org/2000/svg">
+]>
+<svg xmlns="&ns_svg;" width="%d" height="%d" overflow="visible" style="background: %s">
+""" % (width, height, background))
+        self.style = 'fill="none" stroke="%s" stroke-width="%g"' % (stroke, stroke_width)
+
+    # Open "filename" for writing, compressed with gzip if it ends in ".svgz",
+    # and return the SvgWriter for it. The other parameters are as for the
+    # constructor.
+    @staticmethod
+    def open(filename, *args, **kwargs):
+        if filename.endswith(".svgz"):
+            out = gzip.open(filename, "wb", 3)
+        else:
+            out = open(filename, "wb")
+
+        return SvgWriter(out, *args, **kwargs)
+
+    def write(self, s):
+        self.buffer.append(s)
+        self.buffer_size += len(s)
+        if self.buffer_size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.out.write("".join(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def addPath(self, path):
+        if isinstance(path, curves.CurvePath):
+            self.write('<path %s d="%s"/>\n' % (self.style, self.getCurveData(path)))
+        elif self.relative:
+            self.write('<path %s d="%s"/>\n' % (self.style, self.getPolylineData(path)))
+        else:
+            points = self.round([(v.x, v.y) for v in path])
+            self.write('<polyline %s points="%s"/>\n' % (self.style, self.formatPairs(points)))
+
+    # Finish the file and close it.
+    def close(self):
+        self.write("</svg>\n")
+        self.flush()
+        self.out.close()
+
+    # Return the (N,2) array of the points rounded to integer multiples of
+    # the precision.
+    def round(self, points):
+        return np.rint(np.array(points, dtype=np.float64).reshape(-1, 2)*10**self.decimals).astype(np.int64)
+
+    # Return the rounded (N,2) points as "x,y x,y ...". All the numbers are
+    # formatted by one "%" operation, which is much faster than formatting
+    # them one by one. They're multiples of the precision, so "%g" with as
+    # many digits as the largest of them writes them exactly and without
+    # trailing zeros.
+    def formatPairs(self, points):
+        if len(points) == 0:
+            return ""
+
+        if self.decimals <= 0:
+            return " ".join(["%d,%d"]*len(points)) % tuple(points.ravel().tolist())
+
+        number = "%%.%dg" % len(str(np.abs(points).max()))
+        values = tuple((points.ravel()/float(10**self.decimals)).tolist())
+        return " ".join([number + "," + number]*len(points)) % values
+
+    # Return the path data of the list of Vector2.
+    def getPolylineData(self, path):
+        points = self.round([(v.x, v.y) for v in path])
+        closed = len(points) > 2 and (points[0] == points[-1]).all()
+        if closed:
+            points = points[:-1]
+
+        data = "M" + self.formatPairs(points[:1])
+        if len(points) > 1:
+            data += "l" + self.formatPairs(points[1:] - points[:-1])
+        if closed:
+            data += "z"
+        return data
+
+    # Return the path data of the curves.CurvePath.
+    def getCurveData(self, path):
+        previous = self.round([(path.start.x, path.start.y)])
+        start = path.start
+        parts = ["M" + self.formatPairs(previous)]
+        for segment in path.segments:
+            kind = segment[0]
+            end = self.round([(segment[-1].x, segment[-1].y)])
+            origin = previous if self.relative else 0
+            if kind == curves.LINE:
+                parts.append(("l" if self.relative else "L") + self.formatPairs(end - origin))
+            elif kind == curves.ARC:
+                center, sweep = segment[1], segment[2]
+                length = (start - center).length()
+                radius = self.formatPairs(self.round([(length, length)]))
+                parts.append("%s%s 0 %d,%d %s" % ("a" if self.relative else "A", radius,
+                    abs(sweep) > math.pi, sweep > 0, self.formatPairs(end - origin)))
+            else:
+                controls = self.round([(c.x, c.y) for c in segment[1:]])
+                parts.append(("c" if self.relative else "C") + self.formatPairs(controls - origin))
+            previous = end
+            start = segment[-1]
+
+        return " ".join(parts)